@@ -69,7 +69,13 @@ async def process_file_background(job_id: str, file_path: str, filename: str):
         job_manager.update_job(job_id, step=JobStep.CHUNKING, progress=30, message="Chunking content...")
         
         # Callback for granular progress from MalRag
-        async def rag_progress_callback(step_name: str):
+        async def rag_progress_callback(step_name: str, stats: dict = None):
+            # Stages overlap, so a finished stage only reports its throughput
+            if stats is not None:
+                logger.info(f"[Ingestion] Job {job_id} | File: {filename} | {step_name.upper()} done: {stats}")
+                job_manager.update_job(job_id, stats={step_name: stats})
+                return
+
             # Using standard logging format which is cleaner but still detailed
             logger.info(f"[Ingestion] Job {job_id} | File: {filename} | Step: {step_name.upper()}")
             
@@ -87,12 +93,18 @@ async def process_file_background(job_id: str, file_path: str, filename: str):
                 job_manager.update_job(job_id, step=JobStep.INDEXING, progress=90, message="Indexing into Vector DB...")
 
         logger.info(f"Starting ingestion pipeline for {filename} (Job {job_id})")
-        # Use ainsert directly since we are async here. 
-        # Note: We modified MalRag.ainsert to accept progress_callback
-        await rag.ainsert(content, progress_callback=rag_progress_callback)
+        # Keyed by filename: a re-upload of an edited file only re-extracts the
+        # chunks that changed and retracts the ones that are gone
+        report = await rag.aupdate_document(filename, content, progress_callback=rag_progress_callback)
+        if report["previous_doc_id"] is None and any(d["filename"] == filename for d in _load_documents()):
+            logger.warning(
+                f"{filename} was uploaded before, but MalRag has no earlier version under this name "
+                "(no doc_id recorded for it): the old version stays indexed until it is deleted"
+            )
+        job_manager.update_job(job_id, stats={"update": report, "summary_backlog": await rag.asummary_backlog()})
         
         job_manager.update_job(job_id, status=JobStatus.COMPLETED, step=JobStep.READY, progress=100, message="File processed and ready for chat.")
-        _save_document_record(filename)
+        _save_document_record(filename, doc_id=report["doc_id"])
         logger.info(f"Job {job_id} completed successfully. Document {filename} is ready for chat.")
         
     except Exception as e:
@@ -144,12 +156,19 @@ async def get_job_status(job_id: str):
     job = job_manager.get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+
+    # Descriptions are summarized in the background after ingestion, so a ready
+    # job can still have (shared) entities waiting for their summary
+    rag = get_rag_engine()
+    summary_backlog = await rag.asummary_backlog()
     
     return Response(
         status=job["status"],
         message=job["message"],
         job_id=job_id,
-        data=job # Return full job data including progress/step
+        # Return full job data including progress/step, and how deep the LLM
+        # queues are per priority class (queries vs ingestion vs summaries)
+        data={**job, "summary_backlog": summary_backlog, "llm_queues": rag.scheduler_stats()}
     )
 
 # --- Persistent Document Tracking ---
@@ -186,7 +205,35 @@ def _save_document_record(filename, doc_id=None):
     with open(DOCS_FILE, "w") as f:
         json.dump(docs, f, indent=2)
 
+async def backfill_document_index():
+    """Index the documents uploaded before MalRag kept its doc -> chunk index,
+    keyed by their recorded filenames, so re-uploads replace them and they can
+    be deleted."""
+    docs = _load_documents()
+    unknown = [d["filename"] for d in docs if not d.get("doc_id")]
+    if unknown:
+        logger.warning(f"No doc_id recorded for {unknown}: re-uploading them won't replace the old version")
+    report = await get_rag_engine().abackfill_document_index(
+        {d["filename"]: d["doc_id"] for d in docs if d.get("doc_id")}
+    )
+    logger.info(f"Document index backfill: {report}")
+
 @router.get("/documents", response_model=Response)
 async def list_documents():
     docs = _load_documents()
     return Response(status="success", data={"documents": docs})
+
+@router.delete("/documents/{doc_id}", response_model=Response)
+async def delete_document(doc_id: str):
+    rag = get_rag_engine()
+    try:
+        deleted = await rag.adelete_by_doc_id(doc_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    docs = [d for d in _load_documents() if d.get("doc_id") != doc_id]
+    with open(DOCS_FILE, "w") as f:
+        json.dump(docs, f, indent=2)
+    return Response(status="success", message=f"Document {doc_id} deleted")
@@ -1,16 +1,77 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
-import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.generativeai.types import file_types
+import asyncio
+import mimetypes
 import os
 import tempfile
 import shutil
 import logging
-import time
-from malrag.llm import gemini_key_manager
+from malrag.llm import (
+    gemini_content,
+    gemini_key_manager,
+    gemini_request,
+    gemini_text,
+    is_rate_limit_error,
+    provider_clients,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+async def _transcribe(tmp_path: str, api_key: str, attempt: int) -> str:
+    # uploads belong to the key's project, so the transcription has to run on
+    # the same key
+    files = provider_clients.gemini_files(api_key)
+    mime_type, _ = mimetypes.guess_type(tmp_path)
+    if mime_type is None:
+        raise ValueError(f"Unknown mime type for {tmp_path}")
+
+    # Upload to Gemini (the file client is sync, keep it off the event loop)
+    logger.info(f"Uploading audio file to Gemini (Attempt {attempt+1}, Key: ...{api_key[-4:]})...")
+    myfile = file_types.File(
+        await asyncio.to_thread(
+            files.create_file,
+            tmp_path,
+            mime_type=mime_type,
+            display_name=os.path.basename(tmp_path),
+        )
+    )
+    logger.info(f"File uploaded: {myfile.name}")
+
+    # Wait for file to be active
+    logger.info("Waiting for file to process...")
+    while myfile.state.name == "PROCESSING":
+        await asyncio.sleep(2)
+        myfile = file_types.File(await asyncio.to_thread(files.get_file, name=myfile.name))
+
+    if myfile.state.name != "ACTIVE":
+        raise ValueError(f"File {myfile.name} failed to process. State: {myfile.state.name}")
+
+    logger.info("File is ACTIVE. Requesting transcription...")
+
+    # Generate content
+    model_name = os.environ.get("LLM_MODEL", "gemini-2.5-flash")
+    request = gemini_request(
+        model_name,
+        [
+            gemini_content(
+                "user",
+                glm.Part(
+                    file_data=glm.FileData(mime_type=myfile.mime_type, file_uri=myfile.uri)
+                ),
+                "Transcribe this audio file exactly as spoken. Output only the text.",
+            )
+        ],
+    )
+    result = await provider_clients.gemini(api_key).generate_content(request)
+    usage = getattr(result, "usage_metadata", None)
+    if usage is not None and usage.total_token_count:
+        gemini_key_manager.charge(api_key, usage.total_token_count)
+    return gemini_text(result)
+
 @router.post("/transcribe")
 async def transcribe_audio(file: UploadFile = File(...)):
     try:
@@ -33,49 +94,23 @@ async def transcribe_audio(file: UploadFile = File(...)):
         text = None
         max_retries = 3
         
-        # Retry loop with key rotation
+        # Retry loop, every attempt on the best key of the dispatcher
         for attempt in range(max_retries):
+            api_key = None
             try:
-                api_key = gemini_key_manager.get_current_key()
-                if not api_key:
-                    raise ValueError("No Gemini API key available")
-                
-                genai.configure(api_key=api_key)
-                
-                # Upload to Gemini
-                logger.info(f"Uploading audio file to Gemini (Attempt {attempt+1})...")
-                myfile = genai.upload_file(tmp_path)
-                logger.info(f"File uploaded: {myfile.name}")
-                
-                # Wait for file to be active
-                logger.info("Waiting for file to process...")
-                while myfile.state.name == "PROCESSING":
-                    time.sleep(2)
-                    myfile = genai.get_file(myfile.name)
-                    
-                if myfile.state.name != "ACTIVE":
-                    raise ValueError(f"File {myfile.name} failed to process. State: {myfile.state.name}")
-                
-                logger.info("File is ACTIVE. Requesting transcription...")
-                
-                # Generate content
-                model_name = os.environ.get("LLM_MODEL", "gemini-2.5-flash")
-                model = genai.GenerativeModel(model_name)
-                
-                result = model.generate_content(
-                    [myfile, "Transcribe this audio file exactly as spoken. Output only the text."]
-                )
-                
-                text = result.text
+                async with gemini_key_manager.lease() as api_key:
+                    text = await _transcribe(tmp_path, api_key, attempt)
                 logger.info(f"Transcription successful. Length: {len(text)} chars")
                 break # Success
-                
+
             except Exception as e:
                 logger.error(f"Transcription failed with key ...{api_key[-4:] if api_key else 'None'}: {e}")
-                gemini_key_manager.rotate_key()
                 if attempt == max_retries - 1:
                     raise HTTPException(status_code=500, detail=f"Transcription failed after retries (File Size: {file_size} bytes): {str(e)}")
-                time.sleep(1) # wait a bit before retry
+                # a rate-limited key is cooling down and the next attempt
+                # gets another one
+                if not is_rate_limit_error(e):
+                    await asyncio.sleep(1) # wait a bit before retry
 
         return {"text": text}
             
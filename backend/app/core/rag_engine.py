@@ -72,6 +72,11 @@ def initialize_rag():
             max_token_size=8192,
             func=embedding_func_wrapper,
         ),
+        # ingestion savings that are off by default in the library
+        defer_summaries=True,
+        adaptive_gleaning=True,
+        near_duplicate_threshold=0.95,
+        min_chunk_information=0.25,
     )
 
     print("MalRag Engine Initialized.")
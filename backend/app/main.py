@@ -1,6 +1,9 @@
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 load_dotenv()
 
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .api.v1 import ingestion, chat
@@ -14,10 +17,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ingestion.backfill_document_index()
+    yield
+    # pooled LLM/embedding API clients keep connections open
+    from malrag.llm import provider_clients
+    await provider_clients.aclose()
+
 app = FastAPI(
     title="MalRag API",
     description="Backend API for MalRag RAG Pipeline",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS Configuration
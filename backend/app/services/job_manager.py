@@ -46,7 +46,7 @@ class JobManager:
         }
         return job_id
 
-    def update_job(self, job_id: str, status: Optional[JobStatus] = None, step: Optional[JobStep] = None, progress: Optional[int] = None, message: Optional[str] = None):
+    def update_job(self, job_id: str, status: Optional[JobStatus] = None, step: Optional[JobStep] = None, progress: Optional[int] = None, message: Optional[str] = None, stats: Optional[Dict[str, Any]] = None):
         if job_id not in self._jobs:
             return # Or raise error
         
@@ -59,6 +59,8 @@ class JobManager:
             job["progress"] = progress
         if message:
             job["message"] = message
+        if stats:
+            job.setdefault("stats", {}).update(stats)
         
         job["updated_at"] = time.time()
 
@@ -7,7 +7,13 @@ from .utils import EmbeddingFunc
 
 TextChunkSchema = TypedDict(
     "TextChunkSchema",
-    {"tokens": int, "content": str, "full_doc_id": str, "chunk_order_index": int},
+    {
+        "tokens": int,
+        "tokenizer": str,
+        "content": str,
+        "full_doc_id": str,
+        "chunk_order_index": int,
+    },
 )
 
 T = TypeVar("T")
@@ -60,6 +66,9 @@ class BaseVectorStorage(StorageNameSpace):
         """
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
 
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
@@ -83,6 +92,9 @@ class BaseKVStorage(Generic[T], StorageNameSpace):
     async def upsert(self, data: dict[str, T]):
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
     async def drop(self):
         raise NotImplementedError
 
@@ -124,8 +136,47 @@ class BaseGraphStorage(StorageNameSpace):
     ):
         raise NotImplementedError
 
+    async def node_ids(self) -> list[str]:
+        """Every node id in the graph."""
+        raise NotImplementedError
+
     async def delete_node(self, node_id: str):
         raise NotImplementedError
 
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        raise NotImplementedError
+
+    # Bulk API used by the merge stage: one call per batch instead of one per
+    # node or edge. These defaults loop over the single-item methods; remote
+    # backends override them to save round trips.
+
+    async def get_nodes(self, node_ids: list[str]) -> dict[str, dict]:
+        """The existing nodes among ``node_ids``, by id."""
+        nodes = {}
+        for node_id in node_ids:
+            node = await self.get_node(node_id)
+            if node is not None:
+                nodes[node_id] = node
+        return nodes
+
+    async def get_edges(
+        self, edges: list[tuple[str, str]]
+    ) -> dict[tuple[str, str], dict]:
+        """The existing edges among ``(source, target)`` pairs, by pair."""
+        found = {}
+        for source_node_id, target_node_id in edges:
+            edge = await self.get_edge(source_node_id, target_node_id)
+            if edge is not None:
+                found[(source_node_id, target_node_id)] = edge
+        return found
+
+    async def upsert_nodes(self, nodes: dict[str, dict[str, str]]):
+        for node_id, node_data in nodes.items():
+            await self.upsert_node(node_id, node_data)
+
+    async def upsert_edges(self, edges: dict[tuple[str, str], dict[str, str]]):
+        for (source_node_id, target_node_id), edge_data in edges.items():
+            await self.upsert_edge(source_node_id, target_node_id, edge_data)
+
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         raise NotImplementedError("Node embedding is not used in malrag.")
@@ -0,0 +1,39 @@
+import unicodedata
+
+# chunks of this many words or more are not penalized for their length
+_FULL_LENGTH_WORDS = 12
+
+
+def chunk_information_signals(text: str) -> dict:
+    """The cheap signals ``chunk_information_score`` combines, for one text.
+
+    - ``script_ratio``: letters (any script, vowel signs included) among the
+      non-space characters; low for table rules, symbols and OCR noise
+    - ``digit_density``: digits among the non-space characters
+    - ``unique_ratio``: distinct words among the words; low for repeated
+      headers and boilerplate
+    - ``words``: words split on whitespace, punctuation stripped
+    """
+    chars = [c for c in text if not c.isspace()]
+    letters = sum(1 for c in chars if unicodedata.category(c)[0] in ("L", "M"))
+    digits = sum(1 for c in chars if c.isdigit())
+    words = [w for w in (w.strip("\"'()[]{}.,;:!?|-–—*#") for w in text.split()) if w]
+    return {
+        "script_ratio": letters / len(chars) if chars else 0.0,
+        "digit_density": digits / len(chars) if chars else 0.0,
+        "unique_ratio": len({w.lower() for w in words}) / len(words) if words else 0.0,
+        "words": len(words),
+    }
+
+
+def chunk_information_score(text: str) -> float:
+    """0..1 estimate of how much a chunk has for entity extraction, without
+    any model: page headers, numeric tables, signature blocks and OCR noise
+    score low, prose (English or Malayalam) high."""
+    signals = chunk_information_signals(text)
+    return (
+        signals["script_ratio"]
+        * (1 - signals["digit_density"]) ** 2
+        * signals["unique_ratio"] ** 0.5
+        * min(1.0, signals["words"] / _FULL_LENGTH_WORDS)
+    )
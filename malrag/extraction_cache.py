@@ -0,0 +1,107 @@
+import json
+from typing import Optional
+
+from .base import BaseKVStorage
+from .prompt import PROMPTS
+from .utils import compute_args_hash, compute_mdhash_id, logger
+
+
+class ExtractionCache:
+    """Raw entity extraction output per chunk, kept in a KV namespace.
+
+    Entries are keyed by the chunk content hash, the extraction prompt hash,
+    the entity types, the gleaning settings and the model, never by chunk or
+    document ids, so a cache exported from one working directory is valid in
+    any other one (or storage backend) that extracts the same text the same
+    way. Changing the prompts, examples, entity types, language, gleaning or
+    model simply misses.
+    """
+
+    def __init__(self, kv_storage: BaseKVStorage):
+        self.kv_storage = kv_storage
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @staticmethod
+    def key(content: str, context_base: dict, global_config: dict) -> str:
+        prompt = "".join(
+            [
+                PROMPTS["entity_extraction"].format(**context_base, input_text=""),
+                PROMPTS["entiti_continue_extraction"],
+                PROMPTS["entiti_if_loop_extraction"],
+                PROMPTS["gleaning_decision"],
+            ]
+        )
+        llm_model_func = global_config["llm_model_func"]
+        model = (
+            getattr(llm_model_func, "__name__", type(llm_model_func).__name__),
+            global_config["llm_model_name"],
+        )
+        return compute_args_hash(
+            compute_mdhash_id(content),
+            compute_mdhash_id(prompt),
+            context_base["entity_types"],
+            (
+                global_config["entity_extract_max_gleaning"],
+                global_config.get("adaptive_gleaning", False)
+                and (
+                    global_config["gleaning_min_chunk_tokens"],
+                    global_config["gleaning_skip_yield"],
+                ),
+            ),
+            model,
+        )
+
+    async def get(
+        self, content: str, context_base: dict, global_config: dict
+    ) -> Optional[str]:
+        entry = await self.kv_storage.get_by_id(
+            self.key(content, context_base, global_config)
+        )
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["return"]
+
+    async def put(
+        self, content: str, final_result: str, context_base: dict, global_config: dict
+    ):
+        await self.kv_storage.upsert(
+            {self.key(content, context_base, global_config): {"return": final_result}}
+        )
+        self.writes += 1
+
+    async def stats(self) -> dict:
+        """Lookups since this process started and the number of stored entries."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(await self.kv_storage.all_keys()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    async def export(self, file_name: str) -> int:
+        """Write every entry to a JSON file; returns the number written."""
+        keys = await self.kv_storage.all_keys()
+        entries = dict(zip(keys, await self.kv_storage.get_by_ids(keys)))
+        with open(file_name, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        logger.info(f"Exported {len(entries)} extraction cache entries to {file_name}")
+        return len(entries)
+
+    async def load(self, file_name: str) -> int:
+        """Add the entries of an exported file that are not cached yet; returns
+        how many were added."""
+        with open(file_name, encoding="utf-8") as f:
+            entries = json.load(f)
+        new_keys = await self.kv_storage.filter_keys(list(entries))
+        await self.kv_storage.upsert({k: entries[k] for k in new_keys})
+        await self.kv_storage.index_done_callback()
+        logger.info(
+            f"Imported {len(new_keys)} extraction cache entries from {file_name}"
+        )
+        return len(new_keys)
@@ -0,0 +1,251 @@
+import asyncio
+import re
+import unicodedata
+from collections import deque
+from itertools import combinations
+from typing import Callable, Iterator, Optional
+
+from .base import BaseGraphStorage, TextChunkSchema
+from .prompt import GRAPH_FIELD_SEP
+from .utils import logger, split_string_by_multi_markers
+
+
+def _is_word_char(char: str) -> bool:
+    # vowel signs and viramas (Malayalam, Devanagari, ...) are marks, not
+    # letters, but never end a word
+    return char.isalnum() or char == "_" or unicodedata.category(char).startswith("M")
+
+
+def _normalize(name: str) -> str:
+    return " ".join(name.strip().strip('"').lower().split())
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over lowercased names: every occurrence of every
+    name in a text in one pass, however many names there are."""
+
+    def __init__(self):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[str]] = [[]]
+        self._built = True
+
+    def __len__(self):
+        return sum(len(out) for out in self._out)
+
+    def add(self, name: str):
+        state = 0
+        for char in name:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        if name not in self._out[state]:
+            self._out[state].append(name)
+        self._built = False
+
+    def _build(self):
+        # breadth first, so every failure link points to a state already done
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int, str]]:
+        """``(start, end, name)`` of every occurrence of a name in ``text``
+        (compared lowercased) that starts and ends on a word boundary."""
+        if not self._built:
+            self._build()
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # a few characters lowercase to several, keep the offsets right
+            lowered = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+        state = 0
+        for end, char in enumerate(lowered, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            match_state = state
+            while match_state:
+                for name in self._out[match_state]:
+                    start = end - len(name)
+                    if (start == 0 or not _is_word_char(text[start - 1])) and (
+                        end == len(text) or not _is_word_char(text[end])
+                    ):
+                        yield start, end, name
+                match_state = self._fail[match_state]
+
+
+_CAPITALIZED_RUN = re.compile(r"[A-Z][\w&'-]*(?:[ \t]+[A-Z][\w&'-]*)*")
+
+
+def capitalized_mentions(text: str) -> list[str]:
+    """Default mention finder: runs of capitalized words, except a single word
+    opening a sentence. Only meaningful for scripts with case; it finds nothing
+    in Malayalam text, plug an NER model in for that (``ner_model_func``)."""
+    mentions = []
+    for match in _CAPITALIZED_RUN.finditer(text):
+        mention = match.group(0)
+        if match.start() and _is_word_char(text[match.start() - 1]):
+            continue
+        before = text[: match.start()].rstrip()
+        if " " not in mention and (not before or before[-1] in ".!?:;\"'(\n"):
+            continue
+        mentions.append(mention)
+    return mentions
+
+
+class LocalEntityTagger:
+    """CPU-only first extraction tier.
+
+    Chunks are tagged with the graph's known entities (an Aho-Corasick matcher
+    over the node names) and with the mentions ``ner_func`` finds. When every
+    mention is a known entity, the chunk has nothing new for the LLM: ``extract``
+    returns its ``(nodes, edges)`` built from the tags, attaching the chunk to
+    the known entities and to the existing edges among them. Otherwise it
+    returns None and the chunk goes to the LLM.
+
+    The matcher is loaded from the graph on first use and grows with the
+    entities merged afterwards (``add``).
+    """
+
+    def __init__(
+        self,
+        knowledge_graph_inst: BaseGraphStorage,
+        ner_func: Optional[Callable[[str], list[str]]] = None,
+        min_name_length: int = 3,
+    ):
+        self.knowledge_graph_inst = knowledge_graph_inst
+        self.ner_func = ner_func or capitalized_mentions
+        self.min_name_length = min_name_length
+        self.matcher = AhoCorasick()
+        self._node_ids: dict[str, str] = {}
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.tagged = 0
+        self.passed = 0
+
+    def add(self, node_ids):
+        for node_id in node_ids:
+            name = _normalize(node_id)
+            if len(name) >= self.min_name_length and name not in self._node_ids:
+                self._node_ids[name] = node_id
+                self.matcher.add(name)
+
+    def reset(self):
+        """Forget the names, the next ``extract`` reloads them from the graph
+        (after entities were deleted)."""
+        self.matcher = AhoCorasick()
+        self._node_ids = {}
+        self._loaded = False
+
+    async def load(self):
+        async with self._load_lock:
+            if self._loaded:
+                return
+            self.add(await self.knowledge_graph_inst.node_ids())
+            self._loaded = True
+            logger.info(
+                f"Local entity tagger loaded {len(self._node_ids)} entity names"
+            )
+
+    def known_entities(self, text: str) -> list[str]:
+        """Ids of the known entities mentioned in ``text``, in order."""
+        return list(
+            dict.fromkeys(
+                self._node_ids[name] for _, _, name in self.matcher.iter_matches(text)
+            )
+        )
+
+    def _is_known(self, mention: str, known: list[str], text: str = "") -> bool:
+        """A known entity's name, or whole words of one found in the chunk
+        (``Kochi`` for ``KOCHI METRO``, but not ``Och``). Chunking can cut a
+        name, so a mention that ends ``text`` may end with the start of a word
+        and one that starts it with the end of one."""
+        cut_end = text.rstrip().endswith(mention)
+        cut_start = text.lstrip().startswith(mention)
+        mention = _normalize(mention)
+        if mention in self._node_ids:
+            return True
+        words = mention.split()
+        last = len(words) - 1
+
+        def _word_matches(j: int, name_word: str) -> bool:
+            word = words[j]
+            return (
+                word == name_word
+                or (j == last and cut_end and name_word.startswith(word))
+                or (j == 0 and cut_start and name_word.endswith(word))
+            )
+
+        for node_id in known:
+            name = _normalize(node_id).split()
+            for i in range(len(name) - len(words) + 1):
+                if all(_word_matches(j, name[i + j]) for j in range(len(words))):
+                    return True
+        return False
+
+    async def extract(
+        self, chunk_key: str, chunk_dp: TextChunkSchema
+    ) -> Optional[tuple[dict, dict]]:
+        await self.load()
+        content = chunk_dp["content"]
+        known = self.known_entities(content)
+        mentions = await asyncio.to_thread(self.ner_func, content) if known else []
+        # no mention at all says nothing (e.g. a script the finder can't read)
+        if not mentions or not all(self._is_known(m, known, content) for m in mentions):
+            self.passed += 1
+            return None
+
+        nodes = await self.knowledge_graph_inst.get_nodes(known)
+        if len(nodes) < len(known):
+            # deleted since it was added, the LLM has to decide on the chunk
+            self.passed += 1
+            return None
+        edges = await self.knowledge_graph_inst.get_edges(
+            [tuple(sorted(pair)) for pair in combinations(nodes, 2)]
+        )
+        maybe_nodes = {
+            node_id: [
+                dict(
+                    entity_name=node_id,
+                    entity_type=node["entity_type"],
+                    # only provenance: the merge skips empty descriptions, and
+                    # a rebuild after a deletion can't resurrect old ones
+                    description="",
+                    source_id=chunk_key,
+                )
+            ]
+            for node_id, node in nodes.items()
+        }
+        maybe_edges = {}
+        for (src_id, tgt_id), edge in edges.items():
+            n_sources = len(
+                split_string_by_multi_markers(edge["source_id"], [GRAPH_FIELD_SEP])
+            )
+            maybe_edges[(src_id, tgt_id)] = [
+                dict(
+                    src_id=src_id,
+                    tgt_id=tgt_id,
+                    # the edge's average weight per source chunk
+                    weight=float(edge["weight"]) / max(1, n_sources),
+                    description="",
+                    keywords="",
+                    source_id=chunk_key,
+                )
+            ]
+        self.tagged += 1
+        return maybe_nodes, maybe_edges
@@ -167,6 +167,15 @@ class ChromaVectorDBStorage(BaseVectorStorage):
             logger.error(f"Error during ChromaDB query: {str(e)}")
             raise
 
+    async def delete(self, ids: list[str]):
+        if not ids:
+            return
+        try:
+            self._collection.delete(ids=ids)
+        except Exception as e:
+            logger.error(f"Error during ChromaDB delete: {str(e)}")
+            raise
+
     async def index_done_callback(self):
         # ChromaDB handles persistence automatically
         pass
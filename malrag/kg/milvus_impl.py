@@ -74,6 +74,10 @@ class MilvusVectorDBStorge(BaseVectorStorage):
         results = self._client.upsert(collection_name=self.namespace, data=list_data)
         return results
 
+    async def delete(self, ids: list[str]):
+        if ids:
+            self._client.delete(collection_name=self.namespace, ids=ids)
+
     async def query(self, query, top_k=5):
         embedding = await self.embedding_func([query])
         results = self._client.search(
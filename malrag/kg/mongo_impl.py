@@ -26,13 +26,15 @@ class MongoKVStorage(BaseKVStorage):
 
     async def get_by_ids(self, ids, fields=None):
         if fields is None:
-            return list(self._data.find({"_id": {"$in": ids}}))
-        return list(
-            self._data.find(
+            found = self._data.find({"_id": {"$in": ids}})
+        else:
+            found = self._data.find(
                 {"_id": {"$in": ids}},
                 {field: 1 for field in fields},
             )
-        )
+        # in the order of ids, None for the missing ones, like JsonKVStorage
+        by_id = {x["_id"]: x for x in found}
+        return [by_id.get(id) for id in ids]
 
     async def filter_keys(self, data: list[str]) -> set[str]:
         existing_ids = [
@@ -46,6 +48,9 @@ class MongoKVStorage(BaseKVStorage):
             data[k]["_id"] = k
         return data
 
+    async def delete(self, ids: list[str]):
+        self._data.delete_many({"_id": {"$in": ids}})
+
     async def drop(self):
         """ """
         pass
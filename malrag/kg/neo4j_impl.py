@@ -35,6 +35,7 @@ class Neo4JStorage(BaseGraphStorage):
         )
         self._driver = None
         self._driver_lock = asyncio.Lock()
+        self._schema_ready = False
         URI = os.environ["NEO4J_URI"]
         USERNAME = os.environ["NEO4J_USERNAME"]
         PASSWORD = os.environ["NEO4J_PASSWORD"]
@@ -60,14 +61,48 @@ class Neo4JStorage(BaseGraphStorage):
     async def index_done_callback(self):
         print("KG successfully indexed.")
 
+    async def _ensure_schema(self):
+        """Index nodes by their ``entity_id`` property, once per storage.
+
+        Nodes are ``(:base {entity_id: <entity name>})`` so queries can take the
+        entity name as a parameter. Graphs written before that carried the name
+        only as the node's label; those nodes get the property here.
+        """
+        if self._schema_ready:
+            return
+        async with self._driver_lock:
+            if self._schema_ready:
+                return
+            async with self._driver.session() as session:
+                await (
+                    await session.run(
+                        "CREATE INDEX base_entity_id IF NOT EXISTS "
+                        "FOR (n:base) ON (n.entity_id)"
+                    )
+                ).consume()
+                summary = await (
+                    await session.run(
+                        "MATCH (n) WHERE n.entity_id IS NULL AND size(labels(n)) > 0 "
+                        "SET n:base, n.entity_id = labels(n)[0]"
+                    )
+                ).consume()
+                if summary.counters.properties_set:
+                    logger.warning(
+                        f"Neo4j: added entity_id to {summary.counters.properties_set} "
+                        "nodes that were only identified by their label"
+                    )
+            self._schema_ready = True
+
     async def has_node(self, node_id: str) -> bool:
+        await self._ensure_schema()
         entity_name_label = node_id.strip('"')
 
         async with self._driver.session() as session:
             query = (
-                f"MATCH (n:`{entity_name_label}`) RETURN count(n) > 0 AS node_exists"
+                "MATCH (n:base {entity_id: $entity_id}) "
+                "RETURN count(n) > 0 AS node_exists"
             )
-            result = await session.run(query)
+            result = await session.run(query, entity_id=entity_name_label)
             single_result = await result.single()
             logger.debug(
                 f'{inspect.currentframe().f_code.co_name}:query:{query}:result:{single_result["node_exists"]}'
@@ -75,15 +110,18 @@ class Neo4JStorage(BaseGraphStorage):
             return single_result["node_exists"]
 
     async def has_edge(self, source_node_id: str, target_node_id: str) -> bool:
+        await self._ensure_schema()
         entity_name_label_source = source_node_id.strip('"')
         entity_name_label_target = target_node_id.strip('"')
 
         async with self._driver.session() as session:
             query = (
-                f"MATCH (a:`{entity_name_label_source}`)-[r]-(b:`{entity_name_label_target}`) "
+                "MATCH (a:base {entity_id: $source})-[r]-(b:base {entity_id: $target}) "
                 "RETURN COUNT(r) > 0 AS edgeExists"
             )
-            result = await session.run(query)
+            result = await session.run(
+                query, source=entity_name_label_source, target=entity_name_label_target
+            )
             single_result = await result.single()
             logger.debug(
                 f'{inspect.currentframe().f_code.co_name}:query:{query}:result:{single_result["edgeExists"]}'
@@ -91,10 +129,11 @@ class Neo4JStorage(BaseGraphStorage):
             return single_result["edgeExists"]
 
     async def get_node(self, node_id: str) -> Union[dict, None]:
+        await self._ensure_schema()
         async with self._driver.session() as session:
             entity_name_label = node_id.strip('"')
-            query = f"MATCH (n:`{entity_name_label}`) RETURN n"
-            result = await session.run(query)
+            query = "MATCH (n:base {entity_id: $entity_id}) RETURN n"
+            result = await session.run(query, entity_id=entity_name_label)
             record = await result.single()
             if record:
                 node = record["n"]
@@ -106,14 +145,15 @@ class Neo4JStorage(BaseGraphStorage):
             return None
 
     async def node_degree(self, node_id: str) -> int:
+        await self._ensure_schema()
         entity_name_label = node_id.strip('"')
 
         async with self._driver.session() as session:
-            query = f"""
-                MATCH (n:`{entity_name_label}`)
-                RETURN COUNT{{ (n)--() }} AS totalEdgeCount
+            query = """
+                MATCH (n:base {entity_id: $entity_id})
+                RETURN COUNT { (n)--() } AS totalEdgeCount
             """
-            result = await session.run(query)
+            result = await session.run(query, entity_id=entity_name_label)
             record = await result.single()
             if record:
                 edge_count = record["totalEdgeCount"]
@@ -143,6 +183,7 @@ class Neo4JStorage(BaseGraphStorage):
     async def get_edge(
         self, source_node_id: str, target_node_id: str
     ) -> Union[dict, None]:
+        await self._ensure_schema()
         entity_name_label_source = source_node_id.strip('"')
         entity_name_label_target = target_node_id.strip('"')
         """
@@ -156,16 +197,15 @@ class Neo4JStorage(BaseGraphStorage):
             list: List of all relationships/edges found
         """
         async with self._driver.session() as session:
-            query = f"""
-            MATCH (start:`{entity_name_label_source}`)-[r]->(end:`{entity_name_label_target}`)
+            query = """
+            MATCH (start:base {entity_id: $source})-[r]->(end:base {entity_id: $target})
             RETURN properties(r) as edge_properties
             LIMIT 1
-            """.format(
-                entity_name_label_source=entity_name_label_source,
-                entity_name_label_target=entity_name_label_target,
-            )
+            """
 
-            result = await session.run(query)
+            result = await session.run(
+                query, source=entity_name_label_source, target=entity_name_label_target
+            )
             record = await result.single()
             if record:
                 result = dict(record["edge_properties"])
@@ -176,34 +216,29 @@ class Neo4JStorage(BaseGraphStorage):
             else:
                 return None
 
+    async def node_ids(self) -> List[str]:
+        await self._ensure_schema()
+        async with self._driver.session() as session:
+            result = await session.run("MATCH (n:base) RETURN n.entity_id AS entity_id")
+            return [record["entity_id"] async for record in result]
+
     async def get_node_edges(self, source_node_id: str) -> List[Tuple[str, str]]:
+        await self._ensure_schema()
         node_label = source_node_id.strip('"')
 
         """
-        Retrieves all edges (relationships) for a particular node identified by its label.
-        :return: List of dictionaries containing edge information
+        Retrieves all edges (relationships) for a particular node identified by its entity_id.
+        :return: List of (source, target) entity ids
         """
-        query = f"""MATCH (n:`{node_label}`)
-                OPTIONAL MATCH (n)-[r]-(connected)
-                RETURN n, r, connected"""
+        query = """MATCH (n:base {entity_id: $entity_id})
+                OPTIONAL MATCH (n)-[r]-(connected:base)
+                RETURN n.entity_id AS source, connected.entity_id AS target"""
         async with self._driver.session() as session:
-            results = await session.run(query)
+            results = await session.run(query, entity_id=node_label)
             edges = []
             async for record in results:
-                source_node = record["n"]
-                connected_node = record["connected"]
-
-                source_label = (
-                    list(source_node.labels)[0] if source_node.labels else None
-                )
-                target_label = (
-                    list(connected_node.labels)[0]
-                    if connected_node and connected_node.labels
-                    else None
-                )
-
-                if source_label and target_label:
-                    edges.append((source_label, target_label))
+                if record["source"] and record["target"]:
+                    edges.append((record["source"], record["target"]))
 
             return edges
 
@@ -224,20 +259,21 @@ class Neo4JStorage(BaseGraphStorage):
         Upsert a node in the Neo4j database.
 
         Args:
-            node_id: The unique identifier for the node (used as label)
+            node_id: The unique identifier for the node (stored as entity_id)
             node_data: Dictionary of node properties
         """
+        await self._ensure_schema()
         label = node_id.strip('"')
         properties = node_data
 
         async def _do_upsert(tx: AsyncManagedTransaction):
-            query = f"""
-            MERGE (n:`{label}`)
+            query = """
+            MERGE (n:base {entity_id: $entity_id})
             SET n += $properties
             """
-            await tx.run(query, properties=properties)
+            await tx.run(query, entity_id=label, properties=properties)
             logger.debug(
-                f"Upserted node with label '{label}' and properties: {properties}"
+                f"Upserted node with entity_id '{label}' and properties: {properties}"
             )
 
         try:
@@ -262,27 +298,33 @@ class Neo4JStorage(BaseGraphStorage):
         self, source_node_id: str, target_node_id: str, edge_data: Dict[str, Any]
     ):
         """
-        Upsert an edge and its properties between two nodes identified by their labels.
+        Upsert an edge and its properties between two nodes identified by their entity_id.
 
         Args:
-            source_node_id (str): Label of the source node (used as identifier)
-            target_node_id (str): Label of the target node (used as identifier)
+            source_node_id (str): entity_id of the source node
+            target_node_id (str): entity_id of the target node
             edge_data (dict): Dictionary of properties to set on the edge
         """
+        await self._ensure_schema()
         source_node_label = source_node_id.strip('"')
         target_node_label = target_node_id.strip('"')
         edge_properties = edge_data
 
         async def _do_upsert_edge(tx: AsyncManagedTransaction):
-            query = f"""
-            MATCH (source:`{source_node_label}`)
+            query = """
+            MATCH (source:base {entity_id: $source})
             WITH source
-            MATCH (target:`{target_node_label}`)
+            MATCH (target:base {entity_id: $target})
             MERGE (source)-[r:DIRECTED]->(target)
             SET r += $properties
             RETURN r
             """
-            await tx.run(query, properties=edge_properties)
+            await tx.run(
+                query,
+                source=source_node_label,
+                target=target_node_label,
+                properties=edge_properties,
+            )
             logger.debug(
                 f"Upserted edge from '{source_node_label}' to '{target_node_label}' with properties: {edge_properties}"
             )
@@ -294,5 +336,186 @@ class Neo4JStorage(BaseGraphStorage):
             logger.error(f"Error during edge upsert: {str(e)}")
             raise
 
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def delete_node(self, node_id: str):
+        """Delete a node along with its edges."""
+        await self._ensure_schema()
+        label = node_id.strip('"')
+
+        async def _do_delete(tx: AsyncManagedTransaction):
+            await tx.run(
+                "MATCH (n:base {entity_id: $entity_id}) DETACH DELETE n",
+                entity_id=label,
+            )
+
+        async with self._driver.session() as session:
+            await session.execute_write(_do_delete)
+        logger.debug(f"Deleted node with entity_id '{label}'")
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        """Delete the edges between two nodes, in either direction."""
+        await self._ensure_schema()
+        source_node_label = source_node_id.strip('"')
+        target_node_label = target_node_id.strip('"')
+
+        async def _do_delete_edge(tx: AsyncManagedTransaction):
+            await tx.run(
+                "MATCH (:base {entity_id: $source})-[r]-(:base {entity_id: $target}) "
+                "DELETE r",
+                source=source_node_label,
+                target=target_node_label,
+            )
+
+        async with self._driver.session() as session:
+            await session.execute_write(_do_delete_edge)
+        logger.debug(
+            f"Deleted edge between '{source_node_label}' and '{target_node_label}'"
+        )
+
+    async def get_nodes(self, node_ids: List[str]) -> Dict[str, dict]:
+        """Fetch many nodes with a single query."""
+        if not node_ids:
+            return {}
+        await self._ensure_schema()
+        ids = {node_id.strip('"'): node_id for node_id in node_ids}
+        query = """
+        UNWIND $ids AS id
+        MATCH (n:base {entity_id: id})
+        RETURN id, n
+        """
+        nodes = {}
+        async with self._driver.session() as session:
+            result = await session.run(query, ids=list(ids))
+            async for record in result:
+                nodes.setdefault(ids[record["id"]], dict(record["n"]))
+        return nodes
+
+    async def get_edges(
+        self, edges: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], dict]:
+        """Fetch many directed edges with a single query."""
+        if not edges:
+            return {}
+        await self._ensure_schema()
+        pairs = {(s.strip('"'), t.strip('"')): (s, t) for s, t in edges}
+        query = """
+        UNWIND $pairs AS pair
+        MATCH (:base {entity_id: pair.source})-[r]->(:base {entity_id: pair.target})
+        RETURN pair.source AS source, pair.target AS target,
+               properties(r) AS edge_properties
+        """
+        found = {}
+        async with self._driver.session() as session:
+            result = await session.run(
+                query, pairs=[{"source": s, "target": t} for s, t in pairs]
+            )
+            async for record in result:
+                found.setdefault(
+                    pairs[(record["source"], record["target"])],
+                    dict(record["edge_properties"]),
+                )
+        return found
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def upsert_nodes(self, nodes: Dict[str, Dict[str, Any]]):
+        """Upsert many nodes with a single query."""
+        if not nodes:
+            return
+        await self._ensure_schema()
+        rows = [
+            {"entity_id": node_id.strip('"'), "properties": properties}
+            for node_id, properties in nodes.items()
+        ]
+
+        async def _do_upsert(tx: AsyncManagedTransaction):
+            query = """
+            UNWIND $rows AS row
+            MERGE (n:base {entity_id: row.entity_id})
+            SET n += row.properties
+            """
+            await tx.run(query, rows=rows)
+
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_upsert)
+            logger.debug(f"Upserted {len(nodes)} nodes")
+        except Exception as e:
+            logger.error(f"Error during bulk upsert: {str(e)}")
+            raise
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def upsert_edges(self, edges: Dict[Tuple[str, str], Dict[str, Any]]):
+        """Upsert many edges with a single query."""
+        if not edges:
+            return
+        await self._ensure_schema()
+        rows = [
+            {
+                "source": source_node_id.strip('"'),
+                "target": target_node_id.strip('"'),
+                "properties": properties,
+            }
+            for (source_node_id, target_node_id), properties in edges.items()
+        ]
+
+        async def _do_upsert_edges(tx: AsyncManagedTransaction):
+            query = """
+            UNWIND $rows AS row
+            MATCH (source:base {entity_id: row.source})
+            MATCH (target:base {entity_id: row.target})
+            MERGE (source)-[r:DIRECTED]->(target)
+            SET r += row.properties
+            """
+            await tx.run(query, rows=rows)
+
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_upsert_edges)
+            logger.debug(f"Upserted {len(edges)} edges")
+        except Exception as e:
+            logger.error(f"Error during bulk edge upsert: {str(e)}")
+            raise
+
     async def _node2vec_embed(self):
         print("Implemented but never called.")
@@ -1,4 +1,5 @@
 import asyncio
+import json
 
 # import html
 # import os
@@ -163,6 +164,20 @@ class OracleDB:
             print(data)
             raise
 
+    async def executemany(self, sql: str, data: list[dict]):
+        """Run one statement for many rows of binds, in a single round trip."""
+        try:
+            async with self.pool.acquire() as connection:
+                connection.inputtypehandler = self.input_type_handler
+                connection.outputtypehandler = self.output_type_handler
+                with connection.cursor() as cursor:
+                    await cursor.executemany(sql, data)
+                    await connection.commit()
+        except Exception as e:
+            logger.error(f"Oracle database error: {e}")
+            print(sql)
+            raise
+
 
 @dataclass
 class OracleKVStorage(BaseKVStorage):
@@ -170,11 +185,31 @@ class OracleKVStorage(BaseKVStorage):
     def __post_init__(self):
         self._data = {}
         self._max_batch_size = self.global_config["embedding_batch_num"]
+        # full docs and chunks have their own tables, the other namespaces
+        # (caches, checkpoints, document bookkeeping) are JSON rows of MALRAG_KV_STORE
+        self._generic = self.namespace not in N_T
+
+    def _params(self, **params) -> dict:
+        params["workspace"] = self.db.workspace
+        if self._generic:
+            params["namespace"] = self.namespace
+        return params
 
     ################ QUERY METHODS ################
 
+    async def all_keys(self) -> list[str]:
+        if self._generic:
+            SQL = SQL_TEMPLATES["all_keys_kv"]
+        else:
+            SQL = SQL_TEMPLATES["all_keys"].format(table_name=N_T[self.namespace])
+        res = await self.db.query(SQL, self._params(), multirows=True)
+        return [row["id"] for row in res]
+
     async def get_by_id(self, id: str) -> Union[dict, None]:
         """根据 id 获取 doc_full 数据."""
+        if self._generic:
+            res = await self.db.query(SQL_TEMPLATES["get_by_id_kv"], self._params(id=id))
+            return json.loads(res["data"]) if res else None
         SQL = SQL_TEMPLATES["get_by_id_" + self.namespace]
         params = {"workspace": self.db.workspace, "id": id}
         # print("get_by_id:"+SQL)
@@ -187,46 +222,53 @@ class OracleKVStorage(BaseKVStorage):
             return None
 
     # Query by id
-    async def get_by_ids(self, ids: list[str], fields=None) -> Union[list[dict], None]:
-        """根据 id 获取 doc_chunks 数据"""
-        SQL = SQL_TEMPLATES["get_by_ids_" + self.namespace].format(
-            ids=",".join([f"'{id}'" for id in ids])
-        )
-        params = {"workspace": self.db.workspace}
-        # print("get_by_ids:"+SQL)
-        # print(params)
-        res = await self.db.query(SQL, params, multirows=True)
-        if res:
-            data = res  # [{"data":i} for i in res]
-            # print(data)
-            return data
-        else:
-            return None
+    async def get_by_ids(self, ids: list[str], fields=None) -> list[Union[dict, None]]:
+        """根据 id 获取 doc_chunks 数据, in the order of ``ids`` (None: missing)"""
+        if not ids:
+            return []
+        res = []
+        for placeholders, params in _id_binds(ids):
+            if self._generic:
+                SQL = SQL_TEMPLATES["get_by_ids_kv"].format(ids=placeholders)
+            else:
+                SQL = SQL_TEMPLATES["get_by_ids_" + self.namespace].format(
+                    ids=placeholders
+                )
+            res += await self.db.query(SQL, self._params(**params), multirows=True)
+        rows = {
+            row["id"]: json.loads(row["data"]) if self._generic else row for row in res
+        }
+        if fields is not None:
+            rows = {k: {f: v for f, v in row.items() if f in fields} for k, row in rows.items()}
+        return [rows.get(id) for id in ids]
 
     async def filter_keys(self, keys: list[str]) -> set[str]:
         """过滤掉重复内容"""
-        SQL = SQL_TEMPLATES["filter_keys"].format(
-            table_name=N_T[self.namespace], ids=",".join([f"'{id}'" for id in keys])
-        )
-        params = {"workspace": self.db.workspace}
-        try:
-            await self.db.query(SQL, params)
-        except Exception as e:
-            logger.error(f"Oracle database error: {e}")
-            print(SQL)
-            print(params)
-        res = await self.db.query(SQL, params, multirows=True)
-        data = None
-        if res:
-            exist_keys = [key["id"] for key in res]
-            data = set([s for s in keys if s not in exist_keys])
-        else:
-            exist_keys = []
-            data = set([s for s in keys if s not in exist_keys])
-        return data
+        if not keys:
+            return set()
+        exist_keys = set()
+        for placeholders, params in _id_binds(keys):
+            if self._generic:
+                SQL = SQL_TEMPLATES["filter_keys_kv"].format(ids=placeholders)
+            else:
+                SQL = SQL_TEMPLATES["filter_keys"].format(
+                    table_name=N_T[self.namespace], ids=placeholders
+                )
+            res = await self.db.query(SQL, self._params(**params), multirows=True)
+            exist_keys.update(key["id"] for key in res)
+        return set([s for s in keys if s not in exist_keys])
 
     ################ INSERT METHODS ################
     async def upsert(self, data: dict[str, dict]):
+        if self._generic:
+            new_keys = await self.filter_keys(list(data))
+            left_data = {k: v for k, v in data.items() if k in new_keys}
+            for k, v in left_data.items():
+                await self.db.execute(
+                    SQL_TEMPLATES["merge_kv"],
+                    self._params(id=k, data=json.dumps(v, ensure_ascii=False)),
+                )
+            return left_data
         left_data = {k: v for k, v in data.items() if k not in self._data}
         self._data.update(left_data)
         # print(self._data)
@@ -280,6 +322,20 @@ class OracleKVStorage(BaseKVStorage):
                 await self.db.execute(merge_sql, data)
         return left_data
 
+    async def delete(self, ids: list[str]):
+        if not ids:
+            return
+        for id in ids:
+            self._data.pop(id, None)
+        for placeholders, params in _id_binds(ids):
+            if self._generic:
+                SQL = SQL_TEMPLATES["delete_kv"].format(ids=placeholders)
+            else:
+                SQL = SQL_TEMPLATES["delete"].format(
+                    table_name=N_T[self.namespace], ids=placeholders
+                )
+            await self.db.execute(SQL, self._params(**params))
+
     async def index_done_callback(self):
         if self.namespace in ["full_docs", "text_chunks"]:
             logger.info("full doc and chunk data had been saved into oracle db!")
@@ -321,6 +377,11 @@ class OracleVectorDBStorage(BaseVectorStorage):
         # print("vector search result:",results)
         return results
 
+    async def delete(self, ids: list[str]):
+        """The vectors are columns of the chunk, node and edge rows, which
+        OracleKVStorage and OracleGraphStorage delete."""
+        pass
+
 
 @dataclass
 class OracleGraphStorage(BaseGraphStorage):
@@ -408,6 +469,82 @@ class OracleGraphStorage(BaseGraphStorage):
         await self.db.execute(merge_sql, data)
         # self._graph.add_edge(source_node_id, target_node_id, **edge_data)
 
+    async def _embed(self, contents: list[str]) -> np.ndarray:
+        batches = [
+            contents[i : i + self._max_batch_size]
+            for i in range(0, len(contents), self._max_batch_size)
+        ]
+        embeddings_list = await asyncio.gather(
+            *[self.embedding_func(batch) for batch in batches]
+        )
+        return np.concatenate(embeddings_list)
+
+    async def upsert_nodes(self, nodes: dict[str, dict[str, str]]):
+        """批量插入或更新节点"""
+        if not nodes:
+            return
+        contents = [
+            node_id + node_data["description"] for node_id, node_data in nodes.items()
+        ]
+        embeddings = await self._embed(contents)
+        data = [
+            {
+                "workspace": self.db.workspace,
+                "name": node_id,
+                "entity_type": node_data["entity_type"],
+                "description": node_data["description"],
+                "source_chunk_id": node_data["source_id"],
+                "content": content,
+                "content_vector": content_vector,
+            }
+            for (node_id, node_data), content, content_vector in zip(
+                nodes.items(), contents, embeddings
+            )
+        ]
+        await self.db.executemany(SQL_TEMPLATES["merge_node"], data)
+
+    async def upsert_edges(self, edges: dict[tuple[str, str], dict[str, str]]):
+        """批量插入或更新边"""
+        if not edges:
+            return
+        contents = [
+            edge_data["keywords"] + source_name + target_name + edge_data["description"]
+            for (source_name, target_name), edge_data in edges.items()
+        ]
+        embeddings = await self._embed(contents)
+        data = [
+            {
+                "workspace": self.db.workspace,
+                "source_name": source_name,
+                "target_name": target_name,
+                "weight": edge_data["weight"],
+                "keywords": edge_data["keywords"],
+                "description": edge_data["description"],
+                "source_chunk_id": edge_data["source_id"],
+                "content": content,
+                "content_vector": content_vector,
+            }
+            for ((source_name, target_name), edge_data), content, content_vector in zip(
+                edges.items(), contents, embeddings
+            )
+        ]
+        await self.db.executemany(SQL_TEMPLATES["merge_edge"], data)
+
+    async def delete_node(self, node_id: str):
+        """删除节点及其所有边"""
+        params = {"workspace": self.db.workspace, "node_id": node_id}
+        await self.db.execute(SQL_TEMPLATES["delete_node_edges"], params)
+        await self.db.execute(SQL_TEMPLATES["delete_node"], params)
+
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        """删除两个节点之间的边(两个方向)"""
+        params = {
+            "workspace": self.db.workspace,
+            "source_node_id": source_node_id,
+            "target_node_id": target_node_id,
+        }
+        await self.db.execute(SQL_TEMPLATES["delete_edge"], params)
+
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         """为节点生成向量"""
         if algorithm not in self._node_embed_algorithms:
@@ -515,6 +652,33 @@ class OracleGraphStorage(BaseGraphStorage):
             # print("Edge not exist!",self.db.workspace, source_node_id, target_node_id)
             return None
 
+    async def get_nodes(self, node_ids: list[str]) -> dict[str, dict]:
+        """批量获取节点数据, 每个节点取最新的一行"""
+        nodes = {}
+        for placeholders, params in _id_binds(node_ids):
+            SQL = SQL_TEMPLATES["get_nodes"].format(ids=placeholders)
+            params["workspace"] = self.db.workspace
+            for row in await self.db.query(SQL, params, multirows=True):
+                nodes.setdefault(row["name"], row)
+        return nodes
+
+    async def get_edges(
+        self, edges: list[tuple[str, str]]
+    ) -> dict[tuple[str, str], dict]:
+        """批量获取边数据, 每条边取最新的一行"""
+        found = {}
+        for start in range(0, len(edges), 500):
+            params = {"workspace": self.db.workspace}
+            pairs = []
+            for i, (source, target) in enumerate(edges[start : start + 500]):
+                params[f"s{i}"], params[f"t{i}"] = source, target
+                pairs.append(f"(:s{i},:t{i})")
+            SQL = SQL_TEMPLATES["get_edges"].format(pairs=",".join(pairs))
+            for row in await self.db.query(SQL, params, multirows=True):
+                key = (row.pop("source_name"), row.pop("target_name"))
+                found.setdefault(key, row)
+        return found
+
     async def get_node_edges(self, source_node_id: str):
         """根据节点id获取节点的所有边"""
         if await self.has_node(source_node_id):
@@ -529,6 +693,13 @@ class OracleGraphStorage(BaseGraphStorage):
                 # print("Node Edge not exist!",self.db.workspace, source_node_id)
                 return []
 
+    async def node_ids(self) -> list[str]:
+        """查询所有节点名"""
+        SQL = SQL_TEMPLATES["node_ids"]
+        params = {"workspace": self.db.workspace}
+        res = await self.db.query(sql=SQL, params=params, multirows=True)
+        return [row["name"] for row in res]
+
     async def get_all_nodes(self, limit: int):
         """查询所有节点"""
         SQL = SQL_TEMPLATES["get_all_nodes"]
@@ -553,6 +724,16 @@ class OracleGraphStorage(BaseGraphStorage):
             return res
 
 
+def _id_binds(ids: list[str], batch_size: int = 500):
+    """Named bind placeholders for an ``IN ({ids})`` list, and their values.
+
+    Yields one pair per batch: Oracle refuses lists of more than 1000 expressions.
+    """
+    for start in range(0, len(ids), batch_size):
+        params = {f"id{i}": id for i, id in enumerate(ids[start : start + batch_size])}
+        yield ",".join(f":{name}" for name in params), params
+
+
 N_T = {
     "full_docs": "MALRAG_DOC_FULL",
     "text_chunks": "MALRAG_DOC_CHUNKS",
@@ -626,6 +807,17 @@ TABLES = {
                     updatetime TIMESTAMP DEFAULT NULL
                     )"""
     },
+    "MALRAG_KV_STORE": {
+        "ddl": """CREATE TABLE MALRAG_KV_STORE (
+                    id varchar(256),
+                    namespace varchar(64),
+                    workspace varchar(256),
+                    data CLOB,
+                    createtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updatetime TIMESTAMP DEFAULT NULL,
+                    PRIMARY KEY (workspace, namespace, id)
+                    )"""
+    },
     "MALRAG_GRAPH": {
         "ddl": """CREATE OR REPLACE PROPERTY GRAPH malrag_graph
                 VERTEX TABLES (
@@ -651,6 +843,20 @@ SQL_TEMPLATES = {
     "get_by_ids_full_docs": "select ID,NVL(content,'') as content from MALRAG_DOC_FULL where workspace=:workspace and ID in ({ids})",
     "get_by_ids_text_chunks": "select ID,TOKENS,NVL(content,'') as content,CHUNK_ORDER_INDEX,FULL_DOC_ID  from MALRAG_DOC_CHUNKS where workspace=:workspace and ID in ({ids})",
     "filter_keys": "select id from {table_name} where workspace=:workspace and id in ({ids})",
+    "all_keys": "select id from {table_name} where workspace=:workspace",
+    "delete": "delete from {table_name} where workspace=:workspace and id in ({ids})",
+    # the other KV namespaces, one JSON document per key
+    "get_by_id_kv": "select id,data from MALRAG_KV_STORE where workspace=:workspace and namespace=:namespace and id=:id",
+    "get_by_ids_kv": "select id,data from MALRAG_KV_STORE where workspace=:workspace and namespace=:namespace and id in ({ids})",
+    "filter_keys_kv": "select id from MALRAG_KV_STORE where workspace=:workspace and namespace=:namespace and id in ({ids})",
+    "all_keys_kv": "select id from MALRAG_KV_STORE where workspace=:workspace and namespace=:namespace",
+    "delete_kv": "delete from MALRAG_KV_STORE where workspace=:workspace and namespace=:namespace and id in ({ids})",
+    "merge_kv": """MERGE INTO MALRAG_KV_STORE a
+                    USING DUAL
+                    ON (a.workspace = :workspace and a.namespace = :namespace and a.id = :id)
+                    WHEN NOT MATCHED THEN
+                    INSERT(id,namespace,workspace,data) values(:id,:namespace,:workspace,:data)
+                    """,
     "merge_doc_full": """ MERGE INTO MALRAG_DOC_FULL a
                     USING DUAL
                     ON (a.id = :check_id)
@@ -706,6 +912,15 @@ SQL_TEMPLATES = {
         AND a.name=:source_node_id and b.name = :target_node_id
         COLUMNS (e.id,a.name as source_id)
         ) t1 JOIN MALRAG_GRAPH_EDGES t2 on t1.id=t2.id""",
+    "get_nodes": """SELECT name,entity_type,source_chunk_id as source_id,NVL(description,'') AS description
+        FROM MALRAG_GRAPH_NODES
+        WHERE workspace=:workspace AND name IN ({ids})
+        ORDER BY id DESC""",
+    "get_edges": """SELECT source_name,target_name,weight,source_chunk_id as source_id,
+        NVL(description,'') AS description,NVL(keywords,'') AS keywords
+        FROM MALRAG_GRAPH_EDGES
+        WHERE workspace=:workspace AND (source_name,target_name) IN ({pairs})
+        ORDER BY id DESC""",
     "get_node_edges": """SELECT source_name,target_name
             FROM GRAPH_TABLE (malrag_graph
             MATCH (a)-[e]->(b)
@@ -724,6 +939,14 @@ SQL_TEMPLATES = {
                 WHEN NOT MATCHED THEN
                     INSERT(workspace,source_name,target_name,weight,keywords,description,source_chunk_id,content,content_vector)
                     values (:workspace,:source_name,:target_name,:weight,:keywords,:description,:source_chunk_id,:content,:content_vector) """,
+    "delete_node": "delete from MALRAG_GRAPH_NODES where workspace=:workspace and name=:node_id",
+    "delete_node_edges": """delete from MALRAG_GRAPH_EDGES
+        where workspace=:workspace and (source_name=:node_id or target_name=:node_id)""",
+    "delete_edge": """delete from MALRAG_GRAPH_EDGES
+        where workspace=:workspace
+        and ((source_name=:source_node_id and target_name=:target_node_id)
+        or (source_name=:target_node_id and target_name=:source_node_id))""",
+    "node_ids": "select distinct name from MALRAG_GRAPH_NODES where workspace=:workspace",
     "get_all_nodes": """WITH t0 AS (
                         SELECT name AS id, entity_type AS label, entity_type, description,
                             '["' || replace(source_chunk_id, '<SEP>', '","') || '"]'     source_chunk_ids
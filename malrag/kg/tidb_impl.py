@@ -1,4 +1,5 @@
 import asyncio
+import json
 import os
 from dataclasses import dataclass
 from typing import Union
@@ -97,11 +98,32 @@ class TiDBKVStorage(BaseKVStorage):
     def __post_init__(self):
         self._data = {}
         self._max_batch_size = self.global_config["embedding_batch_num"]
+        # full docs and chunks have their own tables, the other namespaces
+        # (caches, checkpoints, document bookkeeping) are JSON rows of MALRAG_KV_STORE
+        self._generic = self.namespace not in N_T
+
+    def _sql(self, name: str, **fields) -> str:
+        if self._generic:
+            return SQL_TEMPLATES[f"{name}_kv"].format(**fields)
+        return SQL_TEMPLATES[name].format(
+            table_name=N_T[self.namespace], id_field=N_ID[self.namespace], **fields
+        )
 
     ################ QUERY METHODS ################
 
+    async def all_keys(self) -> list[str]:
+        res = await self.db.query(
+            self._sql("all_keys"), {"namespace": self.namespace}, multirows=True
+        )
+        return [row["id"] for row in res]
+
     async def get_by_id(self, id: str) -> Union[dict, None]:
         """根据 id 获取 doc_full 数据."""
+        if self._generic:
+            res = await self.db.query(
+                SQL_TEMPLATES["get_by_id_kv"], {"id": id, "namespace": self.namespace}
+            )
+            return json.loads(res["data"]) if res else None
         SQL = SQL_TEMPLATES["get_by_id_" + self.namespace]
         params = {"id": id}
         # print("get_by_id:"+SQL)
@@ -114,43 +136,57 @@ class TiDBKVStorage(BaseKVStorage):
             return None
 
     # Query by id
-    async def get_by_ids(self, ids: list[str], fields=None) -> Union[list[dict], None]:
-        """根据 id 获取 doc_chunks 数据"""
-        SQL = SQL_TEMPLATES["get_by_ids_" + self.namespace].format(
-            ids=",".join([f"'{id}'" for id in ids])
-        )
-        # print("get_by_ids:"+SQL)
-        res = await self.db.query(SQL, multirows=True)
-        if res:
-            data = res  # [{"data":i} for i in res]
-            # print(data)
-            return data
+    async def get_by_ids(self, ids: list[str], fields=None) -> list[Union[dict, None]]:
+        """根据 id 获取 doc_chunks 数据, in the order of ``ids`` (None: missing)"""
+        if not ids:
+            return []
+        placeholders, params = _id_binds(ids)
+        if self._generic:
+            SQL = SQL_TEMPLATES["get_by_ids_kv"].format(ids=placeholders)
         else:
-            return None
+            SQL = SQL_TEMPLATES["get_by_ids_" + self.namespace].format(ids=placeholders)
+        res = await self.db.query(
+            SQL, {**params, "namespace": self.namespace}, multirows=True
+        )
+        rows = {
+            row["id"]: json.loads(row["data"]) if self._generic else row for row in res
+        }
+        if fields is not None:
+            rows = {k: {f: v for f, v in row.items() if f in fields} for k, row in rows.items()}
+        return [rows.get(id) for id in ids]
 
     async def filter_keys(self, keys: list[str]) -> set[str]:
         """过滤掉重复内容"""
-        SQL = SQL_TEMPLATES["filter_keys"].format(
-            table_name=N_T[self.namespace],
-            id_field=N_ID[self.namespace],
-            ids=",".join([f"'{id}'" for id in keys]),
+        if not keys:
+            return set()
+        placeholders, params = _id_binds(keys)
+        res = await self.db.query(
+            self._sql("filter_keys", ids=placeholders),
+            {**params, "namespace": self.namespace},
+            multirows=True,
         )
-        try:
-            await self.db.query(SQL)
-        except Exception as e:
-            logger.error(f"Tidb database error: {e}")
-            print(SQL)
-        res = await self.db.query(SQL, multirows=True)
-        if res:
-            exist_keys = [key["id"] for key in res]
-            data = set([s for s in keys if s not in exist_keys])
-        else:
-            exist_keys = []
-            data = set([s for s in keys if s not in exist_keys])
-        return data
+        exist_keys = {key["id"] for key in res}
+        return set([s for s in keys if s not in exist_keys])
 
     ################ INSERT full_doc AND chunks ################
     async def upsert(self, data: dict[str, dict]):
+        if self._generic:
+            new_keys = await self.filter_keys(list(data))
+            left_data = {k: v for k, v in data.items() if k in new_keys}
+            if left_data:
+                await self.db.execute(
+                    SQL_TEMPLATES["upsert_kv"],
+                    [
+                        {
+                            "id": k,
+                            "namespace": self.namespace,
+                            "data": json.dumps(v, ensure_ascii=False),
+                            "workspace": self.db.workspace,
+                        }
+                        for k, v in left_data.items()
+                    ],
+                )
+            return left_data
         left_data = {k: v for k, v in data.items() if k not in self._data}
         self._data.update(left_data)
         if self.namespace == "text_chunks":
@@ -203,6 +239,17 @@ class TiDBKVStorage(BaseKVStorage):
             await self.db.execute(merge_sql, data)
         return left_data
 
+    async def delete(self, ids: list[str]):
+        if not ids:
+            return
+        for id in ids:
+            self._data.pop(id, None)
+        placeholders, params = _id_binds(ids)
+        await self.db.execute(
+            self._sql("delete", ids=placeholders),
+            {**params, "namespace": self.namespace, "workspace": self.db.workspace},
+        )
+
     async def index_done_callback(self):
         if self.namespace in ["full_docs", "text_chunks"]:
             logger.info("full doc and chunk data had been saved into TiDB db!")
@@ -310,6 +357,22 @@ class TiDBVectorDBStorage(BaseVectorStorage):
                 )
             await self.db.execute(merge_sql, data)
 
+    async def delete(self, ids: list[str]):
+        # chunk rows belong to TiDBKVStorage, which deletes them
+        if not ids or self.namespace == "chunks":
+            return
+        placeholders, params = _id_binds(ids)
+        SQL = SQL_TEMPLATES["delete"].format(
+            table_name=N_T[self.namespace], id_field=N_ID[self.namespace], ids=placeholders
+        )
+        await self.db.execute(SQL, {**params, "workspace": self.db.workspace})
+
+
+def _id_binds(ids: list[str]) -> tuple[str, dict]:
+    """Named bind placeholders for an ``IN ({ids})`` list, and their values."""
+    params = {f"id{i}": id for i, id in enumerate(ids)}
+    return ",".join(f":{name}" for name in params), params
+
 
 N_T = {
     "full_docs": "MALRAG_DOC_FULL",
@@ -389,6 +452,20 @@ TABLES = {
         );
         """
     },
+    "MALRAG_KV_STORE": {
+        "ddl": """
+        CREATE TABLE MALRAG_KV_STORE (
+            `id` BIGINT PRIMARY KEY AUTO_RANDOM,
+            `kv_id` VARCHAR(256) NOT NULL,
+            `namespace` VARCHAR(64) NOT NULL,
+            `workspace` varchar(256),
+            `data` LONGTEXT,
+            `createtime` DATETIME DEFAULT CURRENT_TIMESTAMP,
+            `updatetime` DATETIME DEFAULT NULL,
+            UNIQUE KEY (`workspace`, `namespace`, `kv_id`)
+        );
+        """
+    },
     "MALRAG_LLM_CACHE": {
         "ddl": """
         CREATE TABLE MALRAG_LLM_CACHE (
@@ -411,6 +488,19 @@ SQL_TEMPLATES = {
     "get_by_ids_full_docs": "SELECT doc_id as id, IFNULL(content, '') AS content FROM MALRAG_DOC_FULL WHERE doc_id IN ({ids}) AND workspace = :workspace",
     "get_by_ids_text_chunks": "SELECT chunk_id as id, tokens, IFNULL(content, '') AS content, chunk_order_index, full_doc_id FROM MALRAG_DOC_CHUNKS WHERE chunk_id IN ({ids}) AND workspace = :workspace",
     "filter_keys": "SELECT {id_field} AS id FROM {table_name} WHERE {id_field} IN ({ids}) AND workspace = :workspace",
+    "all_keys": "SELECT {id_field} AS id FROM {table_name} WHERE workspace = :workspace",
+    "delete": "DELETE FROM {table_name} WHERE {id_field} IN ({ids}) AND workspace = :workspace",
+    # the other KV namespaces, one JSON document per key
+    "get_by_id_kv": "SELECT kv_id AS id, data FROM MALRAG_KV_STORE WHERE kv_id = :id AND namespace = :namespace AND workspace = :workspace",
+    "get_by_ids_kv": "SELECT kv_id AS id, data FROM MALRAG_KV_STORE WHERE kv_id IN ({ids}) AND namespace = :namespace AND workspace = :workspace",
+    "filter_keys_kv": "SELECT kv_id AS id FROM MALRAG_KV_STORE WHERE kv_id IN ({ids}) AND namespace = :namespace AND workspace = :workspace",
+    "all_keys_kv": "SELECT kv_id AS id FROM MALRAG_KV_STORE WHERE namespace = :namespace AND workspace = :workspace",
+    "delete_kv": "DELETE FROM MALRAG_KV_STORE WHERE kv_id IN ({ids}) AND namespace = :namespace AND workspace = :workspace",
+    "upsert_kv": """
+        INSERT INTO MALRAG_KV_STORE (kv_id, namespace, data, workspace)
+        VALUES (:id, :namespace, :data, :workspace)
+        ON DUPLICATE KEY UPDATE data = VALUES(data), updatetime = CURRENT_TIMESTAMP
+        """,
     # SQL for Merge operations (TiDB version with INSERT ... ON DUPLICATE KEY UPDATE)
     "upsert_doc_full": """
         INSERT INTO MALRAG_DOC_FULL (doc_id, content, workspace)
@@ -2,13 +2,20 @@ import base64
 import copy
 import json
 import os
+import random
 import re
 import struct
+import time
 import asyncio
+import inspect
+from collections import Counter
+from contextlib import asynccontextmanager
 from functools import lru_cache
 from typing import List, Dict, Callable, Any, Union, Optional
 import aioboto3
 import aiohttp
+import google.ai.generativelanguage as glm
+import httpx
 import numpy as np
 import ollama
 import torch
@@ -18,7 +25,9 @@ from openai import (
     RateLimitError,
     Timeout,
     AsyncAzureOpenAI,
+    DefaultAsyncHttpxClient,
 )
+from google.api_core import exceptions as google_exceptions
 from pydantic import BaseModel, Field
 from tenacity import (
     retry,
@@ -28,7 +37,10 @@ from tenacity import (
 )
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
+from .tokenizer import GeminiEstimateTokenizer
 from .utils import (
+    ConcurrencyLimiter,
+    ReleasingStream,
     wrap_embedding_func_with_attrs,
     locate_json_string_body_from_string,
     safe_unicode_decode,
@@ -45,6 +57,171 @@ else:
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
+async def _close_client(client):
+    if hasattr(client, "transport"):  # google api clients
+        result = client.transport.close()
+        if inspect.isawaitable(result):
+            await result
+        return
+    if isinstance(getattr(client, "_client", None), httpx.AsyncClient):  # ollama
+        await client._client.aclose()
+        return
+    close = getattr(client, "close", None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+
+class ProviderClientRegistry:
+    """Long-lived provider clients, one per ``(provider, base_url, api_key)``,
+    so calls share connection pools (keep-alive, no TLS handshake per call)
+    instead of building a client each time.
+
+    ``configure`` sets the connection limits and timeout of the clients made
+    afterwards. Async clients belong to the event loop they were made in (their
+    connections do), so a call from another loop (e.g. a later
+    ``asyncio.run``) gets a new one. ``aclose`` closes the clients of the
+    running loop; call it on shutdown.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 600.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self._clients: dict[tuple, tuple[asyncio.AbstractEventLoop, Any]] = {}
+        self.created = Counter()
+        self.reused = Counter()
+
+    def configure(self, **limits):
+        for name, value in limits.items():
+            if name.startswith("_") or not hasattr(self, name):
+                raise ValueError(f"Unknown client setting {name}")
+            setattr(self, name, value)
+
+    def _get(self, key: tuple, factory: Callable[[], Any]):
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(key)
+        if entry is not None and entry[0] is loop:
+            self.reused[key[0]] += 1
+            return entry[1]
+        client = factory()
+        self._clients[key] = (loop, client)
+        self.created[key[0]] += 1
+        return client
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def openai(self, base_url: str = None, api_key: str = None) -> AsyncOpenAI:
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        return self._get(
+            ("openai", base_url, api_key),
+            lambda: AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=self._limits(), timeout=self.timeout
+                ),
+            ),
+        )
+
+    def azure_openai(
+        self, base_url: str, api_key: str, api_version: str
+    ) -> AsyncAzureOpenAI:
+        return self._get(
+            ("azure_openai", base_url, api_key, api_version),
+            lambda: AsyncAzureOpenAI(
+                azure_endpoint=base_url,
+                api_key=api_key,
+                api_version=api_version,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=self._limits(), timeout=self.timeout
+                ),
+            ),
+        )
+
+    def ollama(self, host: str = None, **kwargs) -> ollama.AsyncClient:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return self._get(
+            ("ollama", host, repr(sorted(kwargs.items()))),
+            lambda: ollama.AsyncClient(host=host, limits=self._limits(), **kwargs),
+        )
+
+    def http_session(self) -> aiohttp.ClientSession:
+        """A shared aiohttp session for the providers called over plain HTTP."""
+        return self._get(
+            ("http", None, None),
+            lambda: aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    keepalive_timeout=self.keepalive_expiry,
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            ),
+        )
+
+    def gemini(self, api_key: str):
+        """The async Gemini API client of ``api_key``. Unlike ``genai.configure``
+        it is per key, so calls with different keys can run at once. Build its
+        requests with ``gemini_request``."""
+        return self._get(
+            ("gemini_generative_async", None, api_key),
+            lambda: glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key}),
+        )
+
+    def gemini_files(self, api_key: str):
+        """The (sync) Gemini file service client of ``api_key``."""
+        return self._get(
+            ("gemini_file", None, api_key),
+            lambda: glm.FileServiceClient(client_options={"api_key": api_key}),
+        )
+
+
+    def zhipu(self, api_key: str = None):
+        try:
+            from zhipuai import ZhipuAI
+        except ImportError:
+            raise ImportError("Please install zhipuai before initialize zhipuai backend.")
+
+        return self._get(
+            ("zhipu", None, api_key),
+            lambda: ZhipuAI(api_key=api_key) if api_key else ZhipuAI(),
+        )
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        for key, (client_loop, client) in list(self._clients.items()):
+            del self._clients[key]
+            if client_loop is loop:
+                try:
+                    await _close_client(client)
+                except Exception as e:
+                    logger.warning(f"Closing the {key[0]} client failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "open": dict(Counter(key[0] for key in self._clients)),
+            "created": dict(self.created),
+            "reused": dict(self.reused),
+        }
+
+
+provider_clients = ProviderClientRegistry()
+
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -59,12 +236,7 @@ async def openai_complete_if_cache(
     api_key=None,
     **kwargs,
 ) -> str:
-    if api_key:
-        os.environ["OPENAI_API_KEY"] = api_key
-
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
+    openai_async_client = provider_clients.openai(base_url, api_key)
     kwargs.pop("hashing_kv", None)
     kwargs.pop("keyword_extraction", None)
     messages = []
@@ -128,10 +300,10 @@ async def azure_openai_complete_if_cache(
     if api_version:
         os.environ["AZURE_OPENAI_API_VERSION"] = api_version
 
-    openai_async_client = AsyncAzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+    openai_async_client = provider_clients.azure_openai(
+        os.getenv("AZURE_OPENAI_ENDPOINT"),
+        os.getenv("AZURE_OPENAI_API_KEY"),
+        os.getenv("AZURE_OPENAI_API_VERSION"),
     )
     kwargs.pop("hashing_kv", None)
     messages = []
@@ -320,7 +492,7 @@ async def ollama_model_if_cache(
     host = kwargs.pop("host", None)
     timeout = kwargs.pop("timeout", None)
     kwargs.pop("hashing_kv", None)
-    ollama_client = ollama.AsyncClient(host=host, timeout=timeout)
+    ollama_client = provider_clients.ollama(host, timeout=timeout)
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -611,18 +783,9 @@ async def zhipu_complete_if_cache(
     history_messages: List[Dict[str, str]] = [],
     **kwargs,
 ) -> str:
-    # dynamically load ZhipuAI
-    try:
-        from zhipuai import ZhipuAI
-    except ImportError:
-        raise ImportError("Please install zhipuai before initialize zhipuai backend.")
 
-    if api_key:
-        client = ZhipuAI(api_key=api_key)
-    else:
-        # please set ZHIPUAI_API_KEY in your environment
-        # os.environ["ZHIPUAI_API_KEY"]
-        client = ZhipuAI()
+    # without api_key, please set ZHIPUAI_API_KEY in your environment
+    client = provider_clients.zhipu(api_key)
 
     messages = []
 
@@ -736,17 +899,8 @@ async def zhipu_complete(
 async def zhipu_embedding(
     texts: list[str], model: str = "embedding-3", api_key: str = None, **kwargs
 ) -> np.ndarray:
-    # dynamically load ZhipuAI
-    try:
-        from zhipuai import ZhipuAI
-    except ImportError:
-        raise ImportError("Please install zhipuai before initialize zhipuai backend.")
-    if api_key:
-        client = ZhipuAI(api_key=api_key)
-    else:
-        # please set ZHIPUAI_API_KEY in your environment
-        # os.environ["ZHIPUAI_API_KEY"]
-        client = ZhipuAI()
+    # without api_key, please set ZHIPUAI_API_KEY in your environment
+    client = provider_clients.zhipu(api_key)
 
     # Convert single text to list if needed
     if isinstance(texts, str):
@@ -775,12 +929,7 @@ async def openai_embedding(
     base_url: str = None,
     api_key: str = None,
 ) -> np.ndarray:
-    if api_key:
-        os.environ["OPENAI_API_KEY"] = api_key
-
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
+    openai_async_client = provider_clients.openai(base_url, api_key)
     response = await openai_async_client.embeddings.create(
         model=model, input=texts, encoding_format="float"
     )
@@ -788,11 +937,11 @@ async def openai_embedding(
 
 
 async def fetch_data(url, headers, data):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=data) as response:
-            response_json = await response.json()
-            data_list = response_json.get("data", [])
-            return data_list
+    session = provider_clients.http_session()
+    async with session.post(url, headers=headers, json=data) as response:
+        response_json = await response.json()
+        data_list = response_json.get("data", [])
+        return data_list
 
 
 async def jina_embedding(
@@ -837,12 +986,7 @@ async def nvidia_openai_embedding(
     trunc: str = "NONE",  # NONE or START or END
     encode: str = "float",  # float or base64
 ) -> np.ndarray:
-    if api_key:
-        os.environ["OPENAI_API_KEY"] = api_key
-
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
+    openai_async_client = provider_clients.openai(base_url, api_key)
     response = await openai_async_client.embeddings.create(
         model=model,
         input=texts,
@@ -872,10 +1016,10 @@ async def azure_openai_embedding(
     if api_version:
         os.environ["AZURE_OPENAI_API_VERSION"] = api_version
 
-    openai_async_client = AsyncAzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+    openai_async_client = provider_clients.azure_openai(
+        os.getenv("AZURE_OPENAI_ENDPOINT"),
+        os.getenv("AZURE_OPENAI_API_KEY"),
+        os.getenv("AZURE_OPENAI_API_VERSION"),
     )
 
     response = await openai_async_client.embeddings.create(
@@ -906,12 +1050,12 @@ async def siliconcloud_embedding(
     payload = {"model": model, "input": truncate_texts, "encoding_format": "base64"}
 
     base64_strings = []
-    async with aiohttp.ClientSession() as session:
-        async with session.post(base_url, headers=headers, json=payload) as response:
-            content = await response.json()
-            if "code" in content:
-                raise ValueError(content)
-            base64_strings = [item["embedding"] for item in content["data"]]
+    session = provider_clients.http_session()
+    async with session.post(base_url, headers=headers, json=payload) as response:
+        content = await response.json()
+        if "code" in content:
+            raise ValueError(content)
+        base64_strings = [item["embedding"] for item in content["data"]]
 
     embeddings = []
     for string in base64_strings:
@@ -1013,17 +1157,17 @@ async def ollama_embedding(texts: list[str], embed_model, **kwargs) -> np.ndarra
     Deprecated in favor of `embed`.
     """
     embed_text = []
-    ollama_client = ollama.Client(**kwargs)
+    ollama_client = provider_clients.ollama(**kwargs)
     for text in texts:
-        data = ollama_client.embeddings(model=embed_model, prompt=text)
+        data = await ollama_client.embeddings(model=embed_model, prompt=text)
         embed_text.append(data["embedding"])
 
     return embed_text
 
 
 async def ollama_embed(texts: list[str], embed_model, **kwargs) -> np.ndarray:
-    ollama_client = ollama.Client(**kwargs)
-    data = ollama_client.embed(model=embed_model, input=texts)
+    ollama_client = provider_clients.ollama(**kwargs)
+    data = await ollama_client.embed(model=embed_model, input=texts)
     return data["embeddings"]
 
 
@@ -1052,11 +1196,38 @@ class Model(BaseModel):
         ...,
         description="The arguments to pass to the callable function. Eg. the api key, model name, etc",
     )
+    name: Optional[str] = Field(
+        None,
+        description="The name of the model in MultiModel.stats(), defaults to its position and kwargs['model']",
+    )
+    max_concurrency: Optional[int] = Field(
+        None,
+        description="At most this many calls to the model at once, None for no cap",
+    )
 
     class Config:
         arbitrary_types_allowed = True
 
 
+class _ModelState:
+    def __init__(self, name: str, max_concurrency: Optional[int]):
+        self.name = name
+        self.limiter = ConcurrencyLimiter(max_concurrency) if max_concurrency else None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.readmitted_at: Optional[float] = None
+
+    def has_room(self) -> bool:
+        return self.limiter is None or (
+            self.limiter.in_flight < self.limiter.max_size and not self.limiter.queued
+        )
+
+
 class MultiModel:
     """
     Distributes the load across multiple language models. Useful for circumventing low rate limits with certain api providers especially if you are on the free tier.
@@ -1064,6 +1235,19 @@ class MultiModel:
 
     Attributes:
         models (List[Model]): A list of language models to be used.
+        policy (str): How a call picks its model:
+            "round_robin" - in turn, as before;
+            "least_in_flight" - the model with the fewest calls running;
+            "ewma_latency" - at random, weighted by 1 / (latency EWMA * (calls running + 1)),
+                so a slow or busy model gets a smaller share (models without a latency yet
+                get the best one seen, so they are tried).
+        max_failures (int): After this many failures in a row a model is ejected for
+            `ejection_seconds` (None to never eject). It then comes back gradually: over
+            `readmission_seconds` it is offered to a growing share of the calls, and a failure
+            in that time ejects it again.
+
+    A call to a model at its `max_concurrency` waits for a free slot, unless another model
+    still has room. `stats()` reports the calls, failures, latency and health of every model.
 
     Usage example:
         ```python
@@ -1072,9 +1256,9 @@ class MultiModel:
             Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_2"]}),
             Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_3"]}),
             Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_4"]}),
-            Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_5"]}),
+            Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_5"]}, max_concurrency=4),
         ]
-        multi_model = MultiModel(models)
+        multi_model = MultiModel(models, policy="ewma_latency")
         rag = MalRag(
             llm_model_func=multi_model.llm_model_func
             / ..other args
@@ -1082,21 +1266,130 @@ class MultiModel:
         ```
     """
 
-    def __init__(self, models: List[Model]):
+    POLICIES = ("round_robin", "least_in_flight", "ewma_latency")
+
+    def __init__(
+        self,
+        models: List[Model],
+        policy: str = "round_robin",
+        ewma_alpha: float = 0.3,
+        max_failures: Optional[int] = 3,
+        ejection_seconds: float = 30.0,
+        readmission_seconds: float = 60.0,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown routing policy {policy!r}, expected one of {self.POLICIES}")
         self._models = models
         self._current_model = 0
+        self.policy = policy
+        self.ewma_alpha = ewma_alpha
+        self.max_failures = max_failures
+        self.ejection_seconds = ejection_seconds
+        self.readmission_seconds = readmission_seconds
+        self._random = random.Random()
+        self._state = [
+            _ModelState(
+                model.name or f"{i}:{model.kwargs.get('model', model.gen_func.__name__)}",
+                model.max_concurrency,
+            )
+            for i, model in enumerate(models)
+        ]
 
     def _next_model(self):
         self._current_model = (self._current_model + 1) % len(self._models)
         return self._models[self._current_model]
 
+    def _admission(self, state: _ModelState, now: float) -> float:
+        """The share of the calls a model is offered: 0 while ejected, rising
+        to 1 over the readmission window."""
+        if now < state.ejected_until:
+            return 0.0
+        if state.readmitted_at is None:
+            return 1.0
+        ramp = (now - state.readmitted_at) / self.readmission_seconds
+        if ramp >= 1:
+            state.readmitted_at = None
+            return 1.0
+        return max(ramp, 0.05)
+
+    def _candidates(self) -> list[int]:
+        now = time.monotonic()
+        healthy = []
+        for i, state in enumerate(self._state):
+            if state.readmitted_at is None and state.ejected_until and now >= state.ejected_until:
+                # its ejection is over, start the readmission
+                state.readmitted_at = state.ejected_until
+                state.ejected_until = 0.0
+            admission = self._admission(state, now)
+            if admission > 0 and (admission >= 1 or self._random.random() < admission):
+                healthy.append(i)
+        if not healthy:
+            healthy = [i for i, s in enumerate(self._state) if self._admission(s, now) > 0]
+        if not healthy:
+            # everything is ejected, try the one that comes back first
+            return [min(range(len(self._state)), key=lambda i: self._state[i].ejected_until)]
+        with_room = [i for i in healthy if self._state[i].has_room()]
+        return with_room or healthy
+
+    def _pick(self) -> int:
+        candidates = self._candidates()
+        if self.policy == "round_robin":
+            self._next_model()
+            n = len(self._models)
+            return min(candidates, key=lambda i: (i - self._current_model) % n)
+        if self.policy == "least_in_flight":
+            # ties go round robin, not always to the first model
+            self._next_model()
+            n = len(self._models)
+            return min(
+                candidates,
+                key=lambda i: (self._state[i].in_flight, (i - self._current_model) % n),
+            )
+        known = [s.ewma_latency for s in self._state if s.ewma_latency is not None]
+        best = min(known) if known else 1.0
+        weights = [
+            1 / (
+                max(self._state[i].ewma_latency or best, 1e-6)
+                * (self._state[i].in_flight + 1)
+            )
+            for i in candidates
+        ]
+        return self._random.choices(candidates, weights=weights)[0]
+
+    def _record(self, state: _ModelState, started: float, error: Exception = None):
+        if error is None:
+            latency = time.monotonic() - started
+            state.completed += 1
+            state.consecutive_failures = 0
+            state.ewma_latency = (
+                latency
+                if state.ewma_latency is None
+                else self.ewma_alpha * latency + (1 - self.ewma_alpha) * state.ewma_latency
+            )
+            return
+        state.failed += 1
+        if self.max_failures is None or time.monotonic() < state.ejected_until:
+            # the calls still running when it was ejected don't eject it again
+            return
+        state.consecutive_failures += 1
+        if state.consecutive_failures >= self.max_failures or state.readmitted_at is not None:
+            state.ejected_until = time.monotonic() + self.ejection_seconds
+            state.readmitted_at = None
+            state.consecutive_failures = 0
+            state.ejections += 1
+            logger.warning(
+                f"Ejected model {state.name} for {self.ejection_seconds:g}s after: {error}"
+            )
+
     async def llm_model_func(
         self, prompt, system_prompt=None, history_messages=[], **kwargs
     ) -> str:
         kwargs.pop("model", None)  # stop from overwriting the custom model name
         kwargs.pop("keyword_extraction", None)
         kwargs.pop("mode", None)
-        next_model = self._next_model()
+        index = self._pick()
+        next_model = self._models[index]
+        state = self._state[index]
         args = dict(
             prompt=prompt,
             system_prompt=system_prompt,
@@ -1105,7 +1398,46 @@ class MultiModel:
             **next_model.kwargs,
         )
 
-        return await next_model.gen_func(**args)
+        # counted while queued for a slot too, so the next calls go elsewhere
+        state.in_flight += 1
+        try:
+            if state.limiter is not None:
+                await state.limiter.acquire()
+            try:
+                started = time.monotonic()
+                try:
+                    result = await next_model.gen_func(**args)
+                except Exception as e:
+                    self._record(state, started, e)
+                    raise
+                self._record(state, started)
+                return result
+            finally:
+                if state.limiter is not None:
+                    state.limiter.release()
+        finally:
+            state.in_flight -= 1
+
+    def stats(self) -> dict:
+        """Per model: calls ``in_flight`` (queued ones included), ``completed``,
+        ``failed``, the latency EWMA, how often it was ejected and whether it
+        is ``ejected`` or ``readmitting`` now."""
+        now = time.monotonic()
+        return {
+            state.name: {
+                "in_flight": state.in_flight,
+                "completed": state.completed,
+                "failed": state.failed,
+                "ewma_latency_ms": None
+                if state.ewma_latency is None
+                else state.ewma_latency * 1000,
+                "ejections": state.ejections,
+                "ejected": now < state.ejected_until,
+                "readmitting": state.readmitted_at is not None,
+                "max_concurrency": self._models[i].max_concurrency,
+            }
+            for i, state in enumerate(self._state)
+        }
 
 
 import asyncio
@@ -1123,25 +1455,234 @@ import os
 import numpy as np
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    if isinstance(
+        e,
+        (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.TooManyRequests,
+            RateLimitError,
+        ),
+    ):
+        return True
+    return "429" in str(e)
+
+
+class TokenBucket:
+    """Holds up to ``capacity`` tokens, refilled at ``rate`` per second.
+
+    ``reserve`` takes the tokens right away, letting the level go negative, and
+    returns how long the caller has to wait before spending them, so concurrent
+    callers line up in order instead of polling the bucket.
+    """
+
+    @classmethod
+    def for_quota(cls, limit: float, period: float, burst: float) -> "TokenBucket":
+        """A bucket that never lets more than ``limit`` through in any window
+        of ``period`` seconds: it spends up to ``burst`` of the quota at once and
+        refills the rest over the window."""
+        capacity = max(1.0, limit * burst)
+        return cls(capacity, max(limit - capacity, 1.0) / period)
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, n: float) -> float:
+        self._refill()
+        # a call bigger than the whole bucket waits for a full one
+        n = min(n, self.capacity)
+        return max(0.0, (n - self.level) / self.rate)
+
+    def reserve(self, n: float) -> float:
+        wait = self.wait_time(n)
+        self.level -= n
+        return wait
+
+    def charge(self, n: float):
+        """Take ``n`` more tokens (or give them back if negative), e.g. once
+        the real usage of a call is known."""
+        self._refill()
+        self.level = min(self.capacity, self.level - n)
+
+
+class _GeminiKeyState:
+    def __init__(self, rpm: float, tpm: float, period: float, burst: float):
+        self.requests = TokenBucket.for_quota(rpm, period, burst)
+        self.tokens = TokenBucket.for_quota(tpm, period, burst)
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def wait_time(self, tokens: int) -> float:
+        return max(
+            self.requests.wait_time(1),
+            self.tokens.wait_time(tokens),
+            self.cooldown_until - time.monotonic(),
+        )
+
+
 class GeminiKeyManager:
-    def __init__(self):
-        keys_str = os.getenv("GOOGLE_API_KEYS")
-        if keys_str:
-            self.keys = [k.strip() for k in keys_str.split(",") if k.strip()]
-        else:
-            single_key = os.getenv("GOOGLE_API_KEY")
-            if single_key:
-                self.keys = [single_key]
+    """Spreads Gemini calls over all the keys of ``GOOGLE_API_KEYS`` (or the
+    single ``GOOGLE_API_KEY``).
+
+    Every key has a request and a token bucket sized to its quota (``rpm`` and
+    ``tpm`` per ``period``; ``set_quota`` for a key on another tier), spending
+    up to ``burst`` of it at once and the rest as it refills, so even a sliding
+    quota window never sees more than the quota.
+    ``lease`` hands out the key that can take the call soonest, preferring the
+    one with the fewest calls in flight, and only waits when every key is
+    spent, so concurrent calls run on all the keys at once. A key that answers
+    429 cools down for ``cooldown`` seconds, doubled for every 429 in a row up
+    to ``max_cooldown``, and gets no calls meanwhile.
+
+    ``get_current_key``/``rotate_key`` are the old single-key interface, kept
+    for scripts that pick a key themselves.
+    """
+
+    def __init__(
+        self,
+        keys: Optional[List[str]] = None,
+        rpm: float = 10,
+        tpm: float = 250_000,
+        cooldown: float = 30.0,
+        max_cooldown: float = 300.0,
+        period: float = 60.0,
+        burst: float = 0.1,
+    ):
+        if keys is None:
+            keys_str = os.getenv("GOOGLE_API_KEYS")
+            if keys_str:
+                keys = [k.strip() for k in keys_str.split(",") if k.strip()]
             else:
-                self.keys = []
-        
-        if not self.keys:
-            logger.warning("No GOOGLE_API_KEYS or GOOGLE_API_KEY found.")
-        
+                single_key = os.getenv("GOOGLE_API_KEY")
+                keys = [single_key] if single_key else []
+            if not keys:
+                logger.warning("No GOOGLE_API_KEYS or GOOGLE_API_KEY found.")
+        self.keys = list(dict.fromkeys(keys))
+
+        self.rpm = rpm
+        self.tpm = tpm
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.period = period
+        self.burst = burst
+        self._state = {
+            key: _GeminiKeyState(rpm, tpm, period, burst) for key in self.keys
+        }
+
         # Use a cycle iterator for round-robin/rotation
         self.key_cycle = itertools.cycle(self.keys)
         self.current_key = next(self.key_cycle) if self.keys else None
 
+    def set_quota(self, key: str, rpm: float = None, tpm: float = None):
+        state = self._state[key]
+        if rpm is not None:
+            state.requests = TokenBucket.for_quota(rpm, self.period, self.burst)
+        if tpm is not None:
+            state.tokens = TokenBucket.for_quota(tpm, self.period, self.burst)
+
+    def _pick(self, tokens: int) -> str:
+        return min(
+            self.keys,
+            key=lambda k: (
+                self._state[k].wait_time(tokens),
+                self._state[k].in_flight,
+                -self._state[k].requests.level,
+            ),
+        )
+
+    async def acquire(self, tokens: int = 0) -> str:
+        """Take a request and ``tokens`` from the best key, waiting if every key
+        is spent or cooling down. Pair with ``release``; ``lease`` does both."""
+        if not self.keys:
+            raise ValueError("GOOGLE_API_KEYS/GOOGLE_API_KEY environment variable not set")
+        while True:
+            key = self._pick(tokens)
+            state = self._state[key]
+            wait = max(
+                state.requests.reserve(1),
+                state.tokens.reserve(tokens),
+                state.cooldown_until - time.monotonic(),
+            )
+            # counted while waiting too, so the next calls go to other keys
+            state.in_flight += 1
+            if wait <= 0:
+                return key
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                state.in_flight -= 1
+                raise
+            if state.cooldown_until <= time.monotonic():
+                return key
+            # the key hit a 429 while we waited: give its reservation back and
+            # pick again
+            state.in_flight -= 1
+            state.requests.charge(-1)
+            state.tokens.charge(-tokens)
+
+    def release(self, key: str, error: BaseException = None):
+        state = self._state[key]
+        state.in_flight -= 1
+        if error is None:
+            state.completed += 1
+            state.strikes = 0
+        elif is_rate_limit_error(error):
+            state.rate_limited += 1
+            now = time.monotonic()
+            # the other calls in flight on the key get their 429s too, one
+            # strike for the lot
+            if state.cooldown_until <= now:
+                cooldown = min(self.max_cooldown, self.cooldown * 2**state.strikes)
+                state.cooldown_until = now + cooldown
+                state.strikes += 1
+                logger.warning(
+                    f"Gemini key ...{key[-4:]} is rate limited, cooling down for {cooldown:.0f}s"
+                )
+        else:
+            state.failed += 1
+
+    def charge(self, key: str, tokens: int):
+        """Correct the token bucket of ``key`` once a call's real usage is known."""
+        self._state[key].tokens.charge(tokens)
+
+    @asynccontextmanager
+    async def lease(self, tokens: int = 0):
+        """``async with manager.lease(tokens) as key:`` runs one call on ``key``;
+        a 429 raised inside the block cools the key down."""
+        key = await self.acquire(tokens)
+        try:
+            yield key
+        except BaseException as e:
+            self.release(key, e)
+            raise
+        self.release(key)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            f"...{key[-4:]}": {
+                "in_flight": state.in_flight,
+                "completed": state.completed,
+                "rate_limited": state.rate_limited,
+                "failed": state.failed,
+                "cooldown_seconds": max(0.0, state.cooldown_until - now),
+            }
+            for key, state in self._state.items()
+        }
+
     def get_current_key(self):
         return self.current_key
 
@@ -1156,52 +1697,165 @@ class GeminiKeyManager:
             return self.current_key
         return None
 
-gemini_key_manager = GeminiKeyManager()
+# generation and embedding models have separate quotas
+gemini_key_manager = GeminiKeyManager(
+    rpm=float(os.getenv("GEMINI_RPM", 10)),
+    tpm=float(os.getenv("GEMINI_TPM", 250_000)),
+)
+gemini_embedding_key_manager = GeminiKeyManager(
+    gemini_key_manager.keys,
+    rpm=float(os.getenv("GEMINI_EMBEDDING_RPM", 1500)),
+    tpm=float(os.getenv("GEMINI_EMBEDDING_TPM", 1_000_000)),
+)
+gemini_tokenizer = GeminiEstimateTokenizer()
+
+_gemini_backoff = wait_exponential(multiplier=1, min=1, max=10)
+
+
+def _gemini_retry_wait(retry_state) -> float:
+    # a rate-limited key is cooling down in the key manager and the retry goes
+    # to another key, so there is nothing to wait for here
+    if is_rate_limit_error(retry_state.outcome.exception()):
+        return 0
+    return _gemini_backoff(retry_state)
 
 
 @retry(
     stop=stop_after_attempt(5), # Increased attempts to allow for rotation
-    wait=wait_exponential(multiplier=1, min=1, max=10),
+    wait=_gemini_retry_wait,
     retry=retry_if_exception_type(Exception),
 )
 async def gemini_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
-    api_key = gemini_key_manager.get_current_key()
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEYS/GOOGLE_API_KEY environment variable not set or valid")
-    
+    model_name = kwargs.get("model", "gemini-2.5-flash")
+
+    if system_prompt:
+         # simple prepend strategy for now as chat session is initiated
+         prompt = f"System: {system_prompt}\nUser: {prompt}"
+
+    request = gemini_request(
+        model_name,
+        [
+            gemini_content("user" if msg["role"] == "user" else "model", msg["content"])
+            for msg in history_messages
+        ]
+        + [gemini_content("user", prompt)],
+    )
+
+    # input tokens only, the output is charged once the usage is known
+    estimate = sum(
+        gemini_tokenizer.count_many([prompt] + [m["content"] for m in history_messages])
+    )
+    if kwargs.get("stream"):
+        return await _gemini_stream(model_name, request, estimate)
+    async with gemini_key_manager.lease(estimate) as api_key:
+        try:
+            logger.info(f"[LLM] Calling Gemini API (Model: {model_name}, Key: ...{api_key[-4:]})")
+            response = await provider_clients.gemini(api_key).generate_content(request)
+            text = gemini_text(response)
+        except Exception as e:
+            logger.warning(f"[LLM] Gemini API Failed (Key: ...{api_key[-4:]}). Error: {e}")
+            raise
+        _charge_gemini_usage(api_key, response, estimate)
+        logger.info(f"[LLM] Gemini Response received (Length: {len(text)} chars)")
+        return text
+
+
+def gemini_content(role: str, *parts) -> glm.Content:
+    """A Gemini message of texts and ``glm.Part``s (e.g. an uploaded file's
+    ``file_data``)."""
+    return glm.Content(
+        role=role,
+        parts=[glm.Part(text=part) if isinstance(part, str) else part for part in parts],
+    )
+
+
+def gemini_request(model_name: str, contents: list) -> glm.GenerateContentRequest:
+    """A request for ``provider_clients.gemini(api_key).generate_content`` (or
+    ``stream_generate_content``)."""
+    if "/" not in model_name:
+        model_name = f"models/{model_name}"
+    return glm.GenerateContentRequest(model=model_name, contents=contents)
+
+
+def gemini_text(response: glm.GenerateContentResponse, strict: bool = True) -> str:
+    """The text of the first candidate. Unless ``strict`` is off (streamed
+    chunks), a response without text, e.g. a blocked prompt, raises."""
+    if not response.candidates:
+        if strict:
+            raise ValueError(f"Gemini returned no candidates: {response.prompt_feedback}")
+        return ""
+    candidate = response.candidates[0]
+    if strict and not candidate.content.parts:
+        raise ValueError(
+            f"Gemini returned no text, finish reason {candidate.finish_reason.name}"
+        )
+    return "".join(part.text for part in candidate.content.parts)
+
+
+def _charge_gemini_usage(api_key: str, response, estimate: int):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and usage.total_token_count:
+        gemini_key_manager.charge(api_key, usage.total_token_count - estimate)
+
+
+async def _gemini_stream(
+    model_name: str, request: glm.GenerateContentRequest, estimate: int
+):
+    """Start a streamed Gemini call and return an iterator over its text.
+
+    The key stays leased until the stream is exhausted or closed: a 429 in the
+    middle of it still cools the key down, and the output tokens are charged
+    from the usage reported with the last chunk. The first chunk is read before
+    returning, so an error before any output is retried by ``gemini_complete``
+    like a plain call. The caller has to read or ``aclose`` the result.
+    """
+    api_key = await gemini_key_manager.acquire(estimate)
     try:
-        genai.configure(api_key=api_key)
-        model_name = kwargs.get("model", "gemini-2.5-flash")
-        model = genai.GenerativeModel(model_name)
-
-        gemini_history = []
-        for msg in history_messages:
-            role = "user" if msg["role"] == "user" else "model"
-            gemini_history.append({"role": role, "parts": [msg["content"]]})
-            
-        chat = model.start_chat(history=gemini_history)
-        
-        if system_prompt:
-             # simple prepend strategy for now as chat session is initiated
-             prompt = f"System: {system_prompt}\nUser: {prompt}"
+        logger.info(
+            f"[LLM] Streaming from Gemini API (Model: {model_name}, Key: ...{api_key[-4:]})"
+        )
+        response = await provider_clients.gemini(api_key).stream_generate_content(
+            request
+        )
+        chunks = response.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = None
+    except BaseException as e:
+        if isinstance(e, Exception):
+            logger.warning(f"[LLM] Gemini API Failed (Key: ...{api_key[-4:]}). Error: {e}")
+        gemini_key_manager.release(api_key, e)
+        raise
+
+    last = first
+
+    async def texts():
+        nonlocal last
+        if first is not None:
+            yield gemini_text(first, strict=False)
+            async for chunk in chunks:
+                last = chunk
+                yield gemini_text(chunk, strict=False)
+
+    def done(error):
+        if error is None and last is not None:
+            _charge_gemini_usage(api_key, last, estimate)
+        else:
+            logger.warning(
+                f"[LLM] Gemini stream failed (Key: ...{api_key[-4:]}). Error: {error}"
+            )
+        gemini_key_manager.release(api_key, error)
 
-        logger.info(f"[LLM] Calling Gemini API (Model: {model_name}, Key: ...{api_key[-4:]})")
-        response = await chat.send_message_async(prompt)
-        logger.info(f"[LLM] Gemini Response received (Length: {len(response.text)} chars)")
-        return response.text
-    except Exception as e:
-        logger.warning(f"[LLM] Gemini API Failed (Key: ...{api_key[-4:]}). Error: {e}")
-        logger.warning(f"[LLM] Rotating key and retrying...")
-        gemini_key_manager.rotate_key()
-        raise e # Re-raise to trigger tenacity retry with new key
+    return ReleasingStream(texts(), done)
 
 
 @wrap_embedding_func_with_attrs(embedding_dim=768, max_token_size=2048)
 @retry(
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=10),
+    wait=_gemini_retry_wait,
     retry=retry_if_exception_type(Exception),
 )
 async def gemini_embedding(
@@ -1209,30 +1863,27 @@ async def gemini_embedding(
     model: str = "models/text-embedding-004",
     api_key: str = None,
 ) -> np.ndarray:
-    if api_key:
-        genai.configure(api_key=api_key)
-    else:
-        api_key = gemini_key_manager.get_current_key()
-        if not api_key:
-             raise ValueError("GOOGLE_API_KEYS/GOOGLE_API_KEY environment variable not set")
-        genai.configure(api_key=api_key)
-    
-    try:
-        # Batch embedding
-        result = genai.embed_content(
-            model=model,
-            content=texts,
-            task_type="retrieval_document",
-            title=None
-        )
+    async def embed(key):
+        try:
+            # Batch embedding
+            result = await genai.embed_content_async(
+                model=model,
+                content=texts,
+                task_type="retrieval_document",
+                title=None,
+                client=provider_clients.gemini(key),
+            )
+        except Exception as e:
+            logger.error(f"Gemini Embedding API Error with key ...{key[-4:]}: {e}")
+            raise
         return np.array(result['embedding'])
-    except Exception as e:
-        logger.error(f"Gemini Embedding API Error with key ...{api_key[-4:] if api_key else 'None'}: {e}")
-        if not api_key: # If passed specifically, we probably shouldn't rotate global keys, but for consistency if using global manager:
-             gemini_key_manager.rotate_key()
-        else:
-             gemini_key_manager.rotate_key()
-        raise e
+
+    if api_key:
+        return await embed(api_key)
+    async with gemini_embedding_key_manager.lease(
+        sum(gemini_tokenizer.count_many(texts))
+    ) as key:
+        return await embed(key)
 
 
 @lru_cache(maxsize=1)
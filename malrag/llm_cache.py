@@ -0,0 +1,178 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Optional
+
+from .base import BaseKVStorage
+from .utils import compute_args_hash, logger
+
+# kwargs that change how a response is delivered, not what it says
+_UNKEYED_KWARGS = ("hashing_kv", "stream")
+
+
+class LLMResponseCache:
+    """Exact-match cache of LLM completions, for any provider function.
+
+    ``wrap(func)`` keys every call on ``model`` (the function, model name and
+    model kwargs), the system prompt, the history, the prompt and the other
+    kwargs, and keeps the text responses in a KV namespace. Entries older than
+    ``ttl_seconds`` miss, and past ``max_entries`` or ``max_bytes`` of
+    responses the least recently used ones are evicted. The recency order is
+    kept in memory and starts from the write times after a restart.
+
+    Call sites tag their calls with ``cache_site=...`` (stripped before the
+    provider function sees it); the sites in ``skip_sites`` are never cached,
+    nor are streamed calls. Without ``kv_storage`` nothing is cached and the
+    wrapper only strips the tag.
+    """
+
+    def __init__(
+        self,
+        kv_storage: Optional[BaseKVStorage],
+        model: tuple = (),
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: Optional[float] = None,
+        skip_sites: tuple = (),
+    ):
+        self.kv_storage = kv_storage
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.skip_sites = set(skip_sites)
+        # key -> (written at, size), least recently used first
+        self._index: Optional[OrderedDict[str, tuple[float, int]]] = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.skipped = 0
+
+    def key(self, prompt: str, system_prompt, history_messages, kwargs: dict) -> str:
+        return compute_args_hash(
+            self.model,
+            system_prompt,
+            history_messages,
+            prompt,
+            sorted((k, v) for k, v in kwargs.items() if k not in _UNKEYED_KWARGS),
+        )
+
+    async def _load_index(self) -> OrderedDict:
+        if self._index is None:
+            keys = await self.kv_storage.all_keys()
+            entries = await self.kv_storage.get_by_ids(keys, fields=["created", "size"])
+            index = OrderedDict(
+                sorted(
+                    (
+                        (key, (entry["created"], entry["size"]))
+                        for key, entry in zip(keys, entries)
+                        if entry
+                    ),
+                    key=lambda item: item[1][0],
+                )
+            )
+            if self._index is None:
+                self._index = index
+                self._bytes = sum(size for _, size in index.values())
+        return self._index
+
+    async def _delete(self, keys: list[str]):
+        for key in keys:
+            entry = self._index.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        await self.kv_storage.delete(keys)
+
+    async def get(self, key: str) -> Optional[str]:
+        index = await self._load_index()
+        if key in index:
+            created, _ = index[key]
+            if (
+                self.ttl_seconds is not None
+                and time.time() - created > self.ttl_seconds
+            ):
+                await self._delete([key])
+            else:
+                entry = await self.kv_storage.get_by_id(key)
+                if entry is not None:
+                    index.move_to_end(key)
+                    self.hits += 1
+                    return entry["return"]
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: str):
+        index = await self._load_index()
+        size = len(response.encode("utf-8"))
+        if key in index or size > self.max_bytes:
+            return
+        created = time.time()
+        index[key] = (created, size)
+        self._bytes += size
+        self.writes += 1
+        await self.kv_storage.upsert(
+            {key: {"return": response, "created": created, "size": size}}
+        )
+        evicted = []
+        entries, total = len(index), self._bytes
+        for old_key, (_, old_size) in index.items():
+            if entries <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append(old_key)
+            entries -= 1
+            total -= old_size
+        if evicted:
+            self.evictions += len(evicted)
+            await self._delete(evicted)
+            logger.debug(f"Evicted {len(evicted)} LLM cache entries")
+
+    def wrap(self, func):
+        @wraps(func)
+        async def cached_func(
+            prompt, system_prompt=None, history_messages=[], **kwargs
+        ):
+            cache_site = kwargs.pop("cache_site", None)
+
+            def call():
+                return func(
+                    prompt,
+                    system_prompt=system_prompt,
+                    history_messages=history_messages,
+                    **kwargs,
+                )
+
+            if self.kv_storage is None or kwargs.get("stream"):
+                return await call()
+            if cache_site in self.skip_sites:
+                self.skipped += 1
+                return await call()
+            key = self.key(prompt, system_prompt, history_messages, kwargs)
+            cached = await self.get(key)
+            if cached is not None:
+                return cached
+            response = await call()
+            if isinstance(response, str):
+                await self.put(key, response)
+            return response
+
+        return cached_func
+
+    async def stats(self) -> dict:
+        """Lookups since this process started, the calls skipped by site and
+        the stored entries and bytes."""
+        if self.kv_storage is None:
+            return {}
+        index = await self._load_index()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(index),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "skipped": self.skipped,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
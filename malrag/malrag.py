@@ -1,10 +1,9 @@
 import asyncio
 import os
-from tqdm.asyncio import tqdm as tqdm_async
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from functools import partial
-from typing import Type, cast
+from typing import Optional, Type, cast
 
 from .llm import (
     gpt_4o_mini_complete,
@@ -13,8 +12,8 @@ from .llm import (
     vyakarth_embedding,
 )
 from .operate import (
-    chunking_by_token_size,
-    extract_entities,
+    iter_chunks_by_token_size,
+    remove_chunks_from_graph,
     # local_query,global_query,hybrid_query,
     kg_query,
     naive_query,
@@ -23,7 +22,6 @@ from .operate import (
 from .utils import (
     EmbeddingFunc,
     compute_mdhash_id,
-    limit_async_func_call,
     convert_response_to_json,
     logger,
     set_logger,
@@ -41,6 +39,20 @@ from .storage import (
     NanoVectorDBStorage,
     NetworkXStorage,
 )
+from .extraction_cache import ExtractionCache
+from .llm_cache import LLMResponseCache
+from .gazetteer import LocalEntityTagger
+from .minhash import NearDuplicateIndex
+from .pipeline import run_ingestion_pipeline
+from .scheduler import (
+    DEFAULT_PRIORITY_WEIGHTS,
+    INTERACTIVE,
+    PriorityScheduler,
+    SingleFlight,
+    llm_priority,
+)
+from .summary_queue import SummaryQueue
+from .tokenizer import get_tokenizer_from_config
 
 # future KG integrations
 
@@ -132,10 +144,30 @@ class MalRag:
     chunk_token_size: int = 1200
     chunk_overlap_token_size: int = 100
     tiktoken_model_name: str = "gpt2"
+    # token counting for chunking, summaries and query context budgets:
+    # "tiktoken" (tiktoken_model_name), "vyakarth" (embedding model tokenizer,
+    # any HuggingFace name via tokenizer_model_name) or "gemini" (estimate)
+    tokenizer: str = "tiktoken"
+    tokenizer_model_name: str = None
 
     # entity extraction
     entity_extract_max_gleaning: int = 1
     entity_summary_to_max_tokens: int = 500
+    # no gleaning for chunks under gleaning_min_chunk_tokens or whose first
+    # pass already yielded gleaning_skip_yield records per token, and gleaning
+    # rounds answer "more entities left?" in the same response instead of a
+    # separate call. Off: the fixed continue + loop-check rounds
+    adaptive_gleaning: bool = False
+    gleaning_min_chunk_tokens: int = 300
+    gleaning_skip_yield: float = 0.02
+    # max chunks extracted together in one prompt, so the instructions and
+    # examples are sent once per pack; packs are also capped by what fits in
+    # llm_model_max_token_size. 1 sends one prompt per chunk
+    extraction_pack_size: int = 1
+
+    # ingestion pipeline: max items waiting between chunking, embedding,
+    # extraction and merging
+    pipeline_queue_size: int = 32
 
     # node embedding
     node_embedding_algorithm: str = "node2vec"
@@ -165,7 +197,71 @@ class MalRag:
     # storage
     vector_db_storage_cls_kwargs: dict = field(default_factory=dict)
 
+    # file-backed storages append changes to a write-ahead log and only rewrite
+    # their snapshot once the log outgrows this multiple of it (<= 0: always)
+    wal_compaction_ratio: float = 1.0
+
     enable_llm_cache: bool = True
+    # with enable_llm_cache, the response of every LLM call (extraction,
+    # gleaning, summaries, keywords, whatever the provider) is also cached by
+    # exact prompt and model in the llm_call_cache namespace, evicting the
+    # least recently used past these caps. Call sites (cache_site: extraction,
+    # gleaning, summary, keywords, query_answer) listed in llm_cache_skip_sites
+    # are not cached; query answers already are, per mode, by handle_cache
+    llm_cache_max_entries: int = 10000
+    llm_cache_max_bytes: int = 64 * 1024 * 1024
+    llm_cache_ttl_seconds: Optional[float] = None
+    llm_cache_skip_sites: list = field(default_factory=lambda: ["query_answer"])
+    # persist every chunk's extraction output as soon as it finishes, so a failed
+    # or restarted ainsert of the same documents only redoes the merge. The
+    # records are kept afterwards: document deletion uses them to find and
+    # rebuild the entities and relationships a chunk contributed to
+    enable_extraction_checkpoint: bool = True
+    # chunks whose estimated Jaccard similarity (MinHash over character
+    # shingles) to an already ingested chunk reaches this threshold reuse that
+    # chunk's extraction instead of calling the LLM (None or 0: disabled;
+    # 0.95 catches boilerplate repeated across documents)
+    near_duplicate_threshold: Optional[float] = None
+    minhash_num_perm: int = 128
+    # raw extraction output keyed by chunk text, prompts, entity types,
+    # gleaning and model (not by ids), so a re-index in a new working directory
+    # or storage backend can import it and skip the LLM, see
+    # export_extraction_cache / import_extraction_cache
+    enable_extraction_cache: bool = True
+    # request extraction completions with stream=True and parse the records as
+    # they arrive; LLM functions that return the whole text still work.
+    # Streamed calls bypass the LLM call cache and single-flight
+    stream_extraction: bool = False
+    # merges store descriptions past entity_summary_to_max_tokens as they are
+    # and queue them; a background drain started after every insert summarizes
+    # summary_batch_size of them per prompt (see summarize_pending and
+    # summary_backlog). Off: summarize inline during the merge
+    defer_summaries: bool = False
+    summary_batch_size: int = 8
+    # tag chunks on the CPU first: a chunk whose mentions (ner_model_func,
+    # text -> list of names; default: capitalized phrases) are all entities
+    # the graph already has is attached to them without an LLM call. Plug a
+    # NER model in for Malayalam text, which has no capitals
+    enable_local_ner: bool = False
+    ner_model_func: Optional[callable] = None
+    # chunks scoring below this (script ratio, digit density, unique-word
+    # ratio and length, see chunk_filter) are embedded for naive retrieval but
+    # skip graph extraction (None or 0: extract every chunk; 0.25 drops
+    # page numbers, tables of figures and similar fragments)
+    min_chunk_information: Optional[float] = None
+    # LLM and embedding calls are scheduled by priority class: queries
+    # (interactive), ingestion, and deferred summaries (background). Waiting
+    # classes share the llm_model_max_async / embedding_func_max_async slots
+    # by these weights, and interactive_reserved_slots of them are kept for
+    # queries, so a question doesn't queue behind a large upload
+    priority_weights: dict = field(
+        default_factory=lambda: dict(DEFAULT_PRIORITY_WEIGHTS)
+    )
+    interactive_reserved_slots: int = 1
+    # concurrent identical LLM / embedding calls (the same question asked by
+    # several users at once, the same summary prompt of a hub entity) share
+    # one request instead of each paying for it
+    enable_single_flight: bool = True
 
     # extension
     addon_params: dict = field(default_factory=dict)
@@ -206,9 +302,58 @@ class MalRag:
             if self.enable_llm_cache
             else None
         )
-        self.embedding_func = limit_async_func_call(self.embedding_func_max_async)(
-            self.embedding_func
+        self.llm_call_cache_storage = (
+            self.key_string_value_json_storage_cls(
+                namespace="llm_call_cache",
+                global_config=asdict(self),
+                embedding_func=None,
+            )
+            if self.enable_llm_cache
+            else None
+        )
+        self.extraction_checkpoints = (
+            self.key_string_value_json_storage_cls(
+                namespace="extraction_checkpoints",
+                global_config=asdict(self),
+                embedding_func=None,
+            )
+            if self.enable_extraction_checkpoint
+            else None
+        )
+        self.extraction_cache_storage = None
+        self.extraction_cache = None
+        if self.enable_extraction_cache:
+            self.extraction_cache_storage = self.key_string_value_json_storage_cls(
+                namespace="extraction_cache",
+                global_config=asdict(self),
+                embedding_func=None,
+            )
+            self.extraction_cache = ExtractionCache(self.extraction_cache_storage)
+        # chunk_id -> MinHash signature, see near_duplicate_threshold
+        self.chunk_minhashes = None
+        self.near_duplicate_index = None
+        if self.near_duplicate_threshold:
+            self.chunk_minhashes = self.key_string_value_json_storage_cls(
+                namespace="chunk_minhashes",
+                global_config=asdict(self),
+                embedding_func=None,
+            )
+            self.near_duplicate_index = NearDuplicateIndex(
+                self.chunk_minhashes,
+                threshold=self.near_duplicate_threshold,
+                num_perm=self.minhash_num_perm,
+            )
+        self.embedding_scheduler = PriorityScheduler(
+            self.embedding_func_max_async,
+            self.priority_weights,
+            {INTERACTIVE: self.interactive_reserved_slots},
         )
+        self.embedding_func = self.embedding_scheduler.wrap(self.embedding_func)
+        # outside the scheduler, so the calls that join one in flight don't
+        # take a slot
+        self.embedding_single_flight = SingleFlight()
+        if self.enable_single_flight:
+            self.embedding_func = self.embedding_single_flight.wrap(self.embedding_func)
 
         ####
         # add embedding func by walter
@@ -223,6 +368,26 @@ class MalRag:
             global_config=asdict(self),
             embedding_func=self.embedding_func,
         )
+        # full_doc_id -> {"chunk_ids": [...], "doc_keys": [...]}, every chunk
+        # of the document, including the ones shared with other documents
+        self.doc_chunks = self.key_string_value_json_storage_cls(
+            namespace="doc_chunks",
+            global_config=asdict(self),
+            embedding_func=None,
+        )
+        # chunk_id -> {"doc_ids": [...]}, the documents a chunk belongs to; a
+        # chunk is only retracted once none is left
+        self.chunk_docs = self.key_string_value_json_storage_cls(
+            namespace="chunk_docs",
+            global_config=asdict(self),
+            embedding_func=None,
+        )
+        # stable external key (e.g. filename) -> {"doc_id": current full_doc_id}
+        self.doc_keys = self.key_string_value_json_storage_cls(
+            namespace="doc_keys",
+            global_config=asdict(self),
+            embedding_func=None,
+        )
         self.chunk_entity_relation_graph = self.graph_storage_cls(
             namespace="chunk_entity_relation",
             global_config=asdict(self),
@@ -250,13 +415,60 @@ class MalRag:
             embedding_func=self.embedding_func,
         )
 
-        self.llm_model_func = limit_async_func_call(self.llm_model_max_async)(
-            partial(
-                self.llm_model_func,
-                hashing_kv=self.llm_response_cache,
-                **self.llm_model_kwargs,
+        self.summary_queue_storage = None
+        self.summary_queue = None
+        if self.defer_summaries:
+            self.summary_queue_storage = self.key_string_value_json_storage_cls(
+                namespace="summary_queue",
+                global_config=asdict(self),
+                embedding_func=None,
             )
+            self.summary_queue = SummaryQueue(
+                self.summary_queue_storage,
+                self.chunk_entity_relation_graph,
+                self.entities_vdb,
+                self.relationships_vdb,
+            )
+
+        self.local_tagger = None
+        if self.enable_local_ner:
+            self.local_tagger = LocalEntityTagger(
+                self.chunk_entity_relation_graph, self.ner_model_func
+            )
+
+        self.llm_scheduler = PriorityScheduler(
+            self.llm_model_max_async,
+            self.priority_weights,
+            {INTERACTIVE: self.interactive_reserved_slots},
+        )
+        self.llm_call_cache = LLMResponseCache(
+            self.llm_call_cache_storage,
+            model=(
+                getattr(
+                    self.llm_model_func, "__name__", type(self.llm_model_func).__name__
+                ),
+                self.llm_model_name,
+                sorted(self.llm_model_kwargs.items()),
+            ),
+            max_entries=self.llm_cache_max_entries,
+            max_bytes=self.llm_cache_max_bytes,
+            ttl_seconds=self.llm_cache_ttl_seconds,
+            skip_sites=self.llm_cache_skip_sites,
         )
+        # hits skip the scheduler queue; the wrapper also strips cache_site
+        # when the cache is off
+        self.llm_model_func = self.llm_call_cache.wrap(
+            self.llm_scheduler.wrap(
+                partial(
+                    self.llm_model_func,
+                    hashing_kv=self.llm_response_cache,
+                    **self.llm_model_kwargs,
+                )
+            )
+        )
+        self.llm_single_flight = SingleFlight()
+        if self.enable_single_flight:
+            self.llm_model_func = self.llm_single_flight.wrap(self.llm_model_func)
 
     def _get_storage_class(self) -> Type[BaseGraphStorage]:
         return {
@@ -300,57 +512,51 @@ class MalRag:
             update_storage = True
             logger.info(f"[New Docs] inserting {len(new_docs)} docs")
 
-            inserting_chunks = {}
-            if progress_callback:
-                await progress_callback("chunking")
-            for doc_key, doc in tqdm_async(
-                new_docs.items(), desc="Chunking documents", unit="doc"
-            ):
-                chunks = {
-                    compute_mdhash_id(dp["content"], prefix="chunk-"): {
-                        **dp,
-                        "full_doc_id": doc_key,
-                    }
-                    for dp in chunking_by_token_size(
-                        doc["content"],
-                        overlap_token_size=self.chunk_overlap_token_size,
-                        max_token_size=self.chunk_token_size,
-                        tiktoken_model=self.tiktoken_model_name,
-                    )
-                }
-                inserting_chunks.update(chunks)
-            _add_chunk_keys = await self.text_chunks.filter_keys(
-                list(inserting_chunks.keys())
-            )
-            inserting_chunks = {
-                k: v for k, v in inserting_chunks.items() if k in _add_chunk_keys
-            }
-            if not len(inserting_chunks):
-                logger.warning("All chunks are already in the storage")
-                return
-            logger.info(f"[New Chunks] inserting {len(inserting_chunks)} chunks")
-
-            if progress_callback:
-                await progress_callback("embedding")
-            await self.chunks_vdb.upsert(inserting_chunks)
-
-            logger.info("[Entity Extraction]...")
-            if progress_callback:
-                await progress_callback("extracting_entities")
-            maybe_new_kg = await extract_entities(
+            logger.info("[Chunking, Embedding, Entity Extraction]...")
+            (
                 inserting_chunks,
+                all_entities_data,
+                all_relationships_data,
+                doc_chunk_ids,
+            ) = await run_ingestion_pipeline(
+                new_docs,
+                text_chunks=self.text_chunks,
+                chunks_vdb=self.chunks_vdb,
                 knowledge_graph_inst=self.chunk_entity_relation_graph,
                 entity_vdb=self.entities_vdb,
                 relationships_vdb=self.relationships_vdb,
                 global_config=asdict(self),
+                progress_callback=progress_callback,
+                extraction_checkpoints=self.extraction_checkpoints,
+                near_duplicate_index=self.near_duplicate_index,
+                extraction_cache=self.extraction_cache,
+                summary_queue=self.summary_queue,
+                local_tagger=self.local_tagger,
             )
-            if maybe_new_kg is None:
-                logger.warning("No new entities and relationships found")
-                return
-            self.chunk_entity_relation_graph = maybe_new_kg
+            if not len(inserting_chunks):
+                # the documents still get recorded as sharing those chunks
+                logger.warning("All chunks are already in the storage")
+            logger.info(f"[New Chunks] inserted {len(inserting_chunks)} chunks")
+            if (
+                inserting_chunks
+                and not all_entities_data
+                and not all_relationships_data
+            ):
+                # the chunks are embedded already, so keep the documents and
+                # chunks they resolve to even without graph records
+                logger.warning(
+                    "Didn't extract any entities and relationships, maybe your LLM is not working"
+                )
 
             await self.full_docs.upsert(new_docs)
             await self.text_chunks.upsert(inserting_chunks)
+            await self.doc_chunks.upsert(
+                {
+                    doc_id: {"chunk_ids": chunk_ids, "doc_keys": []}
+                    for doc_id, chunk_ids in doc_chunk_ids.items()
+                }
+            )
+            await self._link_chunks(doc_chunk_ids)
         finally:
             if update_storage:
                 if progress_callback:
@@ -362,7 +568,15 @@ class MalRag:
         for storage_inst in [
             self.full_docs,
             self.text_chunks,
+            self.doc_chunks,
+            self.chunk_docs,
+            self.doc_keys,
             self.llm_response_cache,
+            self.llm_call_cache_storage,
+            self.extraction_checkpoints,
+            self.chunk_minhashes,
+            self.extraction_cache_storage,
+            self.summary_queue_storage,
             self.entities_vdb,
             self.relationships_vdb,
             self.chunks_vdb,
@@ -372,6 +586,8 @@ class MalRag:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
         await asyncio.gather(*tasks)
+        if self.summary_queue is not None:
+            self.summary_queue.start(asdict(self))
 
     def insert_custom_kg(self, custom_kg: dict):
         loop = always_get_an_event_loop()
@@ -514,6 +730,10 @@ class MalRag:
         return loop.run_until_complete(self.aquery(query, param))
 
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
+        with llm_priority(INTERACTIVE):
+            return await self._aquery(query, param)
+
+    async def _aquery(self, query: str, param: QueryParam):
         if param.mode in ["local", "global", "hybrid"]:
             response = await kg_query(
                 query,
@@ -541,7 +761,7 @@ class MalRag:
 
     async def _query_done(self):
         tasks = []
-        for storage_inst in [self.llm_response_cache]:
+        for storage_inst in [self.llm_response_cache, self.llm_call_cache_storage]:
             if storage_inst is None:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
@@ -556,7 +776,14 @@ class MalRag:
 
         try:
             await self.entities_vdb.delete_entity(entity_name)
-            await self.relationships_vdb.delete_relation(entity_name)
+            # relationship vector ids derive from the graph edges, no need to scan
+            edges = await self.chunk_entity_relation_graph.get_node_edges(entity_name)
+            await self.relationships_vdb.delete(
+                [
+                    compute_mdhash_id("".join(sorted(edge)), prefix="rel-")
+                    for edge in edges or []
+                ]
+            )
             await self.chunk_entity_relation_graph.delete_node(entity_name)
 
             logger.info(
@@ -577,3 +804,353 @@ class MalRag:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
         await asyncio.gather(*tasks)
+
+    def delete_by_doc_id(self, doc_id: str):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.adelete_by_doc_id(doc_id))
+
+    async def adelete_by_doc_id(self, doc_id: str) -> bool:
+        """Remove a document, its chunks and their vectors, and take the chunks out
+        of the graph's provenance. Chunks another document shares are kept.
+        Returns False if the document is unknown."""
+        if not await self._delete_doc(doc_id):
+            return False
+        await self._insert_done()
+        return True
+
+    async def _link_chunks(self, doc_chunk_ids: dict[str, list[str]]):
+        """Record the documents of each chunk in chunk_docs."""
+        chunk_ids = list({c for ids in doc_chunk_ids.values() for c in ids})
+        entries = dict(zip(chunk_ids, await self.chunk_docs.get_by_ids(chunk_ids)))
+        doc_ids = {c: list(e["doc_ids"]) if e else [] for c, e in entries.items()}
+        for doc_id, ids in doc_chunk_ids.items():
+            for chunk_id in ids:
+                if doc_id not in doc_ids[chunk_id]:
+                    doc_ids[chunk_id].append(doc_id)
+        await self.chunk_docs.delete(chunk_ids)
+        await self.chunk_docs.upsert({c: {"doc_ids": d} for c, d in doc_ids.items()})
+
+    async def _chunk_owners(
+        self, doc_id: str, chunk_ids: list[str]
+    ) -> tuple[list[str], dict[str, list[str]]]:
+        """Split the chunks of ``doc_id`` into the ones no other document uses
+        and the others, with the documents left on them."""
+        entries = await self.chunk_docs.get_by_ids(chunk_ids)
+        orphaned = []
+        still_used = {}
+        for chunk_id, entry in zip(chunk_ids, entries):
+            # chunks indexed before chunk_docs existed only know their first owner
+            others = [d for d in entry["doc_ids"] if d != doc_id] if entry else []
+            if others:
+                still_used[chunk_id] = others
+            else:
+                orphaned.append(chunk_id)
+        return orphaned, still_used
+
+    async def _unlink_chunks(
+        self, doc_id: str, chunk_ids: list[str], still_used: dict[str, list[str]]
+    ):
+        """Take ``doc_id`` off its chunks. Chunks it was the first owner of move
+        over to another one."""
+        await self.chunk_docs.delete(chunk_ids)
+        await self.chunk_docs.upsert({c: {"doc_ids": d} for c, d in still_used.items()})
+
+        moved = list(still_used)
+        chunks = await self.text_chunks.get_by_ids(moved)
+        moved = {
+            c: {**chunk, "full_doc_id": still_used[c][0]}
+            for c, chunk in zip(moved, chunks)
+            if chunk and chunk["full_doc_id"] == doc_id
+        }
+        await self.text_chunks.delete(list(moved))
+        await self.text_chunks.upsert(moved)
+
+    async def _delete_doc(self, doc_id: str) -> bool:
+        doc_entry = await self.doc_chunks.get_by_id(doc_id)
+        if doc_entry is None:
+            logger.warning(f"Document {doc_id} not found in the doc->chunk index")
+            return False
+        chunk_ids = doc_entry["chunk_ids"]
+        orphaned, still_used = await self._chunk_owners(doc_id, chunk_ids)
+        # storages first, bookkeeping last: if a backend fails halfway, the
+        # document is still indexed and deleting it again finishes the job
+        await self._retract_chunks(orphaned)
+        await self._unlink_chunks(doc_id, chunk_ids, still_used)
+        await self.full_docs.delete([doc_id])
+        await self.doc_chunks.delete([doc_id])
+        doc_keys = doc_entry.get("doc_keys", [])
+        key_entries = await self.doc_keys.get_by_ids(doc_keys)
+        await self.doc_keys.delete(
+            [k for k, e in zip(doc_keys, key_entries) if e and e["doc_id"] == doc_id]
+        )
+        logger.info(
+            f"Document {doc_id} has been deleted with {len(orphaned)} of its "
+            f"{len(chunk_ids)} chunks, the others are shared"
+        )
+        return True
+
+    async def _retract_chunks(self, chunk_ids: list[str]):
+        """Delete chunks with their vectors and take them out of the graph."""
+        if self.extraction_checkpoints is not None:
+            stats = await remove_chunks_from_graph(
+                chunk_ids,
+                knowledge_graph_inst=self.chunk_entity_relation_graph,
+                entity_vdb=self.entities_vdb,
+                relationships_vdb=self.relationships_vdb,
+                extraction_records=self.extraction_checkpoints,
+                global_config=asdict(self),
+                summary_queue=self.summary_queue,
+            )
+            logger.info(f"Graph cleanup for {len(chunk_ids)} chunks: {stats}")
+            await self.extraction_checkpoints.delete(chunk_ids)
+        else:
+            logger.warning(
+                "Extraction records are disabled, the graph still references "
+                f"{len(chunk_ids)} deleted chunks"
+            )
+        if self.near_duplicate_index is not None:
+            await self.near_duplicate_index.remove(chunk_ids)
+        if self.local_tagger is not None:
+            self.local_tagger.reset()
+        await self.text_chunks.delete(chunk_ids)
+        await self.chunks_vdb.delete(chunk_ids)
+
+    def update_document(self, doc_key: str, content: str):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aupdate_document(doc_key, content))
+
+    async def aupdate_document(
+        self, doc_key: str, content: str, progress_callback=None
+    ) -> dict:
+        """Insert or replace the document known under ``doc_key`` (e.g. its filename).
+
+        The new version is chunked and diffed against the chunks of the previous
+        one: unchanged chunks are kept with their extraction results, only new
+        chunks go through embedding and extraction, and chunks that disappeared
+        (and no other document shares) are retracted from the graph.
+        """
+        content = content.strip()
+        doc_id = compute_mdhash_id(content, prefix="doc-")
+        key_entry = await self.doc_keys.get_by_id(doc_key)
+        previous_doc_id = key_entry["doc_id"] if key_entry else None
+        report = {"doc_id": doc_id, "previous_doc_id": previous_doc_id}
+        previous_entry = (
+            await self.doc_chunks.get_by_id(previous_doc_id)
+            if previous_doc_id
+            else None
+        )
+        previous_chunk_ids = previous_entry["chunk_ids"] if previous_entry else []
+        if previous_doc_id == doc_id:
+            logger.info(f"Document {doc_key} is unchanged")
+            return {
+                **report,
+                "chunks_kept": len(previous_chunk_ids),
+                "chunks_added": 0,
+                "chunks_removed": 0,
+            }
+
+        # chunks already in text_chunks (the kept ones) are skipped by the
+        # pipeline, and the new version is recorded as sharing them
+        await self.ainsert(content, progress_callback=progress_callback)
+        doc_entry = await self.doc_chunks.get_by_id(doc_id)
+        chunk_ids = doc_entry["chunk_ids"] if doc_entry else []
+        previous = set(previous_chunk_ids)
+        kept = [c for c in chunk_ids if c in previous]
+        added = [c for c in chunk_ids if c not in previous]
+        removed = [c for c in previous_chunk_ids if c not in set(chunk_ids)]
+        logger.info(
+            f"[Update] {doc_key}: {len(kept)} chunks kept, {len(added)} added, "
+            f"{len(removed)} removed"
+        )
+
+        if doc_entry is not None:
+            await self.doc_chunks.delete([doc_id])
+            await self.doc_chunks.upsert(
+                {
+                    doc_id: {
+                        **doc_entry,
+                        "doc_keys": list(
+                            dict.fromkeys(doc_entry.get("doc_keys", []) + [doc_key])
+                        ),
+                    }
+                }
+            )
+        if previous_entry is not None:
+            other_keys = [k for k in previous_entry.get("doc_keys", []) if k != doc_key]
+            if other_keys:
+                # another key still points at the previous version
+                await self.doc_chunks.delete([previous_doc_id])
+                await self.doc_chunks.upsert(
+                    {previous_doc_id: {**previous_entry, "doc_keys": other_keys}}
+                )
+                removed = []
+            else:
+                await self._delete_doc(previous_doc_id)
+        await self.doc_keys.delete([doc_key])
+        await self.doc_keys.upsert({doc_key: {"doc_id": doc_id}})
+        await self._insert_done()
+        return {
+            **report,
+            "chunks_kept": len(kept),
+            "chunks_added": len(added),
+            "chunks_removed": len(removed),
+        }
+
+    def backfill_document_index(self, doc_keys: Optional[dict[str, str]] = None):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.abackfill_document_index(doc_keys))
+
+    async def abackfill_document_index(
+        self, doc_keys: Optional[dict[str, str]] = None
+    ) -> dict:
+        """Index the documents inserted before doc_chunks, chunk_docs and doc_keys
+        existed, so they can be updated and deleted like the others.
+
+        The chunks of a document without a doc_chunks entry are found by cutting
+        its text again and by their ``full_doc_id`` (for chunks cut with another
+        chunking config, and the first owner of shared ones). ``doc_keys`` (key ->
+        doc_id, e.g. filenames recorded by the caller) are added for the keys
+        that aren't known yet. Safe to run on every startup.
+        """
+        doc_ids = list(
+            await self.doc_chunks.filter_keys(await self.full_docs.all_keys())
+        )
+        new_entries = {}
+        if doc_ids:
+            global_config = asdict(self)
+            tokenizer = get_tokenizer_from_config(global_config)
+            chunk_ids = await self.text_chunks.all_keys()
+            stored = set(chunk_ids)
+            doc_chunk_ids = {doc_id: [] for doc_id in doc_ids}
+            for doc_id, doc in zip(doc_ids, await self.full_docs.get_by_ids(doc_ids)):
+                if doc is None:
+                    continue
+                for dp in iter_chunks_by_token_size(
+                    doc["content"],
+                    overlap_token_size=self.chunk_overlap_token_size,
+                    max_token_size=self.chunk_token_size,
+                    tokenizer=tokenizer,
+                ):
+                    chunk_id = compute_mdhash_id(dp["content"], prefix="chunk-")
+                    if chunk_id in stored:
+                        doc_chunk_ids[doc_id].append(chunk_id)
+            chunks = await self.text_chunks.get_by_ids(
+                chunk_ids, fields={"full_doc_id"}
+            )
+            for chunk_id, chunk in zip(chunk_ids, chunks):
+                if chunk and chunk["full_doc_id"] in doc_chunk_ids:
+                    doc_chunk_ids[chunk["full_doc_id"]].append(chunk_id)
+            new_entries = {
+                doc_id: {"chunk_ids": list(dict.fromkeys(ids)), "doc_keys": []}
+                for doc_id, ids in doc_chunk_ids.items()
+            }
+            await self._link_chunks(
+                {doc_id: e["chunk_ids"] for doc_id, e in new_entries.items()}
+            )
+
+        doc_keys = doc_keys or {}
+        keyed = {}
+        for doc_key in await self.doc_keys.filter_keys(list(doc_keys)):
+            doc_id = doc_keys[doc_key]
+            if doc_id in new_entries:
+                new_entries[doc_id]["doc_keys"].append(doc_key)
+            else:
+                doc_entry = await self.doc_chunks.get_by_id(doc_id)
+                if doc_entry is None:
+                    logger.warning(
+                        f"Can't key {doc_key}: document {doc_id} is not stored"
+                    )
+                    continue
+                await self.doc_chunks.delete([doc_id])
+                await self.doc_chunks.upsert(
+                    {
+                        doc_id: {
+                            **doc_entry,
+                            "doc_keys": doc_entry.get("doc_keys", []) + [doc_key],
+                        }
+                    }
+                )
+            keyed[doc_key] = {"doc_id": doc_id}
+        await self.doc_chunks.upsert(new_entries)
+        await self.doc_keys.upsert(keyed)
+        if new_entries or keyed:
+            await self._insert_done()
+            logger.info(
+                f"Indexed {len(new_entries)} earlier documents and {len(keyed)} "
+                "document keys"
+            )
+        return {
+            "documents": len(new_entries),
+            "chunks": sum(len(e["chunk_ids"]) for e in new_entries.values()),
+            "doc_keys": len(keyed),
+        }
+
+    def extraction_cache_stats(self) -> dict:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aextraction_cache_stats())
+
+    async def aextraction_cache_stats(self) -> dict:
+        if self.extraction_cache is None:
+            return {}
+        return await self.extraction_cache.stats()
+
+    def llm_cache_stats(self) -> dict:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.allm_cache_stats())
+
+    async def allm_cache_stats(self) -> dict:
+        """Hits, misses, evictions and size of the LLM call cache."""
+        return await self.llm_call_cache.stats()
+
+    def export_extraction_cache(self, file_name: str) -> int:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aexport_extraction_cache(file_name))
+
+    async def aexport_extraction_cache(self, file_name: str) -> int:
+        """Write the extraction cache to ``file_name`` for another working directory."""
+        if self.extraction_cache is None:
+            raise ValueError("The extraction cache is disabled")
+        return await self.extraction_cache.export(file_name)
+
+    def import_extraction_cache(self, file_name: str) -> int:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aimport_extraction_cache(file_name))
+
+    async def aimport_extraction_cache(self, file_name: str) -> int:
+        """Add the entries of an exported extraction cache that are missing here."""
+        if self.extraction_cache is None:
+            raise ValueError("The extraction cache is disabled")
+        return await self.extraction_cache.load(file_name)
+
+    def summary_backlog(self) -> int:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.asummary_backlog())
+
+    async def asummary_backlog(self) -> int:
+        """Entities and relationships still waiting for a description summary."""
+        if self.summary_queue is None:
+            return 0
+        return await self.summary_queue.backlog()
+
+    def summarize_pending(self) -> int:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.asummarize_pending())
+
+    def scheduler_stats(self) -> dict:
+        """Queue depth, in-flight calls and waits per priority class, and the
+        calls that shared an identical one in flight."""
+        return {
+            "llm": self.llm_scheduler.stats(),
+            "embedding": self.embedding_scheduler.stats(),
+            "single_flight": {
+                "llm": self.llm_single_flight.stats(),
+                "embedding": self.embedding_single_flight.stats(),
+            },
+        }
+
+    async def asummarize_pending(self) -> int:
+        """Summarize the whole backlog now (after a background drain in
+        progress); returns the number of descriptions summarized."""
+        if self.summary_queue is None:
+            return 0
+        return await self.summary_queue.wait(asdict(self))
@@ -0,0 +1,162 @@
+import base64
+import zlib
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+
+from .base import BaseKVStorage
+from .utils import logger
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _lsh_bands(threshold: float, num_perm: int) -> tuple[int, int]:
+    """Pick ``(bands, rows)`` so the LSH S-curve turns at about ``threshold``."""
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    """In-memory MinHash signatures over character shingles with LSH banding.
+
+    Character shingles keep it language agnostic, which matters for Malayalam
+    where word boundaries are less useful than for English.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _lsh_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._signatures: dict[str, np.ndarray] = {}
+        self._buckets: list[dict[bytes, set]] = [
+            defaultdict(set) for _ in range(self.bands)
+        ]
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, key: str):
+        return key in self._signatures
+
+    def signature(self, text: str) -> np.ndarray:
+        text = " ".join(text.lower().split())
+        k = self.shingle_size
+        shingles = (
+            {text}
+            if len(text) <= k
+            else {text[i : i + k] for i in range(len(text) - k + 1)}
+        )
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows : (band + 1) * self.rows].tobytes()
+
+    def insert(self, key: str, signature: np.ndarray):
+        if key in self._signatures:
+            return
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band][band_key].add(key)
+
+    def remove(self, key: str):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in self._band_keys(signature):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def query(
+        self, signature: np.ndarray, exclude: str = None
+    ) -> Optional[tuple[str, float]]:
+        """Return the most similar indexed key with an estimated Jaccard
+        similarity of at least ``threshold``, as ``(key, similarity)``."""
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        candidates.discard(exclude)
+        best = None
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index of every ingested chunk, persisted in a KV namespace
+    (chunk id -> signature) and rebuilt in memory on first use."""
+
+    def __init__(
+        self, kv_storage: BaseKVStorage, threshold: float, num_perm: int = 128
+    ):
+        self.kv_storage = kv_storage
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self._loaded = False
+
+    async def _load(self):
+        if self._loaded:
+            return
+        keys = await self.kv_storage.all_keys()
+        for key, value in zip(keys, await self.kv_storage.get_by_ids(keys)):
+            if value is None or value.get("num_perm") != self.lsh.num_perm:
+                continue
+            self.lsh.insert(
+                key,
+                np.frombuffer(base64.b64decode(value["signature"]), dtype=np.uint32),
+            )
+        self._loaded = True
+        logger.info(
+            f"Loaded {len(self.lsh)} chunk signatures for near-duplicate lookup"
+        )
+
+    async def find_twin_then_add(self, chunk_key: str, content: str) -> Optional[str]:
+        """Index ``content`` under ``chunk_key`` and return the id of an already
+        indexed near-duplicate chunk, if there is one."""
+        await self._load()
+        signature = self.lsh.signature(content)
+        twin = self.lsh.query(signature, exclude=chunk_key)
+        if chunk_key not in self.lsh:
+            self.lsh.insert(chunk_key, signature)
+            await self.kv_storage.upsert(
+                {
+                    chunk_key: {
+                        "signature": base64.b64encode(signature.tobytes()).decode(),
+                        "num_perm": self.lsh.num_perm,
+                    }
+                }
+            )
+        return twin[0] if twin else None
+
+    async def remove(self, chunk_keys: list[str]):
+        await self._load()
+        for key in chunk_keys:
+            self.lsh.remove(key)
+        await self.kv_storage.delete(chunk_keys)
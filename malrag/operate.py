@@ -2,15 +2,13 @@ import asyncio
 import json
 import re
 from tqdm.asyncio import tqdm as tqdm_async
-from typing import Union
+from typing import Iterator, Optional, Union
 from collections import Counter, defaultdict
 import warnings
 from .utils import (
     logger,
     clean_str,
     compute_mdhash_id,
-    decode_tokens_by_tiktoken,
-    encode_string_by_tiktoken,
     is_float_regex,
     list_of_list_to_csv,
     pack_user_ass_to_openai_messages,
@@ -21,6 +19,7 @@ from .utils import (
     handle_cache,
     save_to_cache,
     CacheData,
+    KeyedLock,
 )
 from .base import (
     BaseGraphStorage,
@@ -29,28 +28,53 @@ from .base import (
     TextChunkSchema,
     QueryParam,
 )
+from .extraction_cache import ExtractionCache
+from .gazetteer import LocalEntityTagger
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
+from .tokenizer import Tokenizer, get_tokenizer, get_tokenizer_from_config
 
 
 def chunking_by_token_size(
-    content: str, overlap_token_size=128, max_token_size=1024, tiktoken_model="gpt2"
+    content: str,
+    overlap_token_size=128,
+    max_token_size=1024,
+    tiktoken_model="gpt2",
+    tokenizer: Tokenizer = None,
 ):
-    tokens = encode_string_by_tiktoken(content, model_name=tiktoken_model)
-    results = []
-    for index, start in enumerate(
-        range(0, len(tokens), max_token_size - overlap_token_size)
-    ):
-        chunk_content = decode_tokens_by_tiktoken(
-            tokens[start : start + max_token_size], model_name=tiktoken_model
+    return list(
+        iter_chunks_by_token_size(
+            content,
+            overlap_token_size=overlap_token_size,
+            max_token_size=max_token_size,
+            tiktoken_model=tiktoken_model,
+            tokenizer=tokenizer,
         )
-        results.append(
-            {
-                "tokens": min(max_token_size, len(tokens) - start),
-                "content": chunk_content.strip(),
-                "chunk_order_index": index,
-            }
-        )
-    return results
+    )
+
+
+def iter_chunks_by_token_size(
+    content: str,
+    overlap_token_size=128,
+    max_token_size=1024,
+    tiktoken_model="gpt2",
+    tokenizer: Tokenizer = None,
+) -> Iterator[TextChunkSchema]:
+    """Yield overlapping token windows of ``content`` as slices of the original string.
+
+    The document is encoded once; see ``Tokenizer.iter_windows``. Without an
+    explicit ``tokenizer`` the tiktoken BPE of ``tiktoken_model`` is used.
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer("tiktoken", tiktoken_model)
+    for index, (n_tokens, chunk_content) in enumerate(
+        tokenizer.iter_windows(content, max_token_size, overlap_token_size)
+    ):
+        yield {
+            "tokens": n_tokens,
+            "tokenizer": tokenizer.name,
+            "content": chunk_content.strip(),
+            "chunk_order_index": index,
+        }
 
 
 async def _handle_entity_relation_summary(
@@ -60,19 +84,16 @@ async def _handle_entity_relation_summary(
 ) -> str:
     use_llm_func: callable = global_config["llm_model_func"]
     llm_max_tokens = global_config["llm_model_max_token_size"]
-    tiktoken_model_name = global_config["tiktoken_model_name"]
+    tokenizer = get_tokenizer_from_config(global_config)
     summary_max_tokens = global_config["entity_summary_to_max_tokens"]
     language = global_config["addon_params"].get(
         "language", PROMPTS["DEFAULT_LANGUAGE"]
     )
 
-    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
+    if tokenizer.count(description) < summary_max_tokens:  # No need for summary
         return description
     prompt_template = PROMPTS["summarize_entity_descriptions"]
-    use_description = decode_tokens_by_tiktoken(
-        tokens[:llm_max_tokens], model_name=tiktoken_model_name
-    )
+    use_description = tokenizer.truncate(description, llm_max_tokens)
     context_base = dict(
         entity_name=entity_or_relation_name,
         description_list=use_description.split(GRAPH_FIELD_SEP),
@@ -80,10 +101,92 @@ async def _handle_entity_relation_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {entity_or_relation_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    summary = await use_llm_func(
+        use_prompt, max_tokens=summary_max_tokens, cache_site="summary"
+    )
     return summary
 
 
+async def summarize_descriptions(
+    items: dict[str, tuple[str, str]], global_config: dict
+) -> dict[str, str]:
+    """Summarize several ``key -> (entity or relation name, description)`` items
+    with one prompt. Items the response leaves out are summarized on their own,
+    as is a single item."""
+    if len(items) == 1:
+        ((key, (name, description)),) = items.items()
+        return {
+            key: await _handle_entity_relation_summary(name, description, global_config)
+        }
+
+    use_llm_func: callable = global_config["llm_model_func"]
+    tokenizer = get_tokenizer_from_config(global_config)
+    summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+    # the descriptions share the prompt budget
+    item_max_tokens = global_config["llm_model_max_token_size"] // len(items)
+    keys = list(items)
+    context_base = dict(
+        tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
+        record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
+        completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
+        language=global_config["addon_params"].get(
+            "language", PROMPTS["DEFAULT_LANGUAGE"]
+        ),
+    )
+    use_prompt = PROMPTS["summarize_descriptions_batch"].format(
+        **context_base,
+        items="\n".join(
+            PROMPTS["summarize_descriptions_batch_item"].format(
+                item_id=i + 1,
+                entity_name=items[key][0],
+                description_list=tokenizer.truncate(
+                    items[key][1], item_max_tokens
+                ).split(GRAPH_FIELD_SEP),
+            )
+            for i, key in enumerate(keys)
+        ),
+    )
+    logger.debug(f"Trigger batched summary of {len(items)} descriptions")
+    result = await use_llm_func(
+        use_prompt, max_tokens=summary_max_tokens * len(items), cache_site="summary"
+    )
+
+    summaries = {}
+    for record in split_string_by_multi_markers(
+        result,
+        [context_base["record_delimiter"], context_base["completion_delimiter"]],
+    ):
+        record = re.search(r"\((.*)\)", record, re.DOTALL)
+        if record is None:
+            continue
+        record_attributes = split_string_by_multi_markers(
+            record.group(1), [context_base["tuple_delimiter"]]
+        )
+        if len(record_attributes) < 3 or record_attributes[0] != '"summary"':
+            continue
+        item_id = clean_str(record_attributes[1]).strip('"')
+        summary = clean_str(record_attributes[2]).strip('"')
+        if item_id.isdigit() and 0 < int(item_id) <= len(keys) and summary:
+            summaries[keys[int(item_id) - 1]] = summary
+
+    missing = [key for key in keys if key not in summaries]
+    if missing:
+        logger.debug(
+            f"Batched summary left out {len(missing)} items, summarizing them alone"
+        )
+        for key, summary in zip(
+            missing,
+            await asyncio.gather(
+                *[
+                    _handle_entity_relation_summary(*items[key], global_config)
+                    for key in missing
+                ]
+            ),
+        ):
+            summaries[key] = summary
+    return summaries
+
+
 async def _handle_single_entity_extraction(
     record_attributes: list[str],
     chunk_key: str,
@@ -131,17 +234,20 @@ async def _handle_single_relationship_extraction(
     )
 
 
-async def _merge_nodes_then_upsert(
+async def _merge_node_data(
     entity_name: str,
     nodes_data: list[dict],
-    knowledge_graph_inst: BaseGraphStorage,
+    already_node: Union[dict, None],
     global_config: dict,
-):
+    summarize: bool = True,
+) -> dict:
+    """Merge ``nodes_data`` into ``already_node`` (None: a new node) and return
+    the node to store, summarizing the description when it grew too long
+    (unless ``summarize`` is off: the caller queues it for later)."""
     already_entity_types = []
     already_source_ids = []
     already_description = []
 
-    already_node = await knowledge_graph_inst.get_node(entity_name)
     if already_node is not None:
         already_entity_types.append(already_node["entity_type"])
         already_source_ids.extend(
@@ -156,42 +262,48 @@ async def _merge_nodes_then_upsert(
         key=lambda x: x[1],
         reverse=True,
     )[0][0]
+    # records from the local tagger carry no description
     description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in nodes_data] + already_description))
+        sorted(
+            set(
+                [dp["description"] for dp in nodes_data if dp["description"]]
+                + already_description
+            )
+        )
     )
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in nodes_data] + already_source_ids)
     )
-    description = await _handle_entity_relation_summary(
-        entity_name, description, global_config
-    )
-    node_data = dict(
+    if summarize:
+        description = await _handle_entity_relation_summary(
+            entity_name, description, global_config
+        )
+    return dict(
         entity_type=entity_type,
         description=description,
         source_id=source_id,
+        **get_tokenizer_from_config(global_config).count_fields(
+            description, "description_tokens"
+        ),
     )
-    await knowledge_graph_inst.upsert_node(
-        entity_name,
-        node_data=node_data,
-    )
-    node_data["entity_name"] = entity_name
-    return node_data
 
 
-async def _merge_edges_then_upsert(
+async def _merge_edge_data(
     src_id: str,
     tgt_id: str,
     edges_data: list[dict],
-    knowledge_graph_inst: BaseGraphStorage,
+    already_edge: Union[dict, None],
     global_config: dict,
-):
+    summarize: bool = True,
+) -> tuple[dict, dict]:
+    """Merge ``edges_data`` into ``already_edge`` (None: a new edge). Returns the
+    edge to store and the node to create for an endpoint missing from the graph."""
     already_weights = []
     already_source_ids = []
     already_description = []
     already_keywords = []
 
-    if await knowledge_graph_inst.has_edge(src_id, tgt_id):
-        already_edge = await knowledge_graph_inst.get_edge(src_id, tgt_id)
+    if already_edge is not None:
         already_weights.append(already_edge["weight"])
         already_source_ids.extend(
             split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
@@ -203,60 +315,80 @@ async def _merge_edges_then_upsert(
 
     weight = sum([dp["weight"] for dp in edges_data] + already_weights)
     description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in edges_data] + already_description))
+        sorted(
+            set(
+                [dp["description"] for dp in edges_data if dp["description"]]
+                + already_description
+            )
+        )
     )
     keywords = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["keywords"] for dp in edges_data] + already_keywords))
+        sorted(
+            set(
+                [dp["keywords"] for dp in edges_data if dp["keywords"]]
+                + already_keywords
+            )
+        )
     )
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in edges_data] + already_source_ids)
     )
-    for need_insert_id in [src_id, tgt_id]:
-        if not (await knowledge_graph_inst.has_node(need_insert_id)):
-            await knowledge_graph_inst.upsert_node(
-                need_insert_id,
-                node_data={
-                    "source_id": source_id,
-                    "description": description,
-                    "entity_type": '"UNKNOWN"',
-                },
-            )
-    description = await _handle_entity_relation_summary(
-        f"({src_id}, {tgt_id})", description, global_config
-    )
-    await knowledge_graph_inst.upsert_edge(
-        src_id,
-        tgt_id,
-        edge_data=dict(
-            weight=weight,
-            description=description,
-            keywords=keywords,
-            source_id=source_id,
-        ),
+    tokenizer = get_tokenizer_from_config(global_config)
+    placeholder_node = {
+        "source_id": source_id,
+        "description": description,
+        "entity_type": '"UNKNOWN"',
+        **tokenizer.count_fields(description, "description_tokens"),
+    }
+    if summarize:
+        description = await _handle_entity_relation_summary(
+            f"({src_id}, {tgt_id})", description, global_config
+        )
+    edge_data = dict(
+        weight=weight,
+        description=description,
+        keywords=keywords,
+        source_id=source_id,
+        **tokenizer.count_fields(description, "description_tokens"),
     )
+    return edge_data, placeholder_node
 
-    edge_data = dict(
+
+def _edge_record(src_id: str, tgt_id: str, edge_data: dict) -> dict:
+    return dict(
         src_id=src_id,
         tgt_id=tgt_id,
-        description=description,
-        keywords=keywords,
+        description=edge_data["description"],
+        keywords=edge_data["keywords"],
     )
 
-    return edge_data
 
+def needs_summary(data: dict, global_config: dict) -> bool:
+    """Whether a node or edge description is long enough to be summarized."""
+    tokenizer = get_tokenizer_from_config(global_config)
+    n_tokens = tokenizer.stored_count(data, "description_tokens")
+    if n_tokens is None:
+        n_tokens = tokenizer.count(data["description"])
+    return n_tokens >= global_config["entity_summary_to_max_tokens"]
 
-async def extract_entities(
-    chunks: dict[str, TextChunkSchema],
-    knowledge_graph_inst: BaseGraphStorage,
-    entity_vdb: BaseVectorStorage,
-    relationships_vdb: BaseVectorStorage,
-    global_config: dict,
-) -> Union[BaseGraphStorage, None]:
-    use_llm_func: callable = global_config["llm_model_func"]
-    entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
 
-    ordered_chunks = list(chunks.items())
-    # add language and example number params to prompt
+def graph_merge_locks(knowledge_graph_inst: BaseGraphStorage) -> KeyedLock:
+    """The per-node/per-edge locks every read-merge-write of this graph holds,
+    so concurrent inserts and deletions never overwrite each other's merge."""
+    locks = getattr(knowledge_graph_inst, "_merge_locks", None)
+    if locks is None:
+        locks = knowledge_graph_inst._merge_locks = KeyedLock()
+    return locks
+
+
+def merge_lock_keys(node_ids, edge_keys) -> list[str]:
+    return [f"node:{node_id}" for node_id in node_ids] + [
+        f"edge:{src_id}\x00{tgt_id}" for src_id, tgt_id in edge_keys
+    ]
+
+
+def build_extraction_context(global_config: dict) -> dict:
+    """Format the entity extraction prompt pieces shared by every chunk."""
     language = global_config["addon_params"].get(
         "language", PROMPTS["DEFAULT_LANGUAGE"]
     )
@@ -281,8 +413,7 @@ async def extract_entities(
     # add example's format
     examples = examples.format(**example_context_base)
 
-    entity_extract_prompt = PROMPTS["entity_extraction"]
-    context_base = dict(
+    return dict(
         tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
         record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
         completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
@@ -291,142 +422,505 @@ async def extract_entities(
         language=language,
     )
 
-    continue_prompt = PROMPTS["entiti_continue_extraction"]
+
+_EXTRACTION_RECORD = re.compile(r"\((.*)\)")
+
+
+class ExtractionRecordParser:
+    """Incremental parser for entity extraction output.
+
+    ``feed`` takes the output piece by piece, e.g. as the LLM streams it, and
+    parses each record as soon as the delimiter after it arrives, so only the
+    unfinished record is ever buffered and the output is scanned once. ``close``
+    parses what is left, and is called at the end of every response so records
+    never run across two of them. ``records`` holds every record's attributes, split on
+    the tuple delimiter.
+
+    With ``n_texts`` the output of a packed prompt is routed to its texts by the
+    ``("text"<|>n)`` lines, as ``split_packed_extraction_result`` cuts it:
+    ``records[i]`` holds the records of text ``i + 1`` and ``seen_texts`` the
+    indexes of the texts whose line was written. Without, ``records[0]`` holds
+    all of them.
+    """
+
+    def __init__(self, context_base: dict, n_texts: Optional[int] = None):
+        separators = [
+            re.escape(context_base["record_delimiter"]),
+            re.escape(context_base["completion_delimiter"]),
+        ]
+        if n_texts is not None:
+            separators.append(
+                r'\(\s*"?text"?\s*'
+                + re.escape(context_base["tuple_delimiter"])
+                + r'\s*"?(\d+)"?\s*\)'
+            )
+        self._separator = re.compile("|".join(separators), re.IGNORECASE)
+        self._tuple_delimiter = re.compile(re.escape(context_base["tuple_delimiter"]))
+        self._n_texts = n_texts
+        # records before the first text line of a packed output are dropped
+        self._text = None if n_texts is not None else 0
+        self._buffer = ""
+        self.records: list[list[list[str]]] = [[] for _ in range(n_texts or 1)]
+        self.seen_texts: set[int] = set()
+
+    def feed(self, output: str):
+        self._buffer += output
+        start = 0
+        for match in self._separator.finditer(self._buffer):
+            self._add_record(self._buffer[start : match.start()])
+            if match.lastindex:
+                index = int(match.group(1)) - 1
+                self._text = index if 0 <= index < self._n_texts else None
+                if self._text is not None:
+                    self.seen_texts.add(self._text)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+
+    def close(self):
+        self._add_record(self._buffer)
+        self._buffer = ""
+
+    def _add_record(self, record: str):
+        record = _EXTRACTION_RECORD.search(record)
+        if record is None or self._text is None:
+            return
+        self.records[self._text].append(
+            [
+                attribute.strip()
+                for attribute in self._tuple_delimiter.split(record.group(1))
+                if attribute.strip()
+            ]
+        )
+
+
+async def _complete_extraction(
+    use_llm_func: callable,
+    prompt: str,
+    parser: Optional[ExtractionRecordParser] = None,
+    **kwargs,
+) -> str:
+    """One extraction LLM call. With ``parser`` the completion is requested as a
+    stream and parsed while it arrives; an LLM function that ignores ``stream``
+    and returns the whole text is parsed at once."""
+    if parser is None:
+        return await use_llm_func(prompt, **kwargs)
+    response = await use_llm_func(prompt, stream=True, **kwargs)
+    if isinstance(response, str):
+        parser.feed(response)
+        parser.close()
+        return response
+    pieces = []
+    try:
+        async for piece in response:
+            pieces.append(piece)
+            parser.feed(piece)
+    finally:
+        # hands the scheduler slot and the provider key back if parsing failed
+        if hasattr(response, "aclose"):
+            await response.aclose()
+    parser.close()
+    return "".join(pieces)
+
+
+def _count_extraction_records(result: str) -> int:
+    return len(re.findall(r'\(\s*"(?:entity|relationship)"', result))
+
+
+def _gleaning_decision_pattern(context_base: dict):
+    return re.compile(
+        r'\(\s*"?more_entities"?\s*'
+        + re.escape(context_base["tuple_delimiter"])
+        + r'\s*"?(yes|no)"?\s*\)',
+        re.IGNORECASE,
+    )
+
+
+async def _run_extraction_prompt(
+    hint_prompt: str,
+    continue_prompt: str,
+    content_tokens: int,
+    context_base: dict,
+    global_config: dict,
+    gleaning_metrics: Optional[Counter] = None,
+    parser: Optional[ExtractionRecordParser] = None,
+) -> str:
+    """Send an extraction prompt, then glean, and return all the LLM output.
+    With ``parser`` every extraction response is streamed into it.
+
+    With ``adaptive_gleaning`` there is no gleaning for texts under
+    ``gleaning_min_chunk_tokens`` or whose first pass already yielded at least
+    ``gleaning_skip_yield`` records per token, and each gleaning round asks for
+    the missed records and the "more entities left?" answer in one response
+    instead of a separate loop-check call. The decision for every prompt is
+    counted in ``gleaning_metrics``.
+    """
+    use_llm_func: callable = global_config["llm_model_func"]
+    entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
     if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
+    adaptive = global_config.get("adaptive_gleaning", False)
+    if gleaning_metrics is None:
+        gleaning_metrics = Counter()
 
-    already_processed = 0
-    already_entities = 0
-    already_relations = 0
+    final_result = await _complete_extraction(
+        use_llm_func, hint_prompt, parser, cache_site="extraction"
+    )
+    if not entity_extract_max_gleaning:
+        return final_result
 
-    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
-        nonlocal already_processed, already_entities, already_relations
-        chunk_key = chunk_key_dp[0]
-        chunk_dp = chunk_key_dp[1]
-        content = chunk_dp["content"]
-        # hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
-        hint_prompt = entity_extract_prompt.format(
-            **context_base, input_text="{input_text}"
-        ).format(**context_base, input_text=content)
-
-        final_result = await use_llm_func(hint_prompt)
-        history = pack_user_ass_to_openai_messages(hint_prompt, final_result)
-        for now_glean_index in range(entity_extract_max_gleaning):
-            glean_result = await use_llm_func(continue_prompt, history_messages=history)
-
-            history += pack_user_ass_to_openai_messages(continue_prompt, glean_result)
-            final_result += glean_result
+    if adaptive:
+        first_pass_yield = _count_extraction_records(final_result) / max(
+            1, content_tokens
+        )
+        skip = None
+        if content_tokens < global_config["gleaning_min_chunk_tokens"]:
+            skip = "skipped_short"
+        elif first_pass_yield >= global_config["gleaning_skip_yield"]:
+            skip = "skipped_yield"
+        logger.debug(
+            f"Gleaning decision: {skip or 'glean'} ({content_tokens} tokens, "
+            f"{first_pass_yield:.4f} records/token)"
+        )
+        if skip:
+            gleaning_metrics[skip] += 1
+            return final_result
+        continue_prompt += PROMPTS["gleaning_decision"].format(**context_base)
+        decision_pattern = _gleaning_decision_pattern(context_base)
+
+    history = pack_user_ass_to_openai_messages(hint_prompt, final_result)
+    # joined once at the end instead of growing a string every round
+    results = [final_result]
+    for now_glean_index in range(entity_extract_max_gleaning):
+        glean_result = await _complete_extraction(
+            use_llm_func,
+            continue_prompt,
+            parser,
+            history_messages=history,
+            cache_site="gleaning",
+        )
+        gleaning_metrics["rounds"] += 1
+
+        history += pack_user_ass_to_openai_messages(continue_prompt, glean_result)
+        if adaptive:
+            decisions = decision_pattern.findall(glean_result)
+            results.append(decision_pattern.sub("", glean_result))
             if now_glean_index == entity_extract_max_gleaning - 1:
+                gleaning_metrics["gleaned_to_max"] += 1
                 break
-
-            if_loop_result: str = await use_llm_func(
-                if_loop_prompt, history_messages=history
-            )
-            if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
-            if if_loop_result != "yes":
+            if not decisions or decisions[-1].lower() != "yes":
+                gleaning_metrics["stopped_by_model"] += 1
                 break
+            continue
 
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
+        results.append(glean_result)
+        if now_glean_index == entity_extract_max_gleaning - 1:
+            break
+
+        if_loop_result: str = await use_llm_func(
+            if_loop_prompt, history_messages=history, cache_site="gleaning"
         )
+        if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
+        if if_loop_result != "yes":
+            break
+    # a response may end without a delimiter, keep its last record apart
+    return context_base["record_delimiter"].join(results)
 
-        maybe_nodes = defaultdict(list)
-        maybe_edges = defaultdict(list)
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
+
+async def extract_single_chunk(
+    chunk_key: str,
+    chunk_dp: TextChunkSchema,
+    context_base: dict,
+    global_config: dict,
+    extraction_cache: Optional[ExtractionCache] = None,
+    gleaning_metrics: Optional[Counter] = None,
+    local_tagger: Optional[LocalEntityTagger] = None,
+) -> tuple[dict, dict]:
+    """Run the extraction prompt (plus gleaning) on one chunk and parse its records
+    into ``(nodes, edges)`` keyed by entity name and ``(src_id, tgt_id)``.
+
+    With ``extraction_cache`` the LLM is only called when the cache has no
+    output for the chunk's text, and the new output is stored. With
+    ``local_tagger`` a chunk that only mentions known entities is tagged
+    locally instead."""
+    results = await extract_packed_chunks(
+        [(chunk_key, chunk_dp)],
+        context_base,
+        global_config,
+        extraction_cache,
+        gleaning_metrics,
+        local_tagger,
+    )
+    return results[0]
+
+
+def _extraction_parser(
+    context_base: dict, global_config: dict, n_texts: Optional[int] = None
+) -> Optional[ExtractionRecordParser]:
+    if not global_config.get("stream_extraction", False):
+        return None
+    return ExtractionRecordParser(context_base, n_texts)
+
+
+async def _extract_chunk_text(
+    chunk_dp: TextChunkSchema,
+    context_base: dict,
+    global_config: dict,
+    gleaning_metrics: Optional[Counter] = None,
+) -> tuple[str, Optional[list[list[str]]]]:
+    """The LLM output for one chunk, and its records when they were parsed
+    from the stream (``stream_extraction``)."""
+    entity_extract_prompt = PROMPTS["entity_extraction"]
+    continue_prompt = PROMPTS["entiti_continue_extraction"]
+
+    content = chunk_dp["content"]
+    # hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
+    hint_prompt = entity_extract_prompt.format(
+        **context_base, input_text="{input_text}"
+    ).format(**context_base, input_text=content)
+
+    parser = _extraction_parser(context_base, global_config)
+    final_result = await _run_extraction_prompt(
+        hint_prompt,
+        continue_prompt,
+        chunk_dp["tokens"],
+        context_base,
+        global_config,
+        gleaning_metrics,
+        parser,
+    )
+    return final_result, parser.records[0] if parser is not None else None
+
+
+def extraction_pack_budget(context_base: dict, global_config: dict) -> int:
+    """How many chunk tokens one packed extraction prompt can take.
+
+    Whatever ``llm_model_max_token_size`` leaves after the instructions and
+    examples is shared by the chunks and the records written back for them,
+    which are assumed to be about as long as the chunks themselves for the
+    first pass and again for every gleaning round (each sent back as history).
+    """
+    tokenizer = get_tokenizer_from_config(global_config)
+    overhead = tokenizer.count(
+        PROMPTS["entity_extraction"].format(
+            **context_base,
+            input_text=PROMPTS["packed_extraction_input"].format(
+                **context_base, n_texts=0, texts=""
+            ),
+        )
+    )
+    turns = 2 + global_config["entity_extract_max_gleaning"]
+    return max(0, (global_config["llm_model_max_token_size"] - overhead) // turns)
+
+
+def pack_chunks_for_extraction(
+    chunks: list[tuple[str, TextChunkSchema]], max_pack_size: int, budget: int
+) -> list[list[tuple[str, TextChunkSchema]]]:
+    """Group consecutive chunks into packs of at most ``max_pack_size`` chunks
+    and ``budget`` tokens; a chunk larger than the budget gets a pack of its own."""
+    packs = []
+    pack = []
+    pack_tokens = 0
+    for chunk_key, chunk_dp in chunks:
+        if pack and (
+            len(pack) >= max_pack_size or pack_tokens + chunk_dp["tokens"] > budget
+        ):
+            packs.append(pack)
+            pack = []
+            pack_tokens = 0
+        pack.append((chunk_key, chunk_dp))
+        pack_tokens += chunk_dp["tokens"]
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def split_packed_extraction_result(
+    final_result: str, n_texts: int, context_base: dict
+) -> list[Union[str, None]]:
+    """Cut the output of a packed prompt at its ``("text"<|>n)`` lines.
+
+    Returns the output of every text in pack order, None for texts whose line
+    the LLM never wrote. Output before the first line is dropped.
+    """
+    marker = re.compile(
+        r'\(\s*"?text"?\s*'
+        + re.escape(context_base["tuple_delimiter"])
+        + r'\s*"?(\d+)"?\s*\)',
+        re.IGNORECASE,
+    )
+    parts = marker.split(final_result)
+    sections = [None] * n_texts
+    for text_id, section in zip(parts[1::2], parts[2::2]):
+        index = int(text_id) - 1
+        if not 0 <= index < n_texts:
+            continue
+        # gleaning rounds repeat the line for the texts they add records to
+        sections[index] = (
+            section
+            if sections[index] is None
+            else sections[index] + context_base["record_delimiter"] + section
+        )
+    return sections
+
+
+async def _extract_pack_texts(
+    chunk_dps: list[TextChunkSchema],
+    context_base: dict,
+    global_config: dict,
+    gleaning_metrics: Optional[Counter] = None,
+) -> list[tuple[str, Optional[list[list[str]]]]]:
+    texts = "\n\n".join(
+        f'("text"{context_base["tuple_delimiter"]}{i})\n{chunk_dp["content"]}'
+        for i, chunk_dp in enumerate(chunk_dps, start=1)
+    )
+    input_text = PROMPTS["packed_extraction_input"].format(
+        **context_base, n_texts=len(chunk_dps), texts=texts
+    )
+    hint_prompt = (
+        PROMPTS["entity_extraction"]
+        .format(**context_base, input_text="{input_text}")
+        .format(**context_base, input_text=input_text)
+    )
+    continue_prompt = PROMPTS["packed_continue_extraction"].format(**context_base)
+
+    parser = _extraction_parser(context_base, global_config, len(chunk_dps))
+    final_result = await _run_extraction_prompt(
+        hint_prompt,
+        continue_prompt,
+        sum(chunk_dp["tokens"] for chunk_dp in chunk_dps),
+        context_base,
+        global_config,
+        gleaning_metrics,
+        parser,
+    )
+    # the sections are still cut from the text, the extraction cache keeps them
+    sections = split_packed_extraction_result(
+        final_result, len(chunk_dps), context_base
+    )
+    outputs = []
+    for i, section in enumerate(sections):
+        if section is None:
+            logger.warning(
+                f"Packed extraction returned nothing for text {i + 1} of "
+                f"{len(chunk_dps)}, extracting it alone"
             )
-            if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk_key
+            outputs.append(
+                await _extract_chunk_text(
+                    chunk_dps[i], context_base, global_config, gleaning_metrics
+                )
             )
-            if if_entities is not None:
-                maybe_nodes[if_entities["entity_name"]].append(if_entities)
-                continue
+        else:
+            outputs.append((section, parser.records[i] if parser is not None else None))
+    return outputs
 
-            if_relation = await _handle_single_relationship_extraction(
-                record_attributes, chunk_key
+
+async def extract_packed_chunks(
+    chunks: list[tuple[str, TextChunkSchema]],
+    context_base: dict,
+    global_config: dict,
+    extraction_cache: Optional[ExtractionCache] = None,
+    gleaning_metrics: Optional[Counter] = None,
+    local_tagger: Optional[LocalEntityTagger] = None,
+) -> list[tuple[dict, dict]]:
+    """Extract several chunks with one prompt (plus gleaning) and return every
+    chunk's ``(nodes, edges)`` in order, as ``extract_single_chunk`` would.
+
+    Each chunk is introduced by a ``("text"<|>n)`` line that the LLM repeats
+    ahead of that chunk's records. A chunk whose line is missing from the output
+    is extracted again on its own. With ``extraction_cache``, cached chunks are
+    left out of the prompt and every chunk's share of the output is stored.
+    With ``local_tagger``, uncached chunks that mention only known entities are
+    tagged locally and left out too (their result depends on the graph, so it
+    is not cached). ``gleaning_metrics`` counts the gleaning decisions, see
+    ``_run_extraction_prompt``.
+    """
+    contents = [chunk_dp["content"] for _, chunk_dp in chunks]
+    outputs = [None] * len(chunks)
+    if extraction_cache is not None:
+        for i, content in enumerate(contents):
+            outputs[i] = await extraction_cache.get(
+                content, context_base, global_config
+            )
+    missing = [i for i, output in enumerate(outputs) if output is None]
+    tagged = {}
+    if local_tagger is not None:
+        for i in missing:
+            result = await local_tagger.extract(*chunks[i])
+            if result is not None:
+                tagged[i] = result
+        missing = [i for i in missing if i not in tagged]
+    # records parsed while the output streamed in, those chunks skip the parse
+    records = [None] * len(chunks)
+    if len(missing) == 1:
+        new_outputs = [
+            await _extract_chunk_text(
+                chunks[missing[0]][1], context_base, global_config, gleaning_metrics
             )
-            if if_relation is not None:
-                maybe_edges[(if_relation["src_id"], if_relation["tgt_id"])].append(
-                    if_relation
-                )
-        already_processed += 1
-        already_entities += len(maybe_nodes)
-        already_relations += len(maybe_edges)
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
         ]
-        print(
-            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
-            end="",
-            flush=True,
+    elif missing:
+        new_outputs = await _extract_pack_texts(
+            [chunks[i][1] for i in missing],
+            context_base,
+            global_config,
+            gleaning_metrics,
+        )
+    else:
+        new_outputs = []
+    for i, (output, output_records) in zip(missing, new_outputs):
+        outputs[i] = output
+        records[i] = output_records
+        if extraction_cache is not None:
+            await extraction_cache.put(contents[i], output, context_base, global_config)
+    return [
+        tagged[i]
+        if i in tagged
+        else await parse_extraction_result(output, chunk_key, context_base)
+        if chunk_records is None
+        else await _records_to_graph(chunk_records, chunk_key)
+        for i, ((chunk_key, _), output, chunk_records) in enumerate(
+            zip(chunks, outputs, records)
         )
-        return dict(maybe_nodes), dict(maybe_edges)
+    ]
 
-    results = []
-    for result in tqdm_async(
-        asyncio.as_completed([_process_single_content(c) for c in ordered_chunks]),
-        total=len(ordered_chunks),
-        desc="Extracting entities from chunks",
-        unit="chunk",
-    ):
-        results.append(await result)
 
+async def parse_extraction_result(
+    final_result: str, chunk_key: str, context_base: dict
+) -> tuple[dict, dict]:
+    parser = ExtractionRecordParser(context_base)
+    parser.feed(final_result)
+    parser.close()
+    return await _records_to_graph(parser.records[0], chunk_key)
+
+
+async def _records_to_graph(
+    records: list[list[str]], chunk_key: str
+) -> tuple[dict, dict]:
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
-    for m_nodes, m_edges in results:
-        for k, v in m_nodes.items():
-            maybe_nodes[k].extend(v)
-        for k, v in m_edges.items():
-            maybe_edges[tuple(sorted(k))].extend(v)
-    logger.info("Inserting entities into storage...")
-    all_entities_data = []
-    for result in tqdm_async(
-        asyncio.as_completed(
-            [
-                _merge_nodes_then_upsert(k, v, knowledge_graph_inst, global_config)
-                for k, v in maybe_nodes.items()
-            ]
-        ),
-        total=len(maybe_nodes),
-        desc="Inserting entities",
-        unit="entity",
-    ):
-        all_entities_data.append(await result)
-
-    logger.info("Inserting relationships into storage...")
-    all_relationships_data = []
-    for result in tqdm_async(
-        asyncio.as_completed(
-            [
-                _merge_edges_then_upsert(
-                    k[0], k[1], v, knowledge_graph_inst, global_config
-                )
-                for k, v in maybe_edges.items()
-            ]
-        ),
-        total=len(maybe_edges),
-        desc="Inserting relationships",
-        unit="relationship",
-    ):
-        all_relationships_data.append(await result)
+    for record_attributes in records:
+        if_entities = await _handle_single_entity_extraction(
+            record_attributes, chunk_key
+        )
+        if if_entities is not None:
+            maybe_nodes[if_entities["entity_name"]].append(if_entities)
+            continue
 
-    if not len(all_entities_data) and not len(all_relationships_data):
-        logger.warning(
-            "Didn't extract any entities and relationships, maybe your LLM is not working"
+        if_relation = await _handle_single_relationship_extraction(
+            record_attributes, chunk_key
         )
-        return None
+        if if_relation is not None:
+            maybe_edges[(if_relation["src_id"], if_relation["tgt_id"])].append(
+                if_relation
+            )
+    return dict(maybe_nodes), dict(maybe_edges)
 
-    if not len(all_entities_data):
-        logger.warning("Didn't extract any entities")
-    if not len(all_relationships_data):
-        logger.warning("Didn't extract any relationships")
 
-    if entity_vdb is not None:
+async def upsert_extraction_vectors(
+    all_entities_data: list[dict],
+    all_relationships_data: list[dict],
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+):
+    if entity_vdb is not None and all_entities_data:
         data_for_vdb = {
             compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
                 "content": dp["entity_name"] + dp["description"],
@@ -436,7 +930,7 @@ async def extract_entities(
         }
         await entity_vdb.upsert(data_for_vdb)
 
-    if relationships_vdb is not None:
+    if relationships_vdb is not None and all_relationships_data:
         data_for_vdb = {
             compute_mdhash_id(dp["src_id"] + dp["tgt_id"], prefix="rel-"): {
                 "src_id": dp["src_id"],
@@ -450,9 +944,359 @@ async def extract_entities(
         }
         await relationships_vdb.upsert(data_for_vdb)
 
+
+async def merge_extraction_results(
+    results: list[tuple[dict, dict]],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+    summary_queue=None,
+) -> tuple[list[dict], list[dict]]:
+    """Merge per-chunk ``(nodes, edges)`` into the graph and the entity/relation
+    vector stores (skipped when they are None). Returns the upserted entity and
+    relationship records.
+
+    With ``summary_queue`` (a ``SummaryQueue``) descriptions that grew past
+    ``entity_summary_to_max_tokens`` are stored as they are and queued for a
+    batched summary later, instead of stalling the merge on one LLM call each.
+
+    The batch is merged in three steps: every node and edge it touches is
+    fetched with the bulk graph API, merged in memory, then written back in
+    bulk. The locks of those nodes and edges are held throughout, so a
+    concurrent merge of the same keys waits for this one.
+    """
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for m_nodes, m_edges in results:
+        for k, v in m_nodes.items():
+            maybe_nodes[k].extend(v)
+        for k, v in m_edges.items():
+            maybe_edges[tuple(sorted(k))].extend(v)
+    node_ids = set(maybe_nodes)
+    for src_id, tgt_id in maybe_edges:
+        node_ids.update((src_id, tgt_id))
+
+    async with graph_merge_locks(knowledge_graph_inst).hold(
+        merge_lock_keys(node_ids, maybe_edges)
+    ):
+        already_nodes = await knowledge_graph_inst.get_nodes(list(node_ids))
+        already_edges = await knowledge_graph_inst.get_edges(list(maybe_edges))
+
+        async def _merge_node(entity_name, nodes_data):
+            return entity_name, await _merge_node_data(
+                entity_name,
+                nodes_data,
+                already_nodes.get(entity_name),
+                global_config,
+                summary_queue is None,
+            )
+
+        async def _merge_edge(key, edges_data):
+            return key, await _merge_edge_data(
+                key[0],
+                key[1],
+                edges_data,
+                already_edges.get(key),
+                global_config,
+                summary_queue is None,
+            )
+
+        logger.info("Merging entities...")
+        new_nodes = {}
+        for result in tqdm_async(
+            asyncio.as_completed([_merge_node(k, v) for k, v in maybe_nodes.items()]),
+            total=len(maybe_nodes),
+            desc="Merging entities",
+            unit="entity",
+        ):
+            entity_name, node_data = await result
+            new_nodes[entity_name] = node_data
+
+        logger.info("Merging relationships...")
+        new_edges = {}
+        placeholder_nodes = {}
+        for result in tqdm_async(
+            asyncio.as_completed([_merge_edge(k, v) for k, v in maybe_edges.items()]),
+            total=len(maybe_edges),
+            desc="Merging relationships",
+            unit="relationship",
+        ):
+            key, (edge_data, placeholder_node) = await result
+            new_edges[key] = edge_data
+            for need_insert_id in key:
+                if (
+                    need_insert_id not in already_nodes
+                    and need_insert_id not in new_nodes
+                ):
+                    placeholder_nodes.setdefault(need_insert_id, placeholder_node)
+
+        logger.info(
+            f"Writing {len(new_nodes) + len(placeholder_nodes)} entities and "
+            f"{len(new_edges)} relationships to the graph..."
+        )
+        await knowledge_graph_inst.upsert_nodes({**placeholder_nodes, **new_nodes})
+        await knowledge_graph_inst.upsert_edges(new_edges)
+        if summary_queue is not None:
+            await summary_queue.mark(
+                nodes=[
+                    name
+                    for name, node_data in {**placeholder_nodes, **new_nodes}.items()
+                    if needs_summary(node_data, global_config)
+                ],
+                edges=[
+                    key
+                    for key, edge_data in new_edges.items()
+                    if needs_summary(edge_data, global_config)
+                ],
+            )
+
+    all_entities_data = [
+        {**node_data, "entity_name": entity_name}
+        for entity_name, node_data in new_nodes.items()
+    ]
+    all_relationships_data = [
+        _edge_record(src_id, tgt_id, edge_data)
+        for (src_id, tgt_id), edge_data in new_edges.items()
+    ]
+    await upsert_extraction_vectors(
+        all_entities_data, all_relationships_data, entity_vdb, relationships_vdb
+    )
+    return all_entities_data, all_relationships_data
+
+
+async def extract_entities(
+    chunks: dict[str, TextChunkSchema],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+    extraction_cache: Optional[ExtractionCache] = None,
+) -> Union[BaseGraphStorage, None]:
+    ordered_chunks = list(chunks.items())
+    context_base = build_extraction_context(global_config)
+
+    already_processed = 0
+    already_entities = 0
+    already_relations = 0
+
+    packs = pack_chunks_for_extraction(
+        ordered_chunks,
+        max_pack_size=global_config.get("extraction_pack_size", 1),
+        budget=extraction_pack_budget(context_base, global_config),
+    )
+
+    gleaning_metrics = Counter()
+
+    async def _process_pack(pack: list[tuple[str, TextChunkSchema]]):
+        nonlocal already_processed, already_entities, already_relations
+        pack_results = await extract_packed_chunks(
+            pack, context_base, global_config, extraction_cache, gleaning_metrics
+        )
+        for maybe_nodes, maybe_edges in pack_results:
+            already_processed += 1
+            already_entities += len(maybe_nodes)
+            already_relations += len(maybe_edges)
+        now_ticks = PROMPTS["process_tickers"][
+            already_processed % len(PROMPTS["process_tickers"])
+        ]
+        print(
+            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
+            end="",
+            flush=True,
+        )
+        return pack_results
+
+    results = []
+    for pack_results in tqdm_async(
+        asyncio.as_completed([_process_pack(pack) for pack in packs]),
+        total=len(packs),
+        desc="Extracting entities from chunks",
+        unit="pack",
+    ):
+        results.extend(await pack_results)
+    logger.info(f"Gleaning decisions: {dict(gleaning_metrics)}")
+
+    all_entities_data, all_relationships_data = await merge_extraction_results(
+        results, knowledge_graph_inst, entity_vdb, relationships_vdb, global_config
+    )
+
+    if not len(all_entities_data) and not len(all_relationships_data):
+        logger.warning(
+            "Didn't extract any entities and relationships, maybe your LLM is not working"
+        )
+        return None
+
+    if not len(all_entities_data):
+        logger.warning("Didn't extract any entities")
+    if not len(all_relationships_data):
+        logger.warning("Didn't extract any relationships")
+
     return knowledge_graph_inst
 
 
+async def remove_chunks_from_graph(
+    chunk_ids: list[str],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    extraction_records: BaseKVStorage,
+    global_config: dict,
+    summary_queue=None,
+) -> dict:
+    """Drop ``chunk_ids`` from the provenance of the entities and relationships
+    extracted from them.
+
+    The per-chunk extraction records say which nodes and edges a chunk touched,
+    so nothing is scanned. Nodes and edges left without any source chunk are
+    deleted along with their vectors; the others are rebuilt (and re-summarized
+    when needed) from the records of the chunks they still come from.
+
+    Like ``merge_extraction_results``, the nodes and edges are read and written
+    back with the bulk graph API while their merge locks are held, so a merge
+    of the same keys running in an insert can't interleave with the rebuild.
+    """
+    removed = set(chunk_ids)
+    records = await extraction_records.get_by_ids(list(chunk_ids))
+    entity_names = set()
+    edge_keys = set()
+    for record in records:
+        if record is None:
+            continue
+        for dp in record["entities"]:
+            entity_names.add(dp["entity_name"])
+        for dp in record["relationships"]:
+            edge_keys.add(tuple(sorted((dp["src_id"], dp["tgt_id"]))))
+            # endpoints may only exist as placeholders created by the edge
+            entity_names.update((dp["src_id"], dp["tgt_id"]))
+
+    def _remaining(data: dict) -> list[str]:
+        return [
+            s
+            for s in split_string_by_multi_markers(data["source_id"], [GRAPH_FIELD_SEP])
+            if s not in removed
+        ]
+
+    async with graph_merge_locks(knowledge_graph_inst).hold(
+        merge_lock_keys(entity_names, edge_keys)
+    ):
+        nodes = {
+            name: (node, _remaining(node))
+            for name, node in (
+                await knowledge_graph_inst.get_nodes(list(entity_names))
+            ).items()
+        }
+        edges = {
+            key: (edge, _remaining(edge))
+            for key, edge in (
+                await knowledge_graph_inst.get_edges(list(edge_keys))
+            ).items()
+        }
+
+        remaining_ids = set()
+        for _, remaining in list(nodes.values()) + list(edges.values()):
+            remaining_ids.update(remaining)
+        remaining_ids = list(remaining_ids)
+        remaining_records = dict(
+            zip(remaining_ids, await extraction_records.get_by_ids(remaining_ids))
+        )
+
+        def _records_for(remaining: list[str], field: str, match) -> list[dict]:
+            return [
+                dp
+                for chunk_id in remaining
+                if remaining_records.get(chunk_id) is not None
+                for dp in remaining_records[chunk_id][field]
+                if match(dp)
+            ]
+
+        # deletions first: deleting a node also drops edges outside edge_keys,
+        # which must not be written back below. Those edges have the node as
+        # an endpoint, so its lock covers them
+        deleted_edges = {key for key, (_, remaining) in edges.items() if not remaining}
+        deleted_entities = [
+            name for name, (_, remaining) in nodes.items() if not remaining
+        ]
+        for name in deleted_entities:
+            for edge in await knowledge_graph_inst.get_node_edges(name) or []:
+                deleted_edges.add(tuple(sorted(edge)))
+        for key in deleted_edges:
+            if key in edges:
+                await knowledge_graph_inst.delete_edge(*key)
+        for name in deleted_entities:
+            await knowledge_graph_inst.delete_node(name)
+
+        # the rest is rebuilt from the records of the chunks left, or (for
+        # chunks extracted before records were kept) only gets its provenance
+        # fixed, then written back in bulk
+        summarize = summary_queue is None
+        new_edges = {}
+        rebuilt_relationships = []
+        for key, (edge, remaining) in edges.items():
+            if key in deleted_edges:
+                continue
+            edges_data = _records_for(
+                remaining,
+                "relationships",
+                lambda dp: tuple(sorted((dp["src_id"], dp["tgt_id"]))) == key,
+            )
+            if edges_data:
+                new_edges[key], _ = await _merge_edge_data(
+                    key[0], key[1], edges_data, None, global_config, summarize
+                )
+                rebuilt_relationships.append(_edge_record(*key, new_edges[key]))
+            else:
+                new_edges[key] = {**edge, "source_id": GRAPH_FIELD_SEP.join(remaining)}
+        new_nodes = {}
+        rebuilt_entities = []
+        for name, (node, remaining) in nodes.items():
+            if not remaining:
+                continue
+            nodes_data = _records_for(
+                remaining, "entities", lambda dp: dp["entity_name"] == name
+            )
+            if nodes_data:
+                new_nodes[name] = await _merge_node_data(
+                    name, nodes_data, None, global_config, summarize
+                )
+                rebuilt_entities.append({**new_nodes[name], "entity_name": name})
+            else:
+                new_nodes[name] = {**node, "source_id": GRAPH_FIELD_SEP.join(remaining)}
+        await knowledge_graph_inst.upsert_nodes(new_nodes)
+        await knowledge_graph_inst.upsert_edges(new_edges)
+        if summary_queue is not None:
+            await summary_queue.mark(
+                nodes=[
+                    name
+                    for name, node_data in new_nodes.items()
+                    if needs_summary(node_data, global_config)
+                ],
+                edges=[
+                    key
+                    for key, edge_data in new_edges.items()
+                    if needs_summary(edge_data, global_config)
+                ],
+            )
+
+    if entity_vdb is not None and deleted_entities:
+        await entity_vdb.delete(
+            [compute_mdhash_id(name, prefix="ent-") for name in deleted_entities]
+        )
+    if relationships_vdb is not None and deleted_edges:
+        await relationships_vdb.delete(
+            [compute_mdhash_id(src + tgt, prefix="rel-") for src, tgt in deleted_edges]
+        )
+    await upsert_extraction_vectors(
+        rebuilt_entities, rebuilt_relationships, entity_vdb, relationships_vdb
+    )
+    return {
+        "entities_deleted": len(deleted_entities),
+        "entities_rebuilt": len(rebuilt_entities),
+        "relationships_deleted": len(deleted_edges),
+        "relationships_rebuilt": len(rebuilt_relationships),
+    }
+
+
 async def kg_query(
     query,
     knowledge_graph_inst: BaseGraphStorage,
@@ -466,18 +1310,15 @@ async def kg_query(
     # Handle cache
     use_model_func = global_config["llm_model_func"]
     args_hash = compute_args_hash(query_param.mode, query)
-    
+
     logger.info(f"KG Query: '{query}' (Mode: {query_param.mode})")
-    
+
     cached_response, quantized, min_val, max_val = await handle_cache(
         hashing_kv, args_hash, query, query_param.mode
     )
     if cached_response is not None:
         logger.info("Cache hit for KG Query.")
-        return {
-            "response": cached_response,
-            "context_data": []
-        }
+        return {"response": cached_response, "context_data": []}
 
     example_number = global_config["addon_params"].get("example_number", None)
     if example_number and example_number < len(PROMPTS["keywords_extraction_examples"]):
@@ -499,9 +1340,11 @@ async def kg_query(
     logger.info(f"[Query] Generating keywords for query: '{query}'")
     kw_prompt_temp = PROMPTS["keywords_extraction"]
     kw_prompt = kw_prompt_temp.format(query=query, examples=examples, language=language)
-    result = await use_model_func(kw_prompt, keyword_extraction=True)
+    result = await use_model_func(
+        kw_prompt, keyword_extraction=True, cache_site="keywords"
+    )
     logger.info(f"[Query] Keyword generation raw result: {result}")
-    
+
     try:
         # json_text = locate_json_string_body_from_string(result) # handled in use_model_func
         match = re.search(r"\{.*\}", result, re.DOTALL)
@@ -511,7 +1354,9 @@ async def kg_query(
 
             hl_keywords = keywords_data.get("high_level_keywords", [])
             ll_keywords = keywords_data.get("low_level_keywords", [])
-            logger.info(f"[Query] Extracted Keywords - High: {hl_keywords}, Low: {ll_keywords}")
+            logger.info(
+                f"[Query] Extracted Keywords - High: {hl_keywords}, Low: {ll_keywords}"
+            )
         else:
             logger.error("[Query] No JSON-like structure found in the keyword result.")
             return PROMPTS["fail_response"]
@@ -523,7 +1368,9 @@ async def kg_query(
 
     # Handdle keywords missing
     if hl_keywords == [] and ll_keywords == []:
-        logger.warning("[Query] Both low_level_keywords and high_level_keywords are empty")
+        logger.warning(
+            "[Query] Both low_level_keywords and high_level_keywords are empty"
+        )
         return PROMPTS["fail_response"]
     if ll_keywords == [] and query_param.mode in ["local", "hybrid"]:
         logger.warning("[Query] low_level_keywords is empty")
@@ -546,8 +1393,9 @@ async def kg_query(
         relationships_vdb,
         text_chunks_db,
         query_param,
+        tokenizer=get_tokenizer_from_config(global_config),
     )
-    
+
     # context is a dictionary or string depending on implementation, log size if possible
     context_size = len(str(context)) if context else 0
     logger.info(f"[Query] Context retrieved (Size: {context_size} chars).")
@@ -562,15 +1410,16 @@ async def kg_query(
     )
     if query_param.only_need_prompt:
         return sys_prompt
-        
+
     logger.info(f"[Query] Sending final prompt to LLM (Query: '{query}')...")
     response = await use_model_func(
         query,
         system_prompt=sys_prompt,
         stream=query_param.stream,
+        cache_site="query_answer",
     )
     logger.info("[Query] LLM response received successfully.")
-    
+
     if isinstance(response, str) and len(response) > len(sys_prompt):
         response = (
             response.replace(sys_prompt, "")
@@ -600,11 +1449,11 @@ async def kg_query(
     # But to be safe with existing calls we might want to attach it to the string or change return type.
     # Let's change return type to dict if upstream can handle it.
     # Check malrag.py: it just returns the result. Wrapper api expects string or object.
-    
+
     # Actually, let's return a dict with response and context data
     return {
         "response": response,
-        "context_data": context[1] if isinstance(context, tuple) else []
+        "context_data": context[1] if isinstance(context, tuple) else [],
     }
 
 
@@ -615,12 +1464,13 @@ async def _build_query_context(
     relationships_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    tokenizer: Tokenizer = None,
 ):
     # ll_entities_context, ll_relations_context, ll_text_units_context = "", "", ""
     # hl_entities_context, hl_relations_context, hl_text_units_context = "", "", ""
 
     ll_kewwords, hl_keywrds = query[0], query[1]
-    
+
     # Initialize lists for text units
     ll_text_units_list = []
     hl_text_units_list = []
@@ -641,13 +1491,14 @@ async def _build_query_context(
                 ll_entities_context,
                 ll_relations_context,
                 ll_text_units_context,
-                ll_text_units_list
+                ll_text_units_list,
             ) = await _get_node_data(
                 ll_kewwords,
                 knowledge_graph_inst,
                 entities_vdb,
                 text_chunks_db,
                 query_param,
+                tokenizer=tokenizer,
             )
     if query_param.mode in ["global", "hybrid"]:
         if hl_keywrds == "":
@@ -665,13 +1516,14 @@ async def _build_query_context(
                 hl_entities_context,
                 hl_relations_context,
                 hl_text_units_context,
-                hl_text_units_list
+                hl_text_units_list,
             ) = await _get_edge_data(
                 hl_keywrds,
                 knowledge_graph_inst,
                 relationships_vdb,
                 text_chunks_db,
                 query_param,
+                tokenizer=tokenizer,
             )
             if (
                 hl_entities_context == ""
@@ -680,7 +1532,7 @@ async def _build_query_context(
             ):
                 logger.warn("No high level context found. Switching to local mode.")
                 query_param.mode = "local"
-                
+
     # Combine sources lists
     combined_text_units_list = []
     seen_ids = set()
@@ -711,7 +1563,7 @@ async def _build_query_context(
             hl_relations_context,
             hl_text_units_context,
         )
-        
+
     context_string = f"""
 -----Entities-----
 ```csv
@@ -735,6 +1587,7 @@ async def _get_node_data(
     entities_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    tokenizer: Tokenizer = None,
 ):
     # get similar entities
     results = await entities_vdb.query(query, top_k=query_param.top_k)
@@ -758,11 +1611,11 @@ async def _get_node_data(
     ]  # what is this text_chunks_db doing.  dont remember it in airvx.  check the diagram.
     # get entitytext chunk
     use_text_units = await _find_most_related_text_unit_from_entities(
-        node_datas, query_param, text_chunks_db, knowledge_graph_inst
+        node_datas, query_param, text_chunks_db, knowledge_graph_inst, tokenizer
     )
     # get relate edges
     use_relations = await _find_most_related_edges_from_entities(
-        node_datas, query_param, knowledge_graph_inst
+        node_datas, query_param, knowledge_graph_inst, tokenizer
     )
     logger.info(
         f"Local query uses {len(node_datas)} entites, {len(use_relations)} relations, {len(use_text_units)} text units"
@@ -811,6 +1664,7 @@ async def _find_most_related_text_unit_from_entities(
     query_param: QueryParam,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     knowledge_graph_inst: BaseGraphStorage,
+    tokenizer: Tokenizer = None,
 ):
     text_units = [
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
@@ -874,6 +1728,8 @@ async def _find_most_related_text_unit_from_entities(
         all_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        tokenizer=tokenizer,
+        token_key=lambda x: tokenizer.stored_count(x["data"]),
     )
 
     all_text_units = [t["data"] for t in all_text_units]
@@ -884,6 +1740,7 @@ async def _find_most_related_edges_from_entities(
     node_datas: list[dict],
     query_param: QueryParam,
     knowledge_graph_inst: BaseGraphStorage,
+    tokenizer: Tokenizer = None,
 ):
     all_related_edges = await asyncio.gather(
         *[knowledge_graph_inst.get_node_edges(dp["entity_name"]) for dp in node_datas]
@@ -916,6 +1773,8 @@ async def _find_most_related_edges_from_entities(
         all_edges_data,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_global_context,
+        tokenizer=tokenizer,
+        token_key=lambda x: tokenizer.stored_count(x, "description_tokens"),
     )
     return all_edges_data
 
@@ -926,6 +1785,7 @@ async def _get_edge_data(
     relationships_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    tokenizer: Tokenizer = None,
 ):
     results = await relationships_vdb.query(keywords, top_k=query_param.top_k)
 
@@ -953,13 +1813,15 @@ async def _get_edge_data(
         edge_datas,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_global_context,
+        tokenizer=tokenizer,
+        token_key=lambda x: tokenizer.stored_count(x, "description_tokens"),
     )
 
     use_entities = await _find_most_related_entities_from_relationships(
-        edge_datas, query_param, knowledge_graph_inst
+        edge_datas, query_param, knowledge_graph_inst, tokenizer
     )
     use_text_units = await _find_related_text_unit_from_relationships(
-        edge_datas, query_param, text_chunks_db, knowledge_graph_inst
+        edge_datas, query_param, text_chunks_db, knowledge_graph_inst, tokenizer
     )
     logger.info(
         f"Global query uses {len(use_entities)} entites, {len(edge_datas)} relations, {len(use_text_units)} text units"
@@ -1006,6 +1868,7 @@ async def _find_most_related_entities_from_relationships(
     edge_datas: list[dict],
     query_param: QueryParam,
     knowledge_graph_inst: BaseGraphStorage,
+    tokenizer: Tokenizer = None,
 ):
     entity_names = []
     seen = set()
@@ -1034,6 +1897,8 @@ async def _find_most_related_entities_from_relationships(
         node_datas,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_local_context,
+        tokenizer=tokenizer,
+        token_key=lambda x: tokenizer.stored_count(x, "description_tokens"),
     )
 
     return node_datas
@@ -1044,6 +1909,7 @@ async def _find_related_text_unit_from_relationships(
     query_param: QueryParam,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     knowledge_graph_inst: BaseGraphStorage,
+    tokenizer: Tokenizer = None,
 ):
     text_units = [
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
@@ -1082,6 +1948,8 @@ async def _find_related_text_unit_from_relationships(
         valid_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        tokenizer=tokenizer,
+        token_key=lambda x: tokenizer.stored_count(x["data"]),
     )
 
     all_text_units: list[TextChunkSchema] = [t["data"] for t in truncated_text_units]
@@ -1120,7 +1988,7 @@ async def naive_query(
     use_model_func = global_config["llm_model_func"]
     args_hash = compute_args_hash(query_param.mode, query)
     logger.info(f"Received query: '{query}' (Mode: {query_param.mode})")
-    
+
     # Check cache first
     cached_response, quantized, min_val, max_val = await handle_cache(
         hashing_kv, args_hash, query, query_param.mode
@@ -1129,7 +1997,7 @@ async def naive_query(
         logger.info("Cache hit! Returning cached response.")
         return {
             "response": cached_response,
-            "context_data": [] # Cache needs update to store sources too, but for now empty
+            "context_data": [],  # Cache needs update to store sources too, but for now empty
         }
 
     logger.info("Extracting keywords for query...")
@@ -1156,10 +2024,13 @@ async def naive_query(
         logger.warning("No valid chunks found after filtering")
         return PROMPTS["fail_response"]
 
+    tokenizer = get_tokenizer_from_config(global_config)
     maybe_trun_chunks = truncate_list_by_token_size(
         valid_chunks,
         key=lambda x: x["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        tokenizer=tokenizer,
+        token_key=tokenizer.stored_count,
     )
 
     if not maybe_trun_chunks:
@@ -1184,6 +2055,7 @@ async def naive_query(
     response = await use_model_func(
         query,
         system_prompt=sys_prompt,
+        cache_site="query_answer",
     )
     logger.info("LLM response received.")
 
@@ -0,0 +1,520 @@
+import asyncio
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .base import BaseGraphStorage, BaseKVStorage, BaseVectorStorage, TextChunkSchema
+from .chunk_filter import chunk_information_score
+from .extraction_cache import ExtractionCache
+from .gazetteer import LocalEntityTagger
+from .minhash import NearDuplicateIndex
+from .operate import (
+    build_extraction_context,
+    extract_packed_chunks,
+    extraction_pack_budget,
+    iter_chunks_by_token_size,
+    merge_extraction_results,
+    pack_chunks_for_extraction,
+    upsert_extraction_vectors,
+)
+from .summary_queue import SummaryQueue
+from .tokenizer import get_tokenizer_from_config
+from .utils import compute_mdhash_id, logger
+
+# end-of-stream marker passed through the queues
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    name: str
+    items: int = 0
+    # extra per-stage counts reported alongside the throughput, e.g. how many
+    # chunks were served from checkpoints ("skipped") or near-duplicates ("reused")
+    counters: dict = field(default_factory=dict)
+    started_at: float = None
+    finished_at: float = None
+
+    def tick(self, n: int = 1):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        self.items += n
+
+    def count(self, counter: str, n: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def finish(self):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        self.finished_at = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.perf_counter()
+        seconds = end - self.started_at if self.started_at is not None else 0.0
+        stats = {
+            "items": self.items,
+            "seconds": round(seconds, 3),
+            "per_second": round(self.items / seconds, 2) if seconds > 0 else None,
+        }
+        stats.update(self.counters)
+        return stats
+
+
+def extraction_to_checkpoint(result: tuple[dict, dict]) -> dict:
+    """Flatten ``extract_single_chunk`` output into a JSON friendly record."""
+    maybe_nodes, maybe_edges = result
+    return {
+        "entities": [dp for dps in maybe_nodes.values() for dp in dps],
+        "relationships": [dp for dps in maybe_edges.values() for dp in dps],
+    }
+
+
+def extraction_from_checkpoint(
+    checkpoint: dict, source_id: str = None
+) -> tuple[dict, dict]:
+    """Rebuild ``(nodes, edges)`` from a checkpoint, attributing the records to
+    ``source_id`` instead when reusing another chunk's result."""
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for dp in checkpoint["entities"]:
+        if source_id is not None:
+            dp = {**dp, "source_id": source_id}
+        maybe_nodes[dp["entity_name"]].append(dp)
+    for dp in checkpoint["relationships"]:
+        if source_id is not None:
+            dp = {**dp, "source_id": source_id}
+        maybe_edges[(dp["src_id"], dp["tgt_id"])].append(dp)
+    return dict(maybe_nodes), dict(maybe_edges)
+
+
+async def run_ingestion_pipeline(
+    new_docs: dict[str, dict],
+    text_chunks: BaseKVStorage,
+    chunks_vdb: BaseVectorStorage,
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+    progress_callback: Optional[Callable] = None,
+    extraction_checkpoints: Optional[BaseKVStorage] = None,
+    near_duplicate_index: Optional[NearDuplicateIndex] = None,
+    extraction_cache: Optional[ExtractionCache] = None,
+    summary_queue: Optional[SummaryQueue] = None,
+    local_tagger: Optional[LocalEntityTagger] = None,
+) -> tuple[dict[str, TextChunkSchema], list[dict], list[dict], dict[str, list[str]]]:
+    """Chunk, embed, extract and merge ``new_docs`` as overlapping stages.
+
+    Chunks are fanned out to the embedding and extraction stages as soon as they
+    are cut, and extraction results are merged in micro-batches while other
+    chunks are still in flight. Queues are bounded by ``pipeline_queue_size`` so
+    a slow stage pushes back on the chunker instead of buffering the whole
+    corpus; the stage concurrency follows ``embedding_func_max_async`` and
+    ``llm_model_max_async``.
+
+    ``progress_callback(step)`` is awaited when a stage starts and
+    ``progress_callback(step, stats)`` when it finishes, with ``stats`` holding
+    the stage's ``items``, ``seconds`` and ``per_second``.
+
+    With ``extraction_checkpoints`` every chunk's extraction output is stored
+    and flushed as soon as it finishes, and chunks that already have one are
+    merged from it without calling the LLM. A checkpoint records the
+    ``ExtractionCache.key`` it was extracted under and is only reused while
+    the prompts, entity types, gleaning and model still match.
+
+    With ``near_duplicate_index`` each new chunk is looked up (and added) while
+    chunking; a chunk with a near-twin reuses the twin's extraction result,
+    waiting for it if the twin is still being extracted in this run. The
+    extraction stage stats count these as ``reused`` and report the
+    ``llm_calls_saved`` by every kind of reuse.
+
+    With ``extraction_pack_size`` > 1 an extraction worker takes the chunks
+    already waiting in its queue along with the one it got, up to that many
+    within ``extraction_pack_budget``, and extracts them with one packed prompt.
+    ``prompts`` in the extraction stats counts the extraction prompts sent.
+
+    With ``extraction_cache`` chunks whose text was extracted before (in any
+    working directory the cache came from) skip the LLM; the extraction stats
+    report the ``cache_hits`` of this run.
+
+    The gleaning decisions of the extraction prompts (see ``adaptive_gleaning``)
+    are reported as ``gleaning_*`` counts: ``skipped_short``, ``skipped_yield``,
+    ``stopped_by_model``, ``gleaned_to_max`` and the total ``rounds``.
+
+    With ``summary_queue`` the merges queue descriptions that need a summary
+    instead of summarizing them inline, see ``merge_extraction_results``.
+    Without one they are queued for this run only and summarized once every
+    micro-batch is merged, so an entity that many batches touch is summarized
+    once rather than after each batch; the merging stats count them as
+    ``summarized``. A failed merge stops the pipeline as soon as it fails.
+
+    With ``local_tagger`` chunks that only mention entities the graph already
+    has are tagged on the CPU instead of extracted by the LLM; the extraction
+    stats count them as ``local_tagged``. Entities merged during the run are
+    added to the tagger as they land.
+
+    Chunks scoring below ``min_chunk_information`` (see
+    ``chunk_information_score``: headers, numeric tables, OCR noise) are stored
+    and embedded for naive retrieval but skip graph extraction; the chunking
+    stats count them as ``low_information``.
+
+    Returns the newly inserted chunks, the merged entity/relationship records
+    and, by document, the ids of all its chunks (in order, including the ones
+    already stored or shared with another document of this run).
+    """
+    queue_size = global_config.get("pipeline_queue_size", 32)
+    embed_batch_size = global_config["embedding_batch_num"]
+    n_embed_workers = max(1, global_config["embedding_func_max_async"])
+    n_extract_workers = max(1, global_config["llm_model_max_async"])
+    tokenizer = get_tokenizer_from_config(global_config)
+    context_base = build_extraction_context(global_config)
+    pack_size = max(1, global_config.get("extraction_pack_size", 1))
+    min_information = global_config.get("min_chunk_information") or 0
+    pack_budget = (
+        extraction_pack_budget(context_base, global_config) if pack_size > 1 else 0
+    )
+
+    # the embedding stage takes whole ``embedding_batch_num`` batches
+    embed_queue = asyncio.Queue(maxsize=max(1, queue_size // embed_batch_size))
+    extract_queue = asyncio.Queue(maxsize=queue_size)
+    merge_queue = asyncio.Queue(maxsize=queue_size)
+
+    stats = {
+        name: StageStats(name)
+        for name in ("chunking", "embedding", "extracting_entities", "merging")
+    }
+    inserting_chunks: dict[str, TextChunkSchema] = {}
+    doc_chunk_ids: dict[str, list[str]] = {}
+    gleaning_metrics = Counter()
+    # chunk id -> future of its extraction result, for near-twins of this run.
+    # A twin is always chunked (so queued) before its duplicate, so waiting on
+    # it can't deadlock the workers.
+    extractions: dict[str, asyncio.Future] = {}
+    all_entities_data: list[dict] = []
+    all_relationships_data: list[dict] = []
+    deferred_summaries = summary_queue
+    if deferred_summaries is None:
+        deferred_summaries = SummaryQueue.in_memory(
+            knowledge_graph_inst, entity_vdb, relationships_vdb, global_config
+        )
+
+    async def _report(step: str, stage_stats: StageStats = None):
+        if not progress_callback:
+            return
+        if stage_stats is None:
+            await progress_callback(step)
+        else:
+            await progress_callback(step, stage_stats.to_dict())
+
+    async def _start(step: str):
+        if stats[step].started_at is None:
+            stats[step].started_at = time.perf_counter()
+            await _report(step)
+
+    async def _finish(step: str):
+        stats[step].finish()
+        logger.info(f"[Pipeline] {step}: {stats[step].to_dict()}")
+        await _report(step, stats[step])
+
+    async def _chunker():
+        await _start("chunking")
+        embed_batch = {}
+        for doc_key, doc in new_docs.items():
+            chunks = {}
+            chunk_ids = []
+            for dp in iter_chunks_by_token_size(
+                doc["content"],
+                overlap_token_size=global_config["chunk_overlap_token_size"],
+                max_token_size=global_config["chunk_token_size"],
+                tokenizer=tokenizer,
+            ):
+                chunk_key = compute_mdhash_id(dp["content"], prefix="chunk-")
+                chunk_ids.append(chunk_key)
+                if chunk_key not in inserting_chunks:
+                    chunks[chunk_key] = {**dp, "full_doc_id": doc_key}
+            doc_chunk_ids[doc_key] = list(dict.fromkeys(chunk_ids))
+            _add_chunk_keys = await text_chunks.filter_keys(list(chunks.keys()))
+            for chunk_key, chunk in chunks.items():
+                if chunk_key not in _add_chunk_keys:
+                    continue
+                inserting_chunks[chunk_key] = chunk
+                stats["chunking"].tick()
+                embed_batch[chunk_key] = chunk
+                if len(embed_batch) >= embed_batch_size:
+                    await embed_queue.put(embed_batch)
+                    embed_batch = {}
+                if (
+                    min_information
+                    and chunk_information_score(chunk["content"]) < min_information
+                ):
+                    stats["chunking"].count("low_information")
+                    continue
+                twin = None
+                if near_duplicate_index is not None:
+                    twin = await near_duplicate_index.find_twin_then_add(
+                        chunk_key, chunk["content"]
+                    )
+                extractions[chunk_key] = asyncio.get_running_loop().create_future()
+                await extract_queue.put((chunk_key, chunk, twin))
+        if embed_batch:
+            await embed_queue.put(embed_batch)
+        await _finish("chunking")
+        for _ in range(n_embed_workers):
+            await embed_queue.put(_DONE)
+        for _ in range(n_extract_workers):
+            await extract_queue.put(_DONE)
+
+    async def _embed_worker():
+        while True:
+            batch = await embed_queue.get()
+            if batch is _DONE:
+                return
+            await _start("embedding")
+            await chunks_vdb.upsert(batch)
+            stats["embedding"].tick(len(batch))
+
+    def _extraction_key(content: str) -> str:
+        return ExtractionCache.key(content, context_base, global_config)
+
+    async def _checkpoint(chunk_key: str, content: str) -> Optional[dict]:
+        checkpoint = await extraction_checkpoints.get_by_id(chunk_key)
+        if checkpoint is None:
+            return None
+        if checkpoint.get("extraction_key") != _extraction_key(content):
+            # extracted with other prompts or another model, redo it
+            stats["extracting_entities"].count("stale_checkpoints")
+            await extraction_checkpoints.delete([chunk_key])
+            return None
+        return checkpoint
+
+    async def _twin_result(chunk_key: str, twin: str) -> Optional[tuple[dict, dict]]:
+        if twin in extractions:
+            twin_result = await extractions[twin]
+            if twin_result is None:
+                return None
+            checkpoint = extraction_to_checkpoint(twin_result)
+        elif extraction_checkpoints is not None:
+            twin_chunk = await text_chunks.get_by_id(twin)
+            if twin_chunk is None:
+                return None
+            checkpoint = await _checkpoint(twin, twin_chunk["content"])
+            if checkpoint is None:
+                return None
+        else:
+            return None
+        return extraction_from_checkpoint(checkpoint, source_id=chunk_key)
+
+    async def _extracted(chunk_key: str, result: tuple[dict, dict], save: bool = True):
+        if save and extraction_checkpoints is not None:
+            content = inserting_chunks[chunk_key]["content"]
+            await extraction_checkpoints.upsert(
+                {
+                    chunk_key: {
+                        **extraction_to_checkpoint(result),
+                        "extraction_key": _extraction_key(content),
+                    }
+                }
+            )
+            await extraction_checkpoints.index_done_callback()
+        extractions[chunk_key].set_result(result)
+        stats["extracting_entities"].tick()
+        await merge_queue.put(result)
+
+    async def _extract_fresh(chunks: list[tuple[str, TextChunkSchema]]):
+        if not chunks:
+            return
+        packs = pack_chunks_for_extraction(chunks, pack_size, pack_budget)
+        stats["extracting_entities"].count("prompts", len(packs))
+        pack_results = await asyncio.gather(
+            *[
+                extract_packed_chunks(
+                    pack,
+                    context_base,
+                    global_config,
+                    extraction_cache,
+                    gleaning_metrics,
+                    local_tagger,
+                )
+                for pack in packs
+            ]
+        )
+        for pack, results in zip(packs, pack_results):
+            for (chunk_key, _), result in zip(pack, results):
+                await _extracted(chunk_key, result)
+
+    async def _extract_twin(chunk_key: str, chunk: TextChunkSchema, twin: str):
+        result = await _twin_result(chunk_key, twin)
+        if result is None:
+            await _extract_fresh([(chunk_key, chunk)])
+        else:
+            stats["extracting_entities"].count("reused")
+            await _extracted(chunk_key, result)
+
+    async def _extract_items(items: list[tuple[str, TextChunkSchema, Optional[str]]]):
+        fresh = []
+        twins = []
+        for chunk_key, chunk, twin in items:
+            checkpoint = None
+            if extraction_checkpoints is not None:
+                checkpoint = await _checkpoint(chunk_key, chunk["content"])
+            if checkpoint is not None:
+                stats["extracting_entities"].count("skipped")
+                await _extracted(
+                    chunk_key, extraction_from_checkpoint(checkpoint), save=False
+                )
+            elif twin is not None:
+                twins.append((chunk_key, chunk, twin))
+            else:
+                fresh.append((chunk_key, chunk))
+        # chunks without a twin never wait, so they go first: a twin may be
+        # one of them, in this worker or another one
+        await _extract_fresh(fresh)
+        await asyncio.gather(*[_extract_twin(*item) for item in twins])
+
+    async def _extract_worker():
+        while True:
+            item = await extract_queue.get()
+            if item is _DONE:
+                return
+            await _start("extracting_entities")
+            items = [item]
+            # top a pack up with chunks that are already waiting, never holding
+            # one back for more to arrive
+            while len(items) < pack_size and not extract_queue.empty():
+                item = extract_queue.get_nowait()
+                if item is _DONE:
+                    break
+                items.append(item)
+            try:
+                await _extract_items(items)
+            finally:
+                for chunk_key, _, _ in items:
+                    if not extractions[chunk_key].done():
+                        # near-twins waiting on this chunk fall back to the LLM
+                        extractions[chunk_key].set_result(None)
+            if item is _DONE:
+                return
+
+    async def _merge_batch(
+        batch: list, merged_entities: dict, merged_relationships: dict
+    ):
+        entities, relationships = await merge_extraction_results(
+            batch, knowledge_graph_inst, None, None, global_config, deferred_summaries
+        )
+        stats["merging"].tick(len(batch))
+        if local_tagger is not None:
+            local_tagger.add(dp["entity_name"] for dp in entities)
+        for dp in entities:
+            merged_entities[dp["entity_name"]] = dp
+        for dp in relationships:
+            merged_relationships[(dp["src_id"], dp["tgt_id"])] = dp
+
+    async def _merger():
+        # latest merged record per entity/edge; their vectors are written once at
+        # the end instead of re-embedding every entity a micro-batch touches
+        merged_entities = {}
+        merged_relationships = {}
+        batch = []
+        merging = None
+        merger = asyncio.current_task()
+
+        def _merged(task: asyncio.Task):
+            # don't wait for the next result to notice, the merger may sit on
+            # an empty queue for a long time while extraction runs
+            if not task.cancelled() and task.exception() is not None:
+                merger.cancel()
+
+        try:
+            while True:
+                item = await merge_queue.get()
+                if item is _DONE:
+                    break
+                batch.append(item)
+                # one merge at a time; results keep draining into the next batch
+                # meanwhile so extraction never stalls on a full queue, and every
+                # merge can re-summarize what it touches, so batches are not cut
+                # below pipeline_queue_size
+                if len(batch) < queue_size or (merging and not merging.done()):
+                    continue
+                if merging is None:
+                    await _start("merging")
+                else:
+                    await merging
+                merging = asyncio.create_task(
+                    _merge_batch(batch, merged_entities, merged_relationships)
+                )
+                merging.add_done_callback(_merged)
+                batch = []
+            if merging is not None:
+                await merging
+            if batch:
+                await _start("merging")
+                await _merge_batch(batch, merged_entities, merged_relationships)
+        except asyncio.CancelledError:
+            if (
+                merging is not None
+                and merging.done()
+                and not merging.cancelled()
+                and merging.exception() is not None
+            ):
+                raise merging.exception()
+            raise
+        finally:
+            if merging is not None and not merging.done():
+                merging.cancel()
+        all_entities_data.extend(merged_entities.values())
+        all_relationships_data.extend(merged_relationships.values())
+        await upsert_extraction_vectors(
+            all_entities_data, all_relationships_data, entity_vdb, relationships_vdb
+        )
+        if summary_queue is None:
+            stats["merging"].count(
+                "summarized", await deferred_summaries.drain(global_config)
+            )
+        await _finish("merging")
+
+    async def _embed_stage():
+        await asyncio.gather(*[_embed_worker() for _ in range(n_embed_workers)])
+        await _finish("embedding")
+
+    async def _extract_stage():
+        cache_hits = extraction_cache.hits if extraction_cache is not None else 0
+        local_tagged = local_tagger.tagged if local_tagger is not None else 0
+        await asyncio.gather(*[_extract_worker() for _ in range(n_extract_workers)])
+        extract_stats = stats["extracting_entities"]
+        if extraction_cache is not None:
+            extract_stats.count("cache_hits", extraction_cache.hits - cache_hits)
+        if local_tagger is not None:
+            extract_stats.count("local_tagged", local_tagger.tagged - local_tagged)
+        for decision, n in gleaning_metrics.items():
+            extract_stats.count(f"gleaning_{decision}", n)
+        # a fresh extraction is one call plus one per gleaning round
+        calls_per_chunk = 1 + global_config["entity_extract_max_gleaning"]
+        extract_stats.count(
+            "llm_calls_saved",
+            calls_per_chunk
+            * (
+                extract_stats.counters.get("skipped", 0)
+                + extract_stats.counters.get("reused", 0)
+                + extract_stats.counters.get("cache_hits", 0)
+                + extract_stats.counters.get("local_tagged", 0)
+                + stats["chunking"].counters.get("low_information", 0)
+            ),
+        )
+        await _finish("extracting_entities")
+        await merge_queue.put(_DONE)
+
+    tasks = [
+        asyncio.create_task(stage())
+        for stage in (_chunker, _embed_stage, _extract_stage, _merger)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # a failed stage would leave the others blocked on their queues
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return inserting_chunks, all_entities_data, all_relationships_data, doc_chunk_ids
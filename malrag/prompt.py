@@ -141,6 +141,28 @@ Description List: {description_list}
 Output:
 """
 
+PROMPTS[
+    "summarize_descriptions_batch"
+] = """You are a helpful assistant responsible for generating comprehensive summaries of the data provided below.
+Each numbered item gives one or two entities, and a list of descriptions, all related to the same entity or group of entities.
+For every item on its own, please concatenate all of its descriptions into a single, comprehensive description. Make sure to include information collected from all the descriptions of the item.
+If the descriptions of an item are contradictory, please resolve the contradictions and provide a single, coherent summary.
+Make sure it is written in third person, and include the entity names so we the have full context.
+Use {language} as output language.
+Write each summary as ("summary"{tuple_delimiter}<item number>{tuple_delimiter}<summary>) and use **{record_delimiter}** as the list delimiter. When finished, output {completion_delimiter}
+
+#######
+-Data-
+{items}
+#######
+Output:
+"""
+
+PROMPTS["summarize_descriptions_batch_item"] = """Item {item_id}
+Entities: {entity_name}
+Description List: {description_list}
+"""
+
 PROMPTS[
     "entiti_continue_extraction"
 ] = """MANY entities were missed in the last extraction.  Add them below using the same format:
@@ -151,6 +173,24 @@ PROMPTS[
 ] = """It appears some entities may have still been missed.  Answer YES | NO if there are still entities that need to be added.
 """
 
+PROMPTS[
+    "gleaning_decision"
+] = """After the new records, add ("more_entities"{tuple_delimiter}YES) if entities still remain to be added after these, otherwise ("more_entities"{tuple_delimiter}NO).
+"""
+
+PROMPTS[
+    "packed_extraction_input"
+] = """{n_texts} separate texts follow, each introduced by its ("text"{tuple_delimiter}<text_id>) line.
+Extract the entities and relationships of every text on its own, never relating entities of different texts.
+In the output, write the ("text"{tuple_delimiter}<text_id>) line of each text before its records, even when a text has none.
+
+{texts}"""
+
+PROMPTS[
+    "packed_continue_extraction"
+] = """MANY entities were missed in the last extraction.  Add them below using the same format, writing the ("text"{tuple_delimiter}<text_id>) line of each text before its records:
+"""
+
 PROMPTS["fail_response"] = "Sorry, I'm not able to provide an answer to that question."
 
 PROMPTS["rag_response"] = """---Role---
@@ -0,0 +1,236 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from .utils import ReleasingStream, compute_args_hash
+
+INTERACTIVE = "interactive"
+INGESTION = "ingestion"
+BACKGROUND = "background"
+
+DEFAULT_PRIORITY_WEIGHTS = {INTERACTIVE: 8, INGESTION: 2, BACKGROUND: 1}
+
+# the class of the LLM/embedding calls made from the current task (and the
+# tasks it creates), see llm_priority
+current_priority: ContextVar[str] = ContextVar("llm_priority", default=INGESTION)
+
+
+@contextmanager
+def llm_priority(priority_class: str):
+    """Run the calls made inside the block (and in tasks created inside it)
+    in ``priority_class``."""
+    token = current_priority.set(priority_class)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class PriorityScheduler:
+    """Shares ``max_async`` call slots between priority classes.
+
+    Calls wait in a FIFO queue per class. A freed slot goes to the waiting
+    class with the least weighted service so far (stride scheduling), so with
+    weights 8:2:1 interactive calls get 8 slots for every 2 ingestion calls
+    while both wait, and a class that was idle gets no credit for it.
+    ``reserved`` keeps slots free for a class: other classes only take a slot
+    if that still leaves the reserved ones the class isn't using.
+
+    ``wrap(func)`` returns a plain async function (so ``asdict`` on the config
+    holding it doesn't copy the scheduler) whose calls take a slot in the
+    class of ``current_priority``. A call returning an async iterator (a
+    stream) keeps its slot until the iterator is exhausted or closed, so the
+    caller has to read or ``aclose`` it.
+    """
+
+    def __init__(
+        self,
+        max_async: int,
+        weights: Optional[dict[str, float]] = None,
+        reserved: Optional[dict[str, int]] = None,
+    ):
+        self.max_async = max(1, max_async)
+        self.weights = dict(weights or DEFAULT_PRIORITY_WEIGHTS)
+        # at least one slot is left for the other classes
+        self.reserved = {}
+        free = self.max_async - 1
+        for priority_class, n in (reserved or {}).items():
+            self.reserved[priority_class] = min(max(0, n), free)
+            free -= self.reserved[priority_class]
+        self._queues: dict[str, deque] = {c: deque() for c in self.weights}
+        self._pass: dict[str, float] = {c: 0.0 for c in self.weights}
+        self._in_flight: dict[str, int] = {c: 0 for c in self.weights}
+        self._completed: dict[str, int] = {c: 0 for c in self.weights}
+        self._wait_seconds: dict[str, float] = {c: 0.0 for c in self.weights}
+        self._max_queued: dict[str, int] = {c: 0 for c in self.weights}
+
+    def _check_class(self, priority_class: str):
+        if priority_class not in self.weights:
+            raise ValueError(
+                f"Unknown priority class {priority_class!r}, expected one of "
+                f"{list(self.weights)}"
+            )
+
+    def _can_start(self, priority_class: str) -> bool:
+        held_back = sum(
+            max(0, n - self._in_flight[c])
+            for c, n in self.reserved.items()
+            if c != priority_class
+        )
+        return sum(self._in_flight.values()) + held_back < self.max_async
+
+    def _start(self, priority_class: str):
+        self._in_flight[priority_class] += 1
+        # an idle class restarts level with the busy ones, not ahead of them
+        busy = [
+            self._pass[c] for c in self.weights if self._queues[c] or self._in_flight[c]
+        ]
+        self._pass[priority_class] = max(self._pass[priority_class], min(busy)) + (
+            1 / self.weights[priority_class]
+        )
+
+    def _dispatch(self):
+        while True:
+            ready = [c for c in self.weights if self._queues[c] and self._can_start(c)]
+            if not ready:
+                return
+            priority_class = min(ready, key=lambda c: self._pass[c])
+            waiter = self._queues[priority_class].popleft()
+            if waiter.done():
+                continue
+            self._start(priority_class)
+            waiter.set_result(None)
+
+    async def acquire(self, priority_class: str):
+        self._check_class(priority_class)
+        if not self._queues[priority_class] and self._can_start(priority_class):
+            self._start(priority_class)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority_class]
+        queue.append(waiter)
+        self._max_queued[priority_class] = max(
+            self._max_queued[priority_class], len(queue)
+        )
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # granted just before the cancel, hand the slot on
+                self.release(priority_class)
+            elif waiter in queue:
+                queue.remove(waiter)
+            raise
+        finally:
+            self._wait_seconds[priority_class] += time.perf_counter() - started
+
+    def release(self, priority_class: str):
+        self._in_flight[priority_class] -= 1
+        self._completed[priority_class] += 1
+        self._dispatch()
+
+    def wrap(self, func):
+        @wraps(func)
+        async def scheduled_func(*args, **kwargs):
+            priority_class = current_priority.get()
+            await self.acquire(priority_class)
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                self.release(priority_class)
+                raise
+            # a streamed response is still being generated: keep the slot
+            # until it has been read
+            if hasattr(result, "__aiter__"):
+                return ReleasingStream(result, lambda _: self.release(priority_class))
+            self.release(priority_class)
+            return result
+
+        return scheduled_func
+
+    def stats(self) -> dict:
+        """Per class: ``queued`` now, ``max_queued``, ``in_flight``,
+        ``completed``, ``reserved`` slots and the average ``wait_seconds`` in
+        the queue per completed call."""
+        return {
+            c: {
+                "queued": len(self._queues[c]),
+                "max_queued": self._max_queued[c],
+                "in_flight": self._in_flight[c],
+                "completed": self._completed[c],
+                "reserved": self.reserved.get(c, 0),
+                "wait_seconds": self._wait_seconds[c] / max(1, self._completed[c]),
+            }
+            for c in self.weights
+        }
+
+
+class SingleFlight:
+    """Concurrent identical calls share one underlying call.
+
+    ``wrap(func)`` keys every call by ``compute_args_hash`` of its arguments
+    (and its priority class, so a query never waits behind a background call).
+    The first call of a key runs ``func`` in a task; the calls with the same key
+    that arrive before it finishes await that task and get its result or its
+    exception. A caller that is cancelled only leaves; the task is cancelled
+    when no caller is left. Streamed calls (``stream=True``) are never shared.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[str, tuple[asyncio.Task, list]] = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    async def do(self, key: str, func, *args, **kwargs):
+        self.calls += 1
+        entry = self._in_flight.get(key)
+        if entry is None:
+            self.executed += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            entry = (task, [0])
+            self._in_flight[key] = entry
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        task, waiters = entry
+        waiters[0] += 1
+        self.max_waiters = max(self.max_waiters, waiters[0])
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and waiters[0] == 1:
+                task.cancel()
+            raise
+        finally:
+            waiters[0] -= 1
+
+    def wrap(self, func):
+        @wraps(func)
+        async def single_flight_func(*args, **kwargs):
+            if kwargs.get("stream"):
+                return await func(*args, **kwargs)
+            key = compute_args_hash(
+                current_priority.get(), args, sorted(kwargs.items())
+            )
+            return await self.do(key, func, *args, **kwargs)
+
+        return single_flight_func
+
+    def stats(self) -> dict:
+        """``calls`` made, ``executed`` underlying calls, ``coalesced`` calls
+        that joined one in flight, the most callers one call had
+        (``max_waiters``) and the calls ``in_flight`` now."""
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "max_waiters": self.max_waiters,
+            "in_flight": len(self._in_flight),
+        }
@@ -1,9 +1,11 @@
 import asyncio
+import base64
 import html
+import json
 import os
 from tqdm.asyncio import tqdm as tqdm_async
 from dataclasses import dataclass
-from typing import Any, Union, cast
+from typing import Any, Iterator, Union, cast
 import networkx as nx
 import numpy as np
 from nano_vectordb import NanoVectorDB
@@ -22,19 +24,129 @@ from .base import (
 )
 
 
+class WriteAheadLog:
+    """Append-only JSON lines log of the changes made since the last snapshot."""
+
+    # don't bother compacting logs smaller than this
+    min_compaction_bytes = 1 << 20
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+    def replay(self) -> Iterator[dict]:
+        if not os.path.exists(self.file_name):
+            return
+        with open(self.file_name, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # only a crash mid-append leaves a torn line, and it is the last one
+                    logger.warning(
+                        f"Ignoring unreadable record at {self.file_name}:{line_no}"
+                    )
+                    return
+
+    def append(self, ops: list[dict]):
+        with open(self.file_name, "a", encoding="utf-8") as f:
+            for op in ops:
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def size(self) -> int:
+        return os.path.getsize(self.file_name) if os.path.exists(self.file_name) else 0
+
+    def reset(self):
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+
+class WalStorageMixin:
+    """Persist a file-backed storage as a snapshot plus a write-ahead log.
+
+    Mutations record an op with ``_log_change``; ``_commit_changes`` appends
+    the pending ops to ``<snapshot>.wal`` and only rewrites the snapshot (via
+    ``_write_snapshot``) once the log grows past ``wal_compaction_ratio`` times
+    the snapshot size. On startup ``_replay_changes`` feeds the log back through
+    ``_apply_change``. A ``wal_compaction_ratio`` <= 0 rewrites the snapshot on
+    every commit, like before the log existed.
+    """
+
+    def _open_wal(self, snapshot_file: str):
+        self._snapshot_file = snapshot_file
+        self._wal = WriteAheadLog(f"{snapshot_file}.wal")
+        self._wal_pending: list[dict] = []
+        self._wal_compaction_ratio = self.global_config.get("wal_compaction_ratio", 1.0)
+
+    def _replay_changes(self):
+        n_ops = 0
+        for op in self._wal.replay():
+            self._apply_change(op)
+            n_ops += 1
+        if n_ops:
+            logger.info(f"Replayed {n_ops} logged changes for {self.namespace}")
+
+    def _log_change(self, op: dict):
+        self._wal_pending.append(op)
+
+    def _apply_change(self, op: dict):
+        raise NotImplementedError
+
+    def _write_snapshot(self, file_name: str):
+        raise NotImplementedError
+
+    def _compact(self):
+        # write next to the snapshot and swap, so a crash never leaves half a file
+        tmp_file = f"{self._snapshot_file}.tmp"
+        self._write_snapshot(tmp_file)
+        os.replace(tmp_file, self._snapshot_file)
+        self._wal.reset()
+
+    def _commit_changes(self):
+        if not self._wal_pending:
+            return
+        if self._wal_compaction_ratio <= 0 or not os.path.exists(self._snapshot_file):
+            self._compact()
+        else:
+            self._wal.append(self._wal_pending)
+            if self._wal.size() > max(
+                self._wal.min_compaction_bytes,
+                self._wal_compaction_ratio * os.path.getsize(self._snapshot_file),
+            ):
+                self._compact()
+        self._wal_pending = []
+
+
 @dataclass
-class JsonKVStorage(BaseKVStorage):
+class JsonKVStorage(WalStorageMixin, BaseKVStorage):
     def __post_init__(self):
         working_dir = self.global_config["working_dir"]
         self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.json")
         self._data = load_json(self._file_name) or {}
+        self._open_wal(self._file_name)
+        self._replay_changes()
         logger.info(f"Load KV {self.namespace} with {len(self._data)} data")
 
+    def _apply_change(self, op: dict):
+        if op["op"] == "upsert":
+            self._data.update(op["data"])
+        elif op["op"] == "delete":
+            for id in op["ids"]:
+                self._data.pop(id, None)
+        elif op["op"] == "drop":
+            self._data = {}
+
+    def _write_snapshot(self, file_name: str):
+        write_json(self._data, file_name)
+
     async def all_keys(self) -> list[str]:
         return list(self._data.keys())
 
     async def index_done_callback(self):
-        write_json(self._data, self._file_name)
+        self._commit_changes()
 
     async def get_by_id(self, id):
         return self._data.get(id, None)
@@ -57,14 +169,22 @@ class JsonKVStorage(BaseKVStorage):
     async def upsert(self, data: dict[str, dict]):
         left_data = {k: v for k, v in data.items() if k not in self._data}
         self._data.update(left_data)
+        if left_data:
+            self._log_change({"op": "upsert", "data": left_data})
         return left_data
 
+    async def delete(self, ids: list[str]):
+        ids = [id for id in ids if self._data.pop(id, None) is not None]
+        if ids:
+            self._log_change({"op": "delete", "ids": ids})
+
     async def drop(self):
         self._data = {}
+        self._log_change({"op": "drop"})
 
 
 @dataclass
-class NanoVectorDBStorage(BaseVectorStorage):
+class NanoVectorDBStorage(WalStorageMixin, BaseVectorStorage):
     cosine_better_than_threshold: float = 0.2
 
     def __post_init__(self):
@@ -78,6 +198,33 @@ class NanoVectorDBStorage(BaseVectorStorage):
         self.cosine_better_than_threshold = self.global_config.get(
             "cosine_better_than_threshold", self.cosine_better_than_threshold
         )
+        self._open_wal(self._client_file_name)
+        self._replay_changes()
+        # id -> row of the client matrix, built on the first delete
+        self._row_index = None
+
+    def _apply_change(self, op: dict):
+        if op["op"] == "upsert":
+            self._client.upsert(
+                datas=[
+                    {
+                        **d,
+                        "__vector__": np.frombuffer(
+                            base64.b64decode(d["__vector__"]), dtype=np.float32
+                        ),
+                    }
+                    for d in op["datas"]
+                ]
+            )
+        elif op["op"] == "delete":
+            self._client.delete(op["ids"])
+
+    def _write_snapshot(self, file_name: str):
+        self._client.storage_file = file_name
+        try:
+            self._client.save()
+        finally:
+            self._client.storage_file = self._client_file_name
 
     async def upsert(self, data: dict[str, dict]):
         logger.info(f"Inserting {len(data)} vectors to {self.namespace}")
@@ -112,7 +259,26 @@ class NanoVectorDBStorage(BaseVectorStorage):
         if len(embeddings) == len(list_data):
             for i, d in enumerate(list_data):
                 d["__vector__"] = embeddings[i]
+            self._log_change(
+                {
+                    "op": "upsert",
+                    "datas": [
+                        {
+                            **d,
+                            "__vector__": base64.b64encode(
+                                np.asarray(d["__vector__"], dtype=np.float32).tobytes()
+                            ).decode(),
+                        }
+                        for d in list_data
+                    ],
+                }
+            )
+            n_rows = len(self._client)
             results = self._client.upsert(datas=list_data)
+            if self._row_index is not None:
+                # new ids are appended in order, updated ones keep their row
+                for row, id in enumerate(results["insert"], n_rows):
+                    self._row_index[id] = row
             return results
         else:
             # sometimes the embedding is not returned correctly. just log it.
@@ -137,12 +303,40 @@ class NanoVectorDBStorage(BaseVectorStorage):
     def client_storage(self):
         return getattr(self._client, "_NanoVectorDB__storage")
 
+    async def delete(self, ids: list[str]):
+        """Delete by id through the row index, filling each hole with the last row
+        instead of shifting (and copying) the whole matrix."""
+        storage = self.client_storage
+        if self._row_index is None:
+            self._row_index = {d["__id__"]: i for i, d in enumerate(storage["data"])}
+        rows = sorted(
+            (self._row_index.pop(id) for id in set(ids) if id in self._row_index),
+            reverse=True,
+        )
+        if not rows:
+            return
+        data, matrix = storage["data"], storage["matrix"]
+        last = len(data) - 1
+        # rows still to delete are all below the current one, so the last row
+        # is never one of them
+        for row in rows:
+            if row != last:
+                data[row] = data[last]
+                matrix[row] = matrix[last]
+                self._row_index[data[row]["__id__"]] = row
+            data.pop()
+            last -= 1
+        storage["matrix"] = matrix[: last + 1]
+        self._log_change({"op": "delete", "ids": list(ids)})
+
     async def delete_entity(self, entity_name: str):
         try:
             entity_id = [compute_mdhash_id(entity_name, prefix="ent-")]
 
             if self._client.get(entity_id):
                 self._client.delete(entity_id)
+                self._row_index = None
+                self._log_change({"op": "delete", "ids": entity_id})
                 logger.info(f"Entity {entity_name} have been deleted.")
             else:
                 logger.info(f"No entity found with name {entity_name}.")
@@ -160,6 +354,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
 
             if ids_to_delete:
                 self._client.delete(ids_to_delete)
+                self._row_index = None
+                self._log_change({"op": "delete", "ids": ids_to_delete})
                 logger.info(
                     f"All relations related to entity {entity_name} have been deleted."
                 )
@@ -171,11 +367,11 @@ class NanoVectorDBStorage(BaseVectorStorage):
             )
 
     async def index_done_callback(self):
-        self._client.save()
+        self._commit_changes()
 
 
 @dataclass
-class NetworkXStorage(BaseGraphStorage):
+class NetworkXStorage(WalStorageMixin, BaseGraphStorage):
     @staticmethod
     def load_nx_graph(file_name) -> nx.Graph:
         if os.path.exists(file_name):
@@ -247,12 +443,29 @@ class NetworkXStorage(BaseGraphStorage):
                 f"Loaded graph from {self._graphml_xml_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
             )
         self._graph = preloaded_graph or nx.Graph()
+        self._open_wal(self._graphml_xml_file)
+        self._replay_changes()
         self._node_embed_algorithms = {
             "node2vec": self._node2vec_embed,
         }
 
+    def _apply_change(self, op: dict):
+        if op["op"] == "node":
+            self._graph.add_node(op["id"], **op["data"])
+        elif op["op"] == "edge":
+            self._graph.add_edge(op["src"], op["tgt"], **op["data"])
+        elif op["op"] == "delete_node":
+            if self._graph.has_node(op["id"]):
+                self._graph.remove_node(op["id"])
+        elif op["op"] == "delete_edge":
+            if self._graph.has_edge(op["src"], op["tgt"]):
+                self._graph.remove_edge(op["src"], op["tgt"])
+
+    def _write_snapshot(self, file_name: str):
+        NetworkXStorage.write_nx_graph(self._graph, file_name)
+
     async def index_done_callback(self):
-        NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        self._commit_changes()
 
     async def has_node(self, node_id: str) -> bool:
         return self._graph.has_node(node_id)
@@ -274,6 +487,9 @@ class NetworkXStorage(BaseGraphStorage):
     ) -> Union[dict, None]:
         return self._graph.edges.get((source_node_id, target_node_id))
 
+    async def node_ids(self) -> list[str]:
+        return list(self._graph.nodes)
+
     async def get_node_edges(self, source_node_id: str):
         if self._graph.has_node(source_node_id):
             return list(self._graph.edges(source_node_id))
@@ -281,11 +497,20 @@ class NetworkXStorage(BaseGraphStorage):
 
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         self._graph.add_node(node_id, **node_data)
+        self._log_change({"op": "node", "id": node_id, "data": node_data})
 
     async def upsert_edge(
         self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
     ):
         self._graph.add_edge(source_node_id, target_node_id, **edge_data)
+        self._log_change(
+            {
+                "op": "edge",
+                "src": source_node_id,
+                "tgt": target_node_id,
+                "data": edge_data,
+            }
+        )
 
     async def delete_node(self, node_id: str):
         """
@@ -295,10 +520,18 @@ class NetworkXStorage(BaseGraphStorage):
         """
         if self._graph.has_node(node_id):
             self._graph.remove_node(node_id)
+            self._log_change({"op": "delete_node", "id": node_id})
             logger.info(f"Node {node_id} deleted from the graph.")
         else:
             logger.warning(f"Node {node_id} not found in the graph for deletion.")
 
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        if self._graph.has_edge(source_node_id, target_node_id):
+            self._graph.remove_edge(source_node_id, target_node_id)
+            self._log_change(
+                {"op": "delete_edge", "src": source_node_id, "tgt": target_node_id}
+            )
+
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         if algorithm not in self._node_embed_algorithms:
             raise ValueError(f"Node embedding algorithm {algorithm} not supported")
@@ -0,0 +1,275 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from .base import BaseGraphStorage, BaseKVStorage, BaseVectorStorage
+from .operate import (
+    graph_merge_locks,
+    merge_lock_keys,
+    needs_summary,
+    summarize_descriptions,
+    upsert_extraction_vectors,
+)
+from .scheduler import BACKGROUND, llm_priority
+from .tokenizer import get_tokenizer_from_config
+from .utils import logger
+
+
+@dataclass
+class _MemoryKVStorage(BaseKVStorage):
+    """KV storage kept in memory only, for a queue that lives for one run."""
+
+    def __post_init__(self):
+        self._data = {}
+
+    async def all_keys(self) -> list[str]:
+        return list(self._data)
+
+    async def get_by_id(self, id: str) -> Union[dict, None]:
+        return self._data.get(id)
+
+    async def get_by_ids(self, ids: list[str], fields=None) -> list[Union[dict, None]]:
+        return [self._data.get(id) for id in ids]
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        return {key for key in data if key not in self._data}
+
+    async def upsert(self, data: dict[str, dict]):
+        for key, value in data.items():
+            self._data.setdefault(key, value)
+
+    async def delete(self, ids: list[str]):
+        for id in ids:
+            self._data.pop(id, None)
+
+    async def drop(self):
+        self._data = {}
+
+
+class SummaryQueue:
+    """Entities and relationships whose merged description needs an LLM summary.
+
+    Merges mark them here instead of summarizing inline, so an insert finishes
+    (and is queryable, with the long descriptions) without waiting on summary
+    calls. ``drain`` then summarizes them ``summary_batch_size`` per prompt and
+    writes the summaries back to the graph and the vector stores. Entries live
+    in a KV namespace, so a backlog left by a restart is picked up again.
+
+    Entries are keyed like the graph merge locks. A summary is only written if
+    the description it was made from is still the stored one; a node or edge
+    that a concurrent merge changed stays queued for the next round.
+    """
+
+    def __init__(
+        self,
+        kv_storage: BaseKVStorage,
+        knowledge_graph_inst: BaseGraphStorage,
+        entity_vdb: BaseVectorStorage,
+        relationships_vdb: BaseVectorStorage,
+        persist: bool = True,
+    ):
+        self.kv_storage = kv_storage
+        self.knowledge_graph_inst = knowledge_graph_inst
+        self.entity_vdb = entity_vdb
+        self.relationships_vdb = relationships_vdb
+        # whether ``drain`` commits the storages after every round
+        self.persist = persist
+        self.summarized = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def in_memory(
+        cls,
+        knowledge_graph_inst: BaseGraphStorage,
+        entity_vdb: BaseVectorStorage,
+        relationships_vdb: BaseVectorStorage,
+        global_config: dict,
+    ) -> "SummaryQueue":
+        """A queue that only lives as long as the caller, which drains it and
+        commits the storages itself."""
+        return cls(
+            _MemoryKVStorage(
+                namespace="summary_queue",
+                global_config=global_config,
+                embedding_func=None,
+            ),
+            knowledge_graph_inst,
+            entity_vdb,
+            relationships_vdb,
+            persist=False,
+        )
+
+    async def mark(self, nodes=(), edges=()):
+        """Queue nodes (by name) and edges (by ``(src, tgt)``) for a summary."""
+        nodes, edges = list(nodes), list(edges)
+        data = dict(
+            zip(
+                merge_lock_keys(nodes, edges),
+                [{"entity_name": name} for name in nodes]
+                + [{"src_id": src_id, "tgt_id": tgt_id} for src_id, tgt_id in edges],
+            )
+        )
+        if data:
+            # already queued keys are left as they are
+            await self.kv_storage.upsert(data)
+
+    async def backlog(self) -> int:
+        return len(await self.kv_storage.all_keys())
+
+    async def _fetch(self, keys: list[str], entries: list[dict]) -> dict[str, dict]:
+        nodes = await self.knowledge_graph_inst.get_nodes(
+            [entry["entity_name"] for entry in entries if "entity_name" in entry]
+        )
+        edges = await self.knowledge_graph_inst.get_edges(
+            [
+                (entry["src_id"], entry["tgt_id"])
+                for entry in entries
+                if "entity_name" not in entry
+            ]
+        )
+        current = {}
+        for key, entry in zip(keys, entries):
+            if "entity_name" in entry:
+                data = nodes.get(entry["entity_name"])
+            else:
+                data = edges.get((entry["src_id"], entry["tgt_id"]))
+            if data is not None:
+                current[key] = data
+        return current
+
+    async def _summarize_batch(self, keys: list[str], global_config: dict) -> int:
+        entries = dict(zip(keys, await self.kv_storage.get_by_ids(keys)))
+        keys = [key for key in keys if entries[key] is not None]
+        entries = [entries[key] for key in keys]
+        current = {
+            key: data
+            for key, data in (await self._fetch(keys, entries)).items()
+            if needs_summary(data, global_config)
+        }
+        names = {
+            key: entry.get("entity_name") or f"({entry['src_id']}, {entry['tgt_id']})"
+            for key, entry in zip(keys, entries)
+        }
+        summaries = {}
+        if current:
+            summaries = await summarize_descriptions(
+                {
+                    key: (names[key], data["description"])
+                    for key, data in current.items()
+                },
+                global_config,
+            )
+
+        tokenizer = get_tokenizer_from_config(global_config)
+        async with graph_merge_locks(self.knowledge_graph_inst).hold(keys):
+            # decide on what is stored now, a merge may have run meanwhile
+            latest = await self._fetch(keys, entries)
+            settled = []
+            new_nodes = {}
+            new_edges = {}
+            for key, entry in zip(keys, entries):
+                data = latest.get(key)
+                if data is None or not needs_summary(data, global_config):
+                    settled.append(key)
+                    continue
+                if (
+                    key not in summaries
+                    or data["description"] != current[key]["description"]
+                ):
+                    continue
+                settled.append(key)
+                data = {
+                    **data,
+                    "description": summaries[key],
+                    **tokenizer.count_fields(summaries[key], "description_tokens"),
+                }
+                if "entity_name" in entry:
+                    new_nodes[entry["entity_name"]] = data
+                else:
+                    new_edges[(entry["src_id"], entry["tgt_id"])] = data
+            await self.knowledge_graph_inst.upsert_nodes(new_nodes)
+            await self.knowledge_graph_inst.upsert_edges(new_edges)
+            await self.kv_storage.delete(settled)
+
+        await upsert_extraction_vectors(
+            [
+                {"entity_name": name, "description": data["description"]}
+                for name, data in new_nodes.items()
+            ],
+            [
+                {
+                    "src_id": src_id,
+                    "tgt_id": tgt_id,
+                    "keywords": data["keywords"],
+                    "description": data["description"],
+                }
+                for (src_id, tgt_id), data in new_edges.items()
+            ],
+            self.entity_vdb,
+            self.relationships_vdb,
+        )
+        self.summarized += len(new_nodes) + len(new_edges)
+        return len(settled)
+
+    async def drain(self, global_config: dict) -> int:
+        """Summarize queued descriptions until the queue is empty. Returns the
+        number of descriptions summarized."""
+        batch_size = max(1, global_config["summary_batch_size"])
+        round_size = batch_size * max(1, global_config["llm_model_max_async"])
+        summarized = self.summarized
+        while True:
+            keys = await self.kv_storage.all_keys()
+            if not keys:
+                break
+            keys = keys[:round_size]
+            settled = sum(
+                await asyncio.gather(
+                    *[
+                        self._summarize_batch(keys[i : i + batch_size], global_config)
+                        for i in range(0, len(keys), batch_size)
+                    ]
+                )
+            )
+            if self.persist:
+                await asyncio.gather(
+                    *[
+                        storage.index_done_callback()
+                        for storage in (
+                            self.kv_storage,
+                            self.knowledge_graph_inst,
+                            self.entity_vdb,
+                            self.relationships_vdb,
+                        )
+                        if storage is not None
+                    ]
+                )
+            logger.info(
+                f"Summarized {self.summarized - summarized} descriptions, "
+                f"{await self.backlog()} left"
+            )
+            if not settled:
+                # everything left is being changed by merges, retry next drain
+                break
+        return self.summarized - summarized
+
+    def start(self, global_config: dict):
+        """Drain in a background task of the running loop, unless one is running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain_in_background(global_config))
+
+    async def _drain_in_background(self, global_config: dict):
+        try:
+            with llm_priority(BACKGROUND):
+                await self.drain(global_config)
+        except Exception as e:
+            # the entries stay queued for the next drain
+            logger.error(f"Background summarization failed: {e}")
+
+    async def wait(self, global_config: dict) -> int:
+        """Drain in the foreground, after any background drain in progress."""
+        summarized = self.summarized
+        if self._task is not None and not self._task.done():
+            await self._task
+        with llm_priority(BACKGROUND):
+            await self.drain(global_config)
+        return self.summarized - summarized
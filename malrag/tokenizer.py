@@ -0,0 +1,251 @@
+import math
+import re
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from .utils import encode_many, get_tiktoken_encoder
+
+VYAKARTH_TOKENIZER_NAME = "krutrim-ai-labs/vyakyarth"
+
+
+class Tokenizer:
+    """Counts tokens and cuts token windows for chunking, summaries and context budgets.
+
+    Subclasses only need ``token_offsets``; the other methods derive from it and
+    are overridden where the backend has a faster native path.
+    """
+
+    name: str = "base"
+
+    def token_offsets(self, content: str) -> list[int]:
+        """Return the character offsets of the token boundaries of ``content``:
+        token ``i`` spans ``content[offsets[i]:offsets[i + 1]]``."""
+        raise NotImplementedError
+
+    def count_many(self, contents: list[str]) -> list[int]:
+        return [len(self.token_offsets(content)) - 1 for content in contents]
+
+    def count(self, content: str) -> int:
+        return self.count_many([content])[0]
+
+    def count_fields(self, content: str, field: str = "tokens") -> dict:
+        """The token count of ``content`` to store on a record under ``field``,
+        with the name of this tokenizer next to it (``description_tokens`` goes
+        with ``description_tokenizer``)."""
+        return {field: self.count(content), _tokenizer_field(field): self.name}
+
+    def stored_count(self, data: dict, field: str = "tokens") -> Optional[int]:
+        """The count stored on ``data`` by ``count_fields``, or None when another
+        tokenizer (or an older version without the name) made it."""
+        if data.get(_tokenizer_field(field)) != self.name:
+            return None
+        return data.get(field)
+
+    def truncate(self, content: str, max_token_size: int) -> str:
+        offsets = self.token_offsets(content)
+        if len(offsets) - 1 <= max_token_size:
+            return content
+        return content[: offsets[max_token_size]]
+
+    def iter_windows(
+        self, content: str, max_token_size: int, overlap_token_size: int
+    ) -> Iterator[tuple[int, str]]:
+        """Yield ``(token_count, text)`` for overlapping token windows of ``content``."""
+        offsets = self.token_offsets(content)
+        n_tokens = len(offsets) - 1
+        for start in range(0, n_tokens, max_token_size - overlap_token_size):
+            end = min(start + max_token_size, n_tokens)
+            yield end - start, content[offsets[start] : offsets[end]]
+
+
+def _tokenizer_field(field: str) -> str:
+    return field[: -len("tokens")] + "tokenizer"
+
+
+# per-encoding cache of token id -> (byte length, char starts, starts on a char boundary)
+_TOKEN_SPAN_CACHE: dict[str, dict[int, tuple[int, int, bool]]] = {}
+
+
+def _token_boundary_offsets(encoder, tokens: list[int]):
+    """Map every token boundary to its byte offset and, when the boundary does not
+    fall inside a multi-byte character, to its character offset (else None)."""
+    span_cache = _TOKEN_SPAN_CACHE.setdefault(encoder.name, {})
+    byte_offsets = [0]
+    char_offsets = [0]
+    n_bytes = n_chars = 0
+    for token in tokens:
+        span = span_cache.get(token)
+        if span is None:
+            token_bytes = encoder.decode_single_token_bytes(token)
+            span = (
+                len(token_bytes),
+                sum(1 for c in token_bytes if not 0x80 <= c < 0xC0),
+                not 0x80 <= token_bytes[0] < 0xC0,
+            )
+            span_cache[token] = span
+        if not span[2]:
+            char_offsets[-1] = None
+        n_bytes += span[0]
+        n_chars += span[1]
+        byte_offsets.append(n_bytes)
+        char_offsets.append(n_chars)
+    return byte_offsets, char_offsets, n_chars
+
+
+class TiktokenTokenizer(Tokenizer):
+    """OpenAI BPE through tiktoken. The historical default (``gpt2``)."""
+
+    def __init__(self, model_name: str = "gpt2"):
+        self.model_name = model_name
+        self.name = f"tiktoken:{model_name}"
+
+    @property
+    def encoder(self):
+        return get_tiktoken_encoder(self.model_name)
+
+    def count_many(self, contents: list[str]) -> list[int]:
+        return [len(tokens) for tokens in encode_many(contents, self.model_name)]
+
+    def truncate(self, content: str, max_token_size: int) -> str:
+        tokens = self.encoder.encode(content)
+        if len(tokens) <= max_token_size:
+            return content
+        return self.encoder.decode(tokens[:max_token_size])
+
+    def iter_windows(
+        self, content: str, max_token_size: int, overlap_token_size: int
+    ) -> Iterator[tuple[int, str]]:
+        """Windows are slices of ``content``. Windows whose edges split a multi-byte
+        character (byte-level BPE does this a lot with Malayalam script) are decoded
+        from the UTF-8 bytes with the same replacement semantics as
+        ``Encoding.decode``, so the text matches decoding each window."""
+        encoder = self.encoder
+        tokens = encoder.encode(content)
+        byte_offsets, char_offsets, n_chars = _token_boundary_offsets(encoder, tokens)
+        lossless = n_chars == len(content)
+        content_bytes = None
+        for start in range(0, len(tokens), max_token_size - overlap_token_size):
+            end = min(start + max_token_size, len(tokens))
+            if not lossless:
+                window = encoder.decode(tokens[start:end])
+            elif char_offsets[start] is not None and char_offsets[end] is not None:
+                window = content[char_offsets[start] : char_offsets[end]]
+            else:
+                if content_bytes is None:
+                    content_bytes = content.encode("utf-8")
+                window = content_bytes[byte_offsets[start] : byte_offsets[end]].decode(
+                    "utf-8", errors="replace"
+                )
+            yield end - start, window
+
+
+@lru_cache(maxsize=None)
+def initialize_hf_tokenizer(model_name):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+
+
+class HFTokenizer(Tokenizer):
+    """Tokenizer of a HuggingFace model, by default the Vyakarth embedding model,
+    so budgets are measured the way the embedding model sees the text."""
+
+    def __init__(self, model_name: str = VYAKARTH_TOKENIZER_NAME):
+        self.model_name = model_name
+        self.name = f"hf:{model_name}"
+
+    def _encode(self, contents: list[str], **kwargs):
+        return initialize_hf_tokenizer(self.model_name)(
+            contents, add_special_tokens=False, verbose=False, **kwargs
+        )
+
+    def token_offsets(self, content: str) -> list[int]:
+        spans = self._encode([content], return_offsets_mapping=True)["offset_mapping"][
+            0
+        ]
+        if not spans:
+            return [0]
+        return [0] + [start for start, _ in spans[1:]] + [len(content)]
+
+    def count_many(self, contents: list[str]) -> list[int]:
+        if not contents:
+            return []
+        return [len(ids) for ids in self._encode(contents)["input_ids"]]
+
+
+class GeminiEstimateTokenizer(Tokenizer):
+    """Offline estimate of Gemini's SentencePiece token counts.
+
+    Text is split into script runs and each run is charged one token per
+    ``*_chars_per_token`` characters. Gemini's large SentencePiece vocabulary
+    keeps Malayalam far denser than byte-level BPE; tune the class attributes
+    against ``count_tokens`` for your own corpus.
+    """
+
+    name = "gemini"
+    malayalam_chars_per_token = 3
+    word_chars_per_token = 4
+    digit_chars_per_token = 3
+
+    _run_pattern = re.compile(
+        r"(?P<malayalam>[\u0D00-\u0D7F\u200C\u200D]+)"
+        r"|(?P<digits>\d+)"
+        r"|(?P<word>[^\W\d_]+)"
+        r"|(?P<symbol>\S)"
+    )
+
+    def _run_step(self, kind: str) -> int:
+        if kind == "malayalam":
+            return self.malayalam_chars_per_token
+        if kind == "digits":
+            return self.digit_chars_per_token
+        if kind == "word":
+            return self.word_chars_per_token
+        return 1
+
+    def token_offsets(self, content: str) -> list[int]:
+        offsets = [0]
+        for run in self._run_pattern.finditer(content):
+            step = self._run_step(run.lastgroup)
+            offsets.extend(range(run.start() + step, run.end(), step))
+            offsets.append(run.end())
+        if len(offsets) > 1:
+            offsets[-1] = len(content)
+        return offsets
+
+    def count_many(self, contents: list[str]) -> list[int]:
+        return [
+            sum(
+                math.ceil((run.end() - run.start()) / self._run_step(run.lastgroup))
+                for run in self._run_pattern.finditer(content)
+            )
+            for content in contents
+        ]
+
+
+TOKENIZERS = {
+    "tiktoken": TiktokenTokenizer,
+    "vyakarth": HFTokenizer,
+    "huggingface": HFTokenizer,
+    "gemini": lambda model_name=None: GeminiEstimateTokenizer(),
+}
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(kind: str = "tiktoken", model_name: str = None) -> Tokenizer:
+    if kind not in TOKENIZERS:
+        raise ValueError(
+            f"Unknown tokenizer {kind}, expected one of {list(TOKENIZERS)}"
+        )
+    if model_name is None:
+        return TOKENIZERS[kind]()
+    return TOKENIZERS[kind](model_name)
+
+
+def get_tokenizer_from_config(global_config: dict) -> Tokenizer:
+    """Resolve the tokenizer selected by ``MalRag.tokenizer``."""
+    kind = global_config.get("tokenizer", "tiktoken")
+    model_name = global_config.get("tokenizer_model_name")
+    if kind == "tiktoken" and model_name is None:
+        model_name = global_config.get("tiktoken_model_name", "gpt2")
+    return get_tokenizer(kind, model_name)
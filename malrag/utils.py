@@ -6,8 +6,12 @@ import json
 import logging
 import os
 import re
+import time
+from bisect import bisect_right
+from collections import deque
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from functools import wraps
+from itertools import accumulate
 from hashlib import md5
 from typing import Any, Union, List, Optional
 import xml.etree.ElementTree as ET
@@ -28,7 +32,44 @@ class UnlimitedSemaphore:
         pass
 
 
-ENCODER = None
+class KeyedLock:
+    """asyncio locks per key, created on demand and dropped once unused.
+
+    ``hold(keys)`` takes the locks of all ``keys`` in sorted order, so two
+    holders with overlapping keys queue up instead of deadlocking.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._users: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, keys):
+        registered = []
+        acquired = []
+        try:
+            for key in sorted(set(keys)):
+                self._users[key] = self._users.get(key, 0) + 1
+                registered.append(key)
+                lock = self._locks.setdefault(key, asyncio.Lock())
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in acquired:
+                lock.release()
+            for key in registered:
+                self._users[key] -= 1
+                if not self._users[key]:
+                    del self._users[key]
+                    del self._locks[key]
+
+
+# tiktoken encoders keyed by the model/encoding name they were requested for
+TIKTOKEN_ENCODERS: dict[str, tiktoken.Encoding] = {}
 
 logger = logging.getLogger("malrag")
 
@@ -111,26 +152,118 @@ def compute_mdhash_id(content, prefix: str = ""):
     return prefix + md5(content.encode()).hexdigest()
 
 
-def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
-    """Add restriction of maximum async calling times for a async func"""
+class ConcurrencyLimiter:
+    """At most ``max_size`` holders at a time, the others wait in FIFO order.
+
+    Waiters sleep on a future until a release hands them its slot, so nothing
+    polls the event loop, and a newcomer never overtakes a queued waiter. Use
+    it as ``async with limiter:``; the slot is released when the body raises
+    or is cancelled too.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self.in_flight = 0
+        self.completed = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < self.max_size:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.max_queued = max(self.max_queued, len(self._waiters))
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the cancel
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def release(self):
+        self.completed += 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # the slot goes straight to the waiter, in_flight is unchanged
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
 
-    def final_decro(func):
-        """Not using async.Semaphore to aovid use nest-asyncio"""
-        __current_size = 0
+    async def __aenter__(self):
+        await self.acquire()
+        return self
 
-        @wraps(func)
-        async def wait_func(*args, **kwargs):
-            nonlocal __current_size
-            while __current_size >= max_size:
-                await asyncio.sleep(waitting_time)
-            __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
-            return result
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "avg_wait_seconds": self.total_wait / max(1, self.completed),
+            "max_wait_seconds": self.max_wait,
+        }
 
-        return wait_func
 
-    return final_decro
+class ReleasingStream:
+    """Async iterator over ``stream`` that calls ``on_done(error)`` exactly once:
+    when the stream is exhausted (``error`` is None), raises (the exception) or
+    is closed with ``aclose`` (None), even before its first item. For resources
+    held by a streamed response until it has been read.
+    """
+
+    def __init__(self, stream, on_done):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._on_done = on_done
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._on_done is None:
+            raise StopAsyncIteration
+        try:
+            return await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._done(None)
+            raise
+        except BaseException as e:
+            self._done(e)
+            raise
+
+    def _done(self, error):
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done(error)
+
+    async def aclose(self):
+        if self._on_done is None:
+            return
+        try:
+            if hasattr(self._stream, "aclose"):
+                await self._stream.aclose()
+        finally:
+            self._done(None)
 
 
 def wrap_embedding_func_with_attrs(**kwargs):
@@ -155,19 +288,41 @@ def write_json(json_obj, file_name):
         json.dump(json_obj, f, indent=2, ensure_ascii=False)
 
 
+def get_tiktoken_encoder(model_name: str = "gpt-4o") -> tiktoken.Encoding:
+    """Return the tiktoken encoder registered for ``model_name``, loading it once.
+
+    ``model_name`` may be a model ("gpt2", "gpt-4o") or an encoding name
+    ("cl100k_base").
+    """
+    encoder = TIKTOKEN_ENCODERS.get(model_name)
+    if encoder is None:
+        try:
+            encoder = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoder = tiktoken.get_encoding(model_name)
+        TIKTOKEN_ENCODERS[model_name] = encoder
+    return encoder
+
+
 def encode_string_by_tiktoken(content: str, model_name: str = "gpt-4o"):
-    global ENCODER
-    if ENCODER is None:
-        ENCODER = tiktoken.encoding_for_model(model_name)
-    tokens = ENCODER.encode(content)
+    tokens = get_tiktoken_encoder(model_name).encode(content)
     return tokens
 
 
+def encode_many(
+    contents: list[str], model_name: str = "gpt-4o", num_threads: int = 8
+) -> list[list[int]]:
+    """Encode a list of strings in one call, using tiktoken's threaded batch encoder."""
+    if not contents:
+        return []
+    encoder = get_tiktoken_encoder(model_name)
+    if len(contents) == 1:
+        return [encoder.encode(contents[0])]
+    return encoder.encode_batch(contents, num_threads=num_threads)
+
+
 def decode_tokens_by_tiktoken(tokens: list[int], model_name: str = "gpt-4o"):
-    global ENCODER
-    if ENCODER is None:
-        ENCODER = tiktoken.encoding_for_model(model_name)
-    content = ENCODER.decode(tokens)
+    content = get_tiktoken_encoder(model_name).decode(tokens)
     return content
 
 
@@ -203,16 +358,39 @@ def is_float_regex(value):
     return bool(re.match(r"^[-+]?[0-9]*\.?[0-9]+$", value))
 
 
-def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
-    """Truncate a list of data by token size"""
+def truncate_list_by_token_size(
+    list_data: list,
+    key: callable,
+    max_token_size: int,
+    model_name: str = "gpt-4o",
+    tokenizer=None,
+    token_key: callable = None,
+):
+    """Truncate a list of data by token size.
+
+    ``token_key`` returns the token count stored on an item (``None`` if it has
+    none); only items without a stored count are tokenized, with ``tokenizer``
+    (see ``malrag.tokenizer``) when given, otherwise with the tiktoken encoder
+    of ``model_name``. The cut point is found by binary search over the running
+    token total.
+    """
     if max_token_size <= 0:
         return []
-    tokens = 0
-    for i, data in enumerate(list_data):
-        tokens += len(encode_string_by_tiktoken(key(data)))
-        if tokens > max_token_size:
-            return list_data[:i]
-    return list_data
+    counts = [token_key(data) for data in list_data] if token_key else []
+    if len(counts) != len(list_data):
+        counts = [None] * len(list_data)
+    missing = [i for i, count in enumerate(counts) if count is None]
+    if missing:
+        contents = [key(list_data[i]) for i in missing]
+        if tokenizer is not None:
+            missing_counts = tokenizer.count_many(contents)
+        else:
+            missing_counts = [
+                len(t) for t in encode_many(contents, model_name=model_name)
+            ]
+        for i, count in zip(missing, missing_counts):
+            counts[i] = count
+    return list_data[: bisect_right(list(accumulate(counts)), max_token_size)]
 
 
 def list_of_list_to_csv(data: List[List[str]]) -> str:
@@ -0,0 +1,150 @@
+"""Measure Gemini throughput against the number of API keys.
+
+Sends --calls completions, --concurrency at a time, to a local stand-in for
+the Gemini API that allows --rpm requests per key per quota window and
+answers 429 (ResourceExhausted) beyond that. A window lasts --period seconds
+instead of a minute so the run stays short; the old backoff is scaled the
+same way. Runs, for 1, 2, 4 ... --max-keys keys:
+
+* rotate: the old scheme, every call on the current key, rotating to the
+  next key and backing off (1-10 "seconds", up to 5 attempts) after a failure
+* dispatch: GeminiKeyManager.lease, calls spread over the per-key buckets
+
+and reports how long the calls took, how many got an answer, the 429s the
+stand-in sent back and the calls that failed for good.
+
+Usage:
+    python scripts/bench_gemini_keys.py [--calls 100] [--rpm 10] [--max-keys 8]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from collections import defaultdict, deque
+
+from google.api_core.exceptions import ResourceExhausted
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag.llm import GeminiKeyManager
+
+
+class QuotaStandIn:
+    def __init__(self, args):
+        self.args = args
+        self.windows = defaultdict(deque)
+        self.rejected = 0
+
+    async def generate(self, key):
+        now = asyncio.get_running_loop().time()
+        window = self.windows[key]
+        while window and window[0] <= now - self.args.period:
+            window.popleft()
+        if len(window) >= self.args.rpm:
+            self.rejected += 1
+            raise ResourceExhausted(
+                "429 Resource has been exhausted (e.g. check quota)."
+            )
+        window.append(now)
+        await asyncio.sleep(self.args.latency)
+        return "ok"
+
+
+def rotate_call(args, manager, api):
+    scale = args.period / 60
+
+    @retry(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential(multiplier=scale, min=scale, max=10 * scale),
+        retry=retry_if_exception_type(Exception),
+    )
+    async def call():
+        key = manager.get_current_key()
+        try:
+            return await api.generate(key)
+        except Exception:
+            manager.rotate_key()
+            raise
+
+    return call
+
+
+def dispatch_call(args, manager, api):
+    async def call():
+        for attempt in range(5):
+            try:
+                async with manager.lease() as key:
+                    return await api.generate(key)
+            except ResourceExhausted:
+                if attempt == 4:
+                    raise
+
+    return call
+
+
+async def run(args, n_keys, make_call) -> dict:
+    keys = [f"key-{i:04d}" for i in range(n_keys)]
+    # the quota of a key is exactly the stand-in's limit
+    manager = GeminiKeyManager(keys, rpm=args.rpm, tpm=1e9, period=args.period)
+    api = QuotaStandIn(args)
+    call = make_call(args, manager, api)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failed = 0
+
+    async def one():
+        nonlocal failed
+        async with semaphore:
+            try:
+                await call()
+            except Exception:
+                failed += 1
+
+    start = asyncio.get_running_loop().time()
+    await asyncio.gather(*[one() for _ in range(args.calls)])
+    elapsed = asyncio.get_running_loop().time() - start
+    return {
+        "secs": elapsed,
+        "ok": args.calls - failed,
+        "rejected": api.rejected,
+        "failed": failed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rpm", type=int, default=10)
+    parser.add_argument("--period", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max-keys", type=int, default=8)
+    args = parser.parse_args()
+    # the 429 warnings would bury the table
+    logging.disable(logging.WARNING)
+
+    print(
+        f"\n{args.calls} calls, {args.concurrency} at a time, {args.rpm} requests "
+        f"per key per {args.period:.1f}s window"
+    )
+    print(f"{'keys':>5}{'scheme':>10}{'secs':>8}{'ok':>6}{'429s':>7}{'failed':>8}")
+    n_keys = 1
+    while n_keys <= args.max_keys:
+        for name, make_call in (("rotate", rotate_call), ("dispatch", dispatch_call)):
+            row = asyncio.run(run(args, n_keys, make_call))
+            print(
+                f"{n_keys:>5}{name:>10}{row['secs']:>8.2f}{row['ok']:>6}"
+                f"{row['rejected']:>7}{row['failed']:>8}"
+            )
+        n_keys *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Compare the pipelined MalRag.ainsert with the old phase-by-phase insert.
+
+Both runs use a stub LLM and a stub embedding function that only sleep, so the
+numbers show how much of the provider latency the pipeline overlaps.
+
+Usage:
+    python scripts/bench_ingestion_pipeline.py [--docs 20] [--llm-latency 0.2] [--embed-latency 0.1]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag import MalRag
+from malrag.operate import extract_entities, iter_chunks_by_token_size
+from malrag.prompt import PROMPTS
+from malrag.tokenizer import get_tokenizer_from_config
+from malrag.utils import EmbeddingFunc, compute_mdhash_id
+
+ENTITY_NAMES = ["KOCHI", "KERALA", "METRO", "PERIYAR", "MUNNAR", "ONAM", "KATHAKALI"]
+EMBEDDING_DIM = 64
+
+
+def make_stub_llm(latency: float, calls: list):
+    tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+    record_delimiter = PROMPTS["DEFAULT_RECORD_DELIMITER"]
+
+    async def stub_llm(prompt, system_prompt=None, history_messages=[], **kwargs):
+        calls.append(prompt)
+        await asyncio.sleep(latency)
+        if history_messages:
+            # gleaning and loop questions
+            return "no" if "YES | NO" in prompt else ""
+        seed = int(hashlib.md5(prompt.encode()).hexdigest(), 16)
+        names = [ENTITY_NAMES[(seed >> (4 * i)) % len(ENTITY_NAMES)] for i in range(3)]
+        records = [
+            f'("entity"{tuple_delimiter}"{name}"{tuple_delimiter}"location"'
+            f'{tuple_delimiter}"{name.title()} mentioned in chunk {seed % 1000}.")'
+            for name in names
+        ]
+        if names[0] != names[1]:
+            records.append(
+                f'("relationship"{tuple_delimiter}"{names[0]}"{tuple_delimiter}"{names[1]}"'
+                f'{tuple_delimiter}"Both appear together."{tuple_delimiter}"travel"{tuple_delimiter}1)'
+            )
+        return record_delimiter.join(records) + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+
+    return stub_llm
+
+
+def make_stub_embedding(latency: float):
+    async def stub_embedding(texts: list[str]) -> np.ndarray:
+        await asyncio.sleep(latency)
+        rng = np.random.default_rng(len(texts))
+        return rng.random((len(texts), EMBEDDING_DIM))
+
+    return EmbeddingFunc(
+        embedding_dim=EMBEDDING_DIM, max_token_size=8192, func=stub_embedding
+    )
+
+
+async def phased_insert(rag: MalRag, documents: list[str]):
+    """The old ainsert: chunk everything, embed everything, extract, then merge."""
+    new_docs = {
+        compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
+        for c in documents
+    }
+    tokenizer = get_tokenizer_from_config(asdict(rag))
+    inserting_chunks = {}
+    for doc_key, doc in new_docs.items():
+        for dp in iter_chunks_by_token_size(
+            doc["content"],
+            overlap_token_size=rag.chunk_overlap_token_size,
+            max_token_size=rag.chunk_token_size,
+            tokenizer=tokenizer,
+        ):
+            inserting_chunks[compute_mdhash_id(dp["content"], prefix="chunk-")] = {
+                **dp,
+                "full_doc_id": doc_key,
+            }
+    await rag.chunks_vdb.upsert(inserting_chunks)
+    await extract_entities(
+        inserting_chunks,
+        knowledge_graph_inst=rag.chunk_entity_relation_graph,
+        entity_vdb=rag.entities_vdb,
+        relationships_vdb=rag.relationships_vdb,
+        global_config=asdict(rag),
+    )
+    await rag.full_docs.upsert(new_docs)
+    await rag.text_chunks.upsert(inserting_chunks)
+
+
+def build_rag(args, working_dir: str, calls: list) -> MalRag:
+    return MalRag(
+        working_dir=working_dir,
+        llm_model_func=make_stub_llm(args.llm_latency, calls),
+        embedding_func=make_stub_embedding(args.embed_latency),
+        llm_model_max_async=args.llm_max_async,
+        embedding_func_max_async=args.embed_max_async,
+        embedding_batch_num=args.embedding_batch_num,
+        chunk_token_size=args.chunk_token_size,
+        chunk_overlap_token_size=args.chunk_overlap_token_size,
+        tokenizer=args.tokenizer,
+        enable_llm_cache=False,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--doc-sentences", type=int, default=400)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embed-latency", type=float, default=0.1)
+    parser.add_argument("--llm-max-async", type=int, default=16)
+    parser.add_argument("--embed-max-async", type=int, default=4)
+    parser.add_argument("--embedding-batch-num", type=int, default=32)
+    parser.add_argument("--chunk-token-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap-token-size", type=int, default=30)
+    parser.add_argument("--tokenizer", default="tiktoken")
+    args = parser.parse_args()
+
+    documents = [
+        " ".join(
+            f"Document {d} sentence {i}: {ENTITY_NAMES[(d + i) % len(ENTITY_NAMES)].title()} "
+            f"ഉത്സവം {i * d}."
+            for i in range(args.doc_sentences)
+        )
+        for d in range(args.docs)
+    ]
+
+    rows = []
+    for name in ("phased", "pipelined"):
+        working_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+        calls = []
+        stage_stats = {}
+
+        async def record_progress(step, stats=None):
+            if stats is not None:
+                stage_stats[step] = stats
+
+        try:
+            rag = build_rag(args, working_dir, calls)
+            start = time.perf_counter()
+            if name == "phased":
+                asyncio.run(phased_insert(rag, documents))
+            else:
+                asyncio.run(rag.ainsert(documents, progress_callback=record_progress))
+            elapsed = time.perf_counter() - start
+            rows.append(
+                (
+                    name,
+                    elapsed,
+                    len(calls),
+                    rag.chunk_entity_relation_graph._graph.number_of_nodes(),
+                )
+            )
+        finally:
+            shutil.rmtree(working_dir, ignore_errors=True)
+        for step, stats in stage_stats.items():
+            print(f"  {name} {step:<20} {stats}")
+
+    print(f"\n{'mode':<12}{'secs':>8}{'llm calls':>11}{'nodes':>7}{'speedup':>9}")
+    for name, elapsed, n_calls, n_nodes in rows:
+        print(
+            f"{name:<12}{elapsed:>8.2f}{n_calls:>11}{n_nodes:>7}{rows[0][1] / elapsed:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Measure event-loop lag while extraction calls queue behind a concurrency limit.
+
+Queues --calls stub extraction calls (each awaiting --call-latency seconds)
+behind a limit of --max-async, while a probe task sleeps --probe-interval in a
+loop and records how late it wakes up: that lateness is what every other
+coroutine on the loop (e.g. the FastAPI handlers) waits on top of its own work.
+Runs the old busy-wait limiter and the priority scheduler MalRag uses, and
+reports the lag percentiles and the CPU time burnt.
+
+Usage:
+    python scripts/bench_limiter_lag.py [--calls 1000] [--max-async 16]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from functools import wraps
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag.scheduler import PriorityScheduler
+
+
+def busy_wait_limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
+    """The limiter before it was event-driven, kept as the baseline."""
+
+    def final_decro(func):
+        __current_size = 0
+
+        @wraps(func)
+        async def wait_func(*args, **kwargs):
+            nonlocal __current_size
+            while __current_size >= max_size:
+                await asyncio.sleep(waitting_time)
+            __current_size += 1
+            result = await func(*args, **kwargs)
+            __current_size -= 1
+            return result
+
+        return wait_func
+
+    return final_decro
+
+
+async def run(args, limit) -> dict:
+    async def extraction_call(i):
+        await asyncio.sleep(args.call_latency)
+        return i
+
+    func = limit(extraction_call)
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            start = loop.time()
+            await asyncio.sleep(args.probe_interval)
+            lags.append(loop.time() - start - args.probe_interval)
+
+    probe_task = asyncio.create_task(probe())
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*[func(i) for i in range(args.calls)])
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    done.set()
+    await probe_task
+    lags_ms = np.array(lags) * 1000
+    return {
+        "secs": elapsed,
+        "cpu": cpu,
+        "p50": np.percentile(lags_ms, 50),
+        "p99": np.percentile(lags_ms, 99),
+        "max": lags_ms.max(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--max-async", type=int, default=16)
+    parser.add_argument("--call-latency", type=float, default=0.05)
+    parser.add_argument("--probe-interval", type=float, default=0.005)
+    args = parser.parse_args()
+
+    limiters = {
+        "busy-wait": busy_wait_limit_async_func_call(args.max_async),
+        "scheduler": PriorityScheduler(args.max_async).wrap,
+    }
+    print(
+        f"\n{args.calls} calls of {args.call_latency * 1000:.0f} ms, "
+        f"{args.max_async} at a time; lag of a {args.probe_interval * 1000:.0f} ms sleep"
+    )
+    print(
+        f"{'limiter':>13}{'secs':>8}{'cpu secs':>10}{'lag p50 ms':>12}{'p99 ms':>9}{'max ms':>9}"
+    )
+    for name, limit in limiters.items():
+        row = asyncio.run(run(args, limit))
+        print(
+            f"{name:>13}{row['secs']:>8.2f}{row['cpu']:>10.2f}{row['p50']:>12.2f}"
+            f"{row['p99']:>9.2f}{row['max']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
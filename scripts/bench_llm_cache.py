@@ -0,0 +1,93 @@
+"""Measure the LLM calls the LLM response cache saves on a query sweep.
+
+Builds a MalRag on a stub LLM (answering after --llm-latency seconds) and asks
+--questions questions in local and hybrid mode, once with enable_llm_cache
+off, once on, and once more on after a restart over the same working
+directory. The answer cache is keyed by mode, so without the call
+cache every mode extracts the keywords again. Reports the keyword and answer
+calls that reached the stub and the wall time.
+
+Usage:
+    python scripts/bench_llm_cache.py [--questions 20] [--llm-latency 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag import MalRag
+from malrag.base import QueryParam
+from malrag.utils import EmbeddingFunc
+
+# global mode on an empty graph falls back to local without any local context
+MODES = ("local", "hybrid")
+
+
+async def run(args, working_dir, enable_llm_cache: bool) -> dict:
+    counts = {"keywords": 0, "answers": 0}
+
+    async def stub_llm(prompt, system_prompt=None, history_messages=[], **kwargs):
+        await asyncio.sleep(args.llm_latency)
+        if kwargs.get("keyword_extraction"):
+            counts["keywords"] += 1
+            return '{"high_level_keywords": ["place"], "low_level_keywords": ["Kochi"]}'
+        counts["answers"] += 1
+        return "Kochi is in Kerala."
+
+    async def stub_embedding(texts):
+        return np.ones((len(texts), 8))
+
+    rag = MalRag(
+        working_dir=working_dir,
+        llm_model_func=stub_llm,
+        embedding_func=EmbeddingFunc(
+            embedding_dim=8, max_token_size=8192, func=stub_embedding
+        ),
+        tokenizer="gemini",
+        enable_llm_cache=enable_llm_cache,
+    )
+    start = time.perf_counter()
+    for mode in MODES:
+        for i in range(args.questions):
+            await rag.aquery(f"Where is place {i}?", QueryParam(mode=mode))
+    elapsed = time.perf_counter() - start
+    await rag._query_done()
+    return {"secs": elapsed, **counts, "cache": await rag.allm_cache_stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rows = {}
+    with tempfile.TemporaryDirectory() as working_dir:
+        rows["off"] = asyncio.run(run(args, working_dir, False))
+    with tempfile.TemporaryDirectory() as working_dir:
+        rows["on"] = asyncio.run(run(args, working_dir, True))
+        rows["on, restarted"] = asyncio.run(run(args, working_dir, True))
+
+    print(f"\n{args.questions} questions asked in {', '.join(MODES)} mode")
+    print(
+        f"{'llm cache':>14}{'secs':>7}{'keyword calls':>15}{'answer calls':>14}{'hit rate':>10}"
+    )
+    for name, row in rows.items():
+        hit_rate = row["cache"].get("hit_rate")
+        print(
+            f"{name:>14}{row['secs']:>7.2f}{row['keywords']:>15}{row['answers']:>14}"
+            f"{'-' if hit_rate is None else hit_rate:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Measure how many chunks the local NER tier keeps away from the LLM.
+
+Ingests the sample corpus (frontend/public/documents/*.txt), then re-ingests it
+into the same graph with a different chunk size, as a re-index with new chunk
+settings would. The new chunk ids and texts miss the extraction checkpoints,
+and the extraction cache and near-duplicate reuse are off, so without the tier
+every re-ingested chunk is an LLM extraction. The stub LLM extracts the
+capitalized phrases of a text, so the tier and the LLM agree on what an entity
+is; the run reports the fraction of re-ingested chunks tagged locally and the
+LLM calls with the tier on and off.
+
+Usage:
+    python scripts/bench_local_ner.py [--chunk-token-size 120] [--reingest-chunk-token-size 90]
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag import MalRag
+from malrag.gazetteer import capitalized_mentions
+from malrag.prompt import PROMPTS
+from malrag.utils import EmbeddingFunc
+
+EMBEDDING_DIM = 64
+DOCUMENTS_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "frontend", "public", "documents"
+)
+
+
+def make_stub_llm(args, usage: dict):
+    d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+
+    async def stub_llm(prompt, system_prompt=None, history_messages=[], **kwargs):
+        usage["calls"] += 1
+        await asyncio.sleep(args.llm_latency)
+        if history_messages:
+            return "no"
+        text = prompt.split("-Real Data-")[1].split("Text: ", 1)[1]
+        names = list(dict.fromkeys(capitalized_mentions(text)))
+        records = [
+            f'("entity"{d}"{name.upper()}"{d}"organization"{d}"{name} is mentioned.")'
+            for name in names
+        ]
+        records += [
+            f'("relationship"{d}"{a.upper()}"{d}"{b.upper()}"{d}"Both appear together."{d}"report"{d}1)'
+            for a, b in zip(names, names[1:])
+        ]
+        return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+
+    return stub_llm
+
+
+async def stub_embedding(texts: list[str]) -> np.ndarray:
+    return np.random.default_rng(len(texts)).random((len(texts), EMBEDDING_DIM))
+
+
+def make_rag(args, working_dir, usage, chunk_token_size, enable_local_ner):
+    return MalRag(
+        working_dir=working_dir,
+        llm_model_func=make_stub_llm(args, usage),
+        embedding_func=EmbeddingFunc(
+            embedding_dim=EMBEDDING_DIM, max_token_size=8192, func=stub_embedding
+        ),
+        llm_model_max_async=args.llm_max_async,
+        chunk_token_size=chunk_token_size,
+        chunk_overlap_token_size=args.chunk_overlap_token_size,
+        tokenizer=args.tokenizer,
+        enable_llm_cache=False,
+        enable_extraction_cache=False,
+        enable_local_ner=enable_local_ner,
+    )
+
+
+def run(args, documents, enable_local_ner):
+    working_dir = tempfile.mkdtemp(prefix="bench_local_ner_")
+    usage = {"calls": 0}
+    stage_stats = {}
+
+    async def progress_callback(step, stats=None):
+        if stats is not None:
+            stage_stats[step] = stats
+
+    try:
+        rag = make_rag(args, working_dir, usage, args.chunk_token_size, False)
+        asyncio.run(rag.ainsert(documents))
+        n_nodes = rag.chunk_entity_relation_graph._graph.number_of_nodes()
+
+        # same documents, new chunks: drop the document records so they insert
+        for name in ("full_docs", "doc_chunks"):
+            os.remove(os.path.join(working_dir, f"kv_store_{name}.json"))
+        usage["calls"] = 0
+        rag = make_rag(
+            args, working_dir, usage, args.reingest_chunk_token_size, enable_local_ner
+        )
+        start = time.perf_counter()
+        asyncio.run(rag.ainsert(documents, progress_callback=progress_callback))
+        elapsed = time.perf_counter() - start
+        extract_stats = stage_stats["extracting_entities"]
+        return (
+            enable_local_ner,
+            extract_stats["items"],
+            extract_stats.get("local_tagged", 0),
+            usage["calls"],
+            elapsed,
+            n_nodes,
+        )
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", default=os.path.join(DOCUMENTS_DIR, "*.txt"))
+    parser.add_argument("--chunk-token-size", type=int, default=120)
+    parser.add_argument("--reingest-chunk-token-size", type=int, default=90)
+    parser.add_argument("--chunk-overlap-token-size", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-max-async", type=int, default=4)
+    parser.add_argument("--tokenizer", default="gemini")
+    args = parser.parse_args()
+
+    documents = []
+    for path in sorted(glob.glob(args.documents)):
+        with open(path, encoding="utf-8") as f:
+            documents.append(f.read())
+    if not documents:
+        parser.error(f"no documents match {args.documents}")
+
+    rows = [
+        run(args, documents, enable_local_ner) for enable_local_ner in (False, True)
+    ]
+    print(f"\n{len(documents)} documents, {rows[0][5]} entities after the first ingest")
+    print(
+        f"{'local ner':>10}{'chunks':>8}{'tagged':>8}{'skipped':>9}{'llm calls':>11}{'secs':>8}"
+    )
+    for enable_local_ner, chunks, tagged, calls, elapsed, _ in rows:
+        print(
+            f"{'on' if enable_local_ner else 'off':>10}{chunks:>8}{tagged:>8}"
+            f"{tagged / chunks:>9.0%}{calls:>11}{elapsed:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
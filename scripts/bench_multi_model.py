@@ -0,0 +1,128 @@
+"""Compare MultiModel routing policies on stub models.
+
+Three stub gen_funcs with log-normal latencies:
+
+* fast: median --fast-ms
+* slow: median --slow-ms, a heavier tail
+* flaky: as fast as fast, but every call fails during the --outage window
+  (seconds after the start), as a backend that is down or rate limited would
+
+--calls calls run --concurrency at a time through round robin without
+ejection (what MultiModel did before), then round robin, least-in-flight and
+EWMA-latency with health ejection. For each it reports the wall time, the
+latency percentiles, the failed calls and each model's share of the calls.
+
+Usage:
+    python scripts/bench_multi_model.py [--calls 600] [--concurrency 24]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag.llm import Model, MultiModel
+
+
+def stub_model(name, median_ms, sigma, rng, outage=None):
+    async def gen_func(prompt, system_prompt=None, history_messages=[], **kwargs):
+        await asyncio.sleep(median_ms / 1000 * rng.lognormal(0, sigma))
+        if outage is not None:
+            elapsed = time.monotonic() - outage["start"]
+            if outage["from"] <= elapsed < outage["to"]:
+                raise RuntimeError(f"{name} is down")
+        return name
+
+    return Model(gen_func=gen_func, kwargs={"model": name}, name=name)
+
+
+async def run(args, policy, max_failures) -> dict:
+    rng = np.random.default_rng(0)
+    outage = {"start": time.monotonic(), "from": args.outage[0], "to": args.outage[1]}
+    models = [
+        stub_model("fast", args.fast_ms, 0.3, rng),
+        stub_model("slow", args.slow_ms, 0.6, rng),
+        stub_model("flaky", args.fast_ms, 0.3, rng, outage),
+    ]
+    multi = MultiModel(
+        models,
+        policy=policy,
+        max_failures=max_failures,
+        ejection_seconds=args.ejection,
+        readmission_seconds=args.ejection,
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    failed = 0
+
+    async def one(i):
+        nonlocal failed
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await multi.llm_model_func(f"prompt {i}")
+            except RuntimeError:
+                failed += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.calls)])
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    stats = multi.stats()
+    return {
+        "secs": elapsed,
+        "p50": np.percentile(latencies_ms, 50),
+        "p99": np.percentile(latencies_ms, 99),
+        "failed": failed,
+        "share": {
+            name: (s["completed"] + s["failed"]) / args.calls
+            for name, s in stats.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=24)
+    parser.add_argument("--fast-ms", type=float, default=50)
+    parser.add_argument("--slow-ms", type=float, default=400)
+    parser.add_argument("--outage", type=float, nargs=2, default=(0.5, 2.5))
+    parser.add_argument("--ejection", type=float, default=1.0)
+    args = parser.parse_args()
+    # an ejection warning per run is noise here
+    logging.disable(logging.WARNING)
+
+    print(
+        f"\n{args.calls} calls, {args.concurrency} at a time; fast {args.fast_ms:.0f} ms, "
+        f"slow {args.slow_ms:.0f} ms, flaky down {args.outage[0]}-{args.outage[1]}s"
+    )
+    print(
+        f"{'policy':>22}{'secs':>7}{'p50 ms':>9}{'p99 ms':>9}{'failed':>8}"
+        f"{'fast':>7}{'slow':>7}{'flaky':>7}"
+    )
+    runs = (
+        ("round_robin, no eject", "round_robin", None),
+        ("round_robin", "round_robin", 3),
+        ("least_in_flight", "least_in_flight", 3),
+        ("ewma_latency", "ewma_latency", 3),
+    )
+    for label, policy, max_failures in runs:
+        row = asyncio.run(run(args, policy, max_failures))
+        share = row["share"]
+        print(
+            f"{label:>22}{row['secs']:>7.2f}{row['p50']:>9.1f}{row['p99']:>9.1f}"
+            f"{row['failed']:>8}{share['fast']:>7.0%}{share['slow']:>7.0%}{share['flaky']:>7.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Measure packed entity extraction against one extraction prompt per chunk.
+
+The stub LLM sleeps for a fixed per-call latency plus a per-token prefill cost,
+and answers packed prompts with a ``("text"<|>n)`` line per text, so the run
+shows the prompt tokens sent per chunk and the wall time for every pack size.
+Pass --fixed-gleaning to compare with gleaning every prompt.
+
+Usage:
+    python scripts/bench_packed_extraction.py [--docs 10] [--pack-sizes 1,2,4,8] [--fixed-gleaning]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag import MalRag
+from malrag.prompt import PROMPTS
+from malrag.tokenizer import get_tokenizer
+from malrag.utils import EmbeddingFunc
+
+ENTITY_NAMES = ["Kochi", "Kerala", "Metro", "Periyar", "Munnar", "Onam", "Kathakali"]
+EMBEDDING_DIM = 64
+
+
+def make_stub_llm(args, tokenizer, usage: dict):
+    d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+    marker = f'("text"{d}'
+
+    def records_for(text):
+        names = [name for name in ENTITY_NAMES if name in text]
+        records = [
+            f'("entity"{d}"{name.upper()}"{d}"location"{d}"{name} is mentioned.")'
+            for name in names
+        ]
+        records += [
+            f'("relationship"{d}"{a.upper()}"{d}"{b.upper()}"{d}"Both appear together."{d}"travel"{d}1)'
+            for a, b in zip(names, names[1:])
+        ]
+        return records
+
+    async def stub_llm(prompt, system_prompt=None, history_messages=[], **kwargs):
+        n_tokens = tokenizer.count(prompt) + sum(
+            tokenizer.count(m["content"]) for m in history_messages
+        )
+        usage["calls"] += 1
+        usage["prompt_tokens"] += n_tokens
+        await asyncio.sleep(args.llm_latency + n_tokens * args.prefill_latency)
+        if history_messages:
+            if "more_entities" in prompt:
+                return f'("more_entities"{d}NO)'
+            return "no" if "YES | NO" in prompt else ""
+        text = prompt.split("-Real Data-")[1].split("Text: ", 1)[1]
+        if marker not in text:
+            records = records_for(text)
+        else:
+            records = []
+            for section in text.split(marker)[1:]:
+                text_id, section_text = section.split(")", 1)
+                records.append(f"{marker}{text_id})")
+                records.extend(records_for(section_text))
+        return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+
+    return stub_llm
+
+
+async def stub_embedding(texts: list[str]) -> np.ndarray:
+    return np.random.default_rng(len(texts)).random((len(texts), EMBEDDING_DIM))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--doc-sentences", type=int, default=120)
+    parser.add_argument("--pack-sizes", default="1,2,4,8")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--prefill-latency", type=float, default=0.00005)
+    parser.add_argument("--llm-max-async", type=int, default=4)
+    parser.add_argument("--chunk-token-size", type=int, default=200)
+    parser.add_argument("--chunk-overlap-token-size", type=int, default=20)
+    parser.add_argument("--max-gleaning", type=int, default=1)
+    parser.add_argument("--tokenizer", default="gemini")
+    parser.add_argument(
+        "--fixed-gleaning",
+        action="store_true",
+        help="glean every prompt (adaptive_gleaning=False)",
+    )
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(args.tokenizer)
+    documents = [
+        " ".join(
+            f"Notice {d}.{i}: {ENTITY_NAMES[(d + i) % len(ENTITY_NAMES)]} and "
+            f"{ENTITY_NAMES[(d * i) % len(ENTITY_NAMES)]} ഉത്സവം {i * d}."
+            for i in range(args.doc_sentences)
+        )
+        for d in range(args.docs)
+    ]
+
+    rows = []
+    for pack_size in (int(size) for size in args.pack_sizes.split(",")):
+        working_dir = tempfile.mkdtemp(prefix=f"bench_pack{pack_size}_")
+        usage = {"calls": 0, "prompt_tokens": 0}
+        try:
+            rag = MalRag(
+                working_dir=working_dir,
+                llm_model_func=make_stub_llm(args, tokenizer, usage),
+                embedding_func=EmbeddingFunc(
+                    embedding_dim=EMBEDDING_DIM,
+                    max_token_size=8192,
+                    func=stub_embedding,
+                ),
+                llm_model_max_async=args.llm_max_async,
+                chunk_token_size=args.chunk_token_size,
+                chunk_overlap_token_size=args.chunk_overlap_token_size,
+                entity_extract_max_gleaning=args.max_gleaning,
+                adaptive_gleaning=not args.fixed_gleaning,
+                extraction_pack_size=pack_size,
+                tokenizer=args.tokenizer,
+                enable_llm_cache=False,
+            )
+            start = time.perf_counter()
+            asyncio.run(rag.ainsert(documents))
+            elapsed = time.perf_counter() - start
+            graph = rag.chunk_entity_relation_graph._graph
+            rows.append(
+                (
+                    pack_size,
+                    elapsed,
+                    usage["calls"],
+                    usage["prompt_tokens"] / len(rag.text_chunks._data),
+                    graph.number_of_nodes(),
+                    graph.number_of_edges(),
+                )
+            )
+        finally:
+            shutil.rmtree(working_dir, ignore_errors=True)
+
+    print(
+        f"\n{'pack':>5}{'secs':>8}{'llm calls':>11}{'tokens/chunk':>14}{'nodes':>7}{'edges':>7}{'speedup':>9}"
+    )
+    for pack_size, elapsed, calls, tokens_per_chunk, nodes, edges in rows:
+        print(
+            f"{pack_size:>5}{elapsed:>8.2f}{calls:>11}{tokens_per_chunk:>14.0f}"
+            f"{nodes:>7}{edges:>7}{rows[0][1] / elapsed:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
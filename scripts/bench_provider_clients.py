@@ -0,0 +1,139 @@
+"""Measure pooled provider clients against a new client per call.
+
+Starts a local HTTP stand-in for the OpenAI chat completions API (answering
+after --server-latency seconds) and sends --calls completions, --concurrency
+at a time, once building a new AsyncOpenAI per call (as
+openai_complete_if_cache used to) and once through openai_complete_if_cache
+with the pooled client registry. The stand-in counts the TCP connections it
+accepts; pass --tls-latency to add that much to the first request of every
+connection, as a TLS handshake to a remote API would.
+
+Usage:
+    python scripts/bench_provider_clients.py [--calls 500] [--concurrency 16]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from aiohttp import web
+from openai import AsyncOpenAI
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag.llm import openai_complete_if_cache, provider_clients
+
+
+def make_app(args, connections: set):
+    async def chat_completions(request):
+        body = await request.json()
+        transport = id(request.transport)
+        if transport not in connections:
+            connections.add(transport)
+            await asyncio.sleep(args.tls_latency)
+        await asyncio.sleep(args.server_latency)
+        return web.json_response(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "ok"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+async def per_call_client(base_url, prompt):
+    # closed here, the old code left that to the garbage collector
+    async with AsyncOpenAI(base_url=base_url, api_key="bench") as client:
+        response = await client.chat.completions.create(
+            model="bench", messages=[{"role": "user", "content": prompt}]
+        )
+    return response.choices[0].message.content
+
+
+async def pooled_client(base_url, prompt):
+    return await openai_complete_if_cache(
+        "bench", prompt, base_url=base_url, api_key="bench"
+    )
+
+
+async def run(args, call) -> dict:
+    connections = set()
+    runner = web.AppRunner(make_app(args, connections))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}/v1"
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(base_url, f"prompt {i}")
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(args.calls)])
+        elapsed = time.perf_counter() - start
+    finally:
+        await provider_clients.aclose()
+        await runner.cleanup()
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "secs": elapsed,
+        "p50": np.percentile(latencies_ms, 50),
+        "p99": np.percentile(latencies_ms, 99),
+        "connections": len(connections),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--server-latency", type=float, default=0.02)
+    parser.add_argument("--tls-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    # a log line per request would dominate the timings
+    logging.disable(logging.INFO)
+
+    print(
+        f"\n{args.calls} completions, {args.concurrency} at a time, "
+        f"{args.server_latency * 1000:.0f} ms server latency, "
+        f"{args.tls_latency * 1000:.0f} ms per new connection"
+    )
+    print(f"{'client':>10}{'secs':>8}{'p50 ms':>9}{'p99 ms':>9}{'connections':>13}")
+    for name, call in (("per call", per_call_client), ("pooled", pooled_client)):
+        row = asyncio.run(run(args, call))
+        print(
+            f"{name:>10}{row['secs']:>8.2f}{row['p50']:>9.1f}{row['p99']:>9.1f}"
+            f"{row['connections']:>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Measure single-flight coalescing on a burst of identical queries.
+
+Builds a MalRag on stub LLM and embedding functions (each answering after
+--llm-latency / --embedding-latency seconds) and sends --users concurrent
+queries drawn from --questions distinct questions, once with
+enable_single_flight off and once on. Reports the LLM and embedding calls that
+reached the stub and the wall time.
+
+Usage:
+    python scripts/bench_single_flight.py [--users 50] [--questions 5]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from malrag import MalRag
+from malrag.base import QueryParam
+from malrag.utils import EmbeddingFunc
+
+
+async def run(args, enable_single_flight: bool) -> dict:
+    counts = {"llm": 0, "embedding": 0}
+
+    async def stub_llm(prompt, system_prompt=None, history_messages=[], **kwargs):
+        counts["llm"] += 1
+        await asyncio.sleep(args.llm_latency)
+        if kwargs.get("keyword_extraction"):
+            return '{"high_level_keywords": ["place"], "low_level_keywords": ["Kochi"]}'
+        return "Kochi is in Kerala."
+
+    async def stub_embedding(texts):
+        counts["embedding"] += 1
+        await asyncio.sleep(args.embedding_latency)
+        return np.ones((len(texts), 8))
+
+    with tempfile.TemporaryDirectory() as working_dir:
+        rag = MalRag(
+            working_dir=working_dir,
+            llm_model_func=stub_llm,
+            embedding_func=EmbeddingFunc(
+                embedding_dim=8, max_token_size=8192, func=stub_embedding
+            ),
+            tokenizer="gemini",
+            enable_llm_cache=False,
+            enable_single_flight=enable_single_flight,
+        )
+        questions = [f"Where is place {i}?" for i in range(args.questions)]
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(
+            *[
+                rag.aquery(questions[i % args.questions], QueryParam(mode="local"))
+                for i in range(args.users)
+            ]
+        )
+        elapsed = loop.time() - start
+        coalesced = rag.scheduler_stats()["single_flight"]
+    return {
+        "secs": elapsed,
+        **counts,
+        "coalesced": coalesced["llm"]["coalesced"]
+        + coalesced["embedding"]["coalesced"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"\n{args.users} concurrent queries over {args.questions} distinct questions")
+    print(
+        f"{'single flight':>14}{'secs':>7}{'llm calls':>11}{'embeddings':>12}{'coalesced':>11}"
+    )
+    for enabled in (False, True):
+        row = asyncio.run(run(args, enabled))
+        print(
+            f"{'on' if enabled else 'off':>14}{row['secs']:>7.2f}{row['llm']:>11}"
+            f"{row['embedding']:>12}{row['coalesced']:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare chunk counts and entity extraction calls per tokenizer on the sample documents.
+
+Usage:
+    python scripts/bench_token_budget.py [--docs frontend/public/documents] [--tokenizers tiktoken,gemini,vyakarth]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.app.services.file_parser import parse_file_content
+from malrag.operate import chunking_by_token_size
+from malrag.tokenizer import get_tokenizer_from_config
+
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf", ".docx")
+
+
+async def load_documents(docs_dir: str) -> dict[str, str]:
+    documents = {}
+    for filename in sorted(os.listdir(docs_dir)):
+        if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            continue
+        try:
+            content = await parse_file_content(
+                os.path.join(docs_dir, filename), filename
+            )
+        except Exception as e:
+            print(f"Skipping {filename}: {e}")
+            continue
+        if content.strip():
+            documents[filename] = content.strip()
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", default="frontend/public/documents")
+    parser.add_argument("--tokenizers", default="tiktoken,gemini,vyakarth")
+    parser.add_argument("--chunk-token-size", type=int, default=1200)
+    parser.add_argument("--chunk-overlap-token-size", type=int, default=100)
+    parser.add_argument("--max-gleaning", type=int, default=1)
+    args = parser.parse_args()
+
+    documents = asyncio.run(load_documents(args.docs))
+    print(f"Loaded {len(documents)} documents from {args.docs}\n")
+
+    # first pass plus one continue call per gleaning round
+    calls_per_chunk = 1 + args.max_gleaning
+    rows = []
+    for kind in args.tokenizers.split(","):
+        tokenizer = get_tokenizer_from_config(
+            {"tokenizer": kind, "tiktoken_model_name": "gpt2"}
+        )
+        start = time.perf_counter()
+        n_tokens = n_chunks = 0
+        for content in documents.values():
+            n_tokens += tokenizer.count(content)
+            n_chunks += len(
+                chunking_by_token_size(
+                    content,
+                    overlap_token_size=args.chunk_overlap_token_size,
+                    max_token_size=args.chunk_token_size,
+                    tokenizer=tokenizer,
+                )
+            )
+        rows.append((tokenizer.name, n_tokens, n_chunks, time.perf_counter() - start))
+
+    baseline_chunks = rows[0][2] or 1
+    print(
+        f"{'tokenizer':<40}{'tokens':>10}{'chunks':>8}{'llm calls':>11}{'vs first':>10}{'secs':>8}"
+    )
+    for name, n_tokens, n_chunks, elapsed in rows:
+        print(
+            f"{name:<40}{n_tokens:>10}{n_chunks:>8}{n_chunks * calls_per_chunk:>11}"
+            f"{n_chunks / baseline_chunks:>10.2f}{elapsed:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
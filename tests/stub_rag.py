@@ -0,0 +1,63 @@
+import asyncio
+import os
+import shutil
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from malrag import MalRag
+from malrag.prompt import PROMPTS
+from malrag.utils import EmbeddingFunc
+
+
+async def stub_llm(prompt, system_prompt=None, history_messages=[], **kwargs):
+    await asyncio.sleep(0.01)
+    if history_messages:
+        return "no"
+    d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+    return (
+        f'("entity"{d}"KOCHI"{d}"location"{d}"A city in Kerala.")'
+        + PROMPTS["DEFAULT_RECORD_DELIMITER"]
+        + f'("entity"{d}"KERALA"{d}"location"{d}"A state in India.")'
+        + PROMPTS["DEFAULT_RECORD_DELIMITER"]
+        + f'("relationship"{d}"KOCHI"{d}"KERALA"{d}"Kochi is in Kerala."{d}"location"{d}2)'
+        + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+    )
+
+
+async def stub_embedding(texts):
+    await asyncio.sleep(0.01)
+    return np.ones((len(texts), 8))
+
+
+class StubRagTestCase(unittest.TestCase):
+    """Tests on a MalRag with the stub LLM and embedding, in a fresh working dir."""
+
+    def setUp(self):
+        self.test_dir = "./test_malrag_data"
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def _stub_rag(self, llm_model_func=stub_llm, **kwargs):
+        kwargs.setdefault("working_dir", self.test_dir)
+        kwargs.setdefault("enable_llm_cache", False)
+        return MalRag(
+            llm_model_func=llm_model_func,
+            embedding_func=EmbeddingFunc(
+                embedding_dim=8, max_token_size=8192, func=stub_embedding
+            ),
+            tokenizer="gemini",
+            chunk_token_size=40,
+            chunk_overlap_token_size=5,
+            embedding_batch_num=4,
+            llm_model_max_async=3,
+            pipeline_queue_size=4,
+            **kwargs,
+        )
@@ -0,0 +1,237 @@
+import asyncio
+import unittest
+
+from stub_rag import StubRagTestCase, stub_llm
+
+from malrag.prompt import PROMPTS
+from malrag.utils import compute_mdhash_id
+
+
+class TestDocuments(StubRagTestCase):
+    def test_delete_by_doc_id(self):
+        print("\n[Test] Deleting a document cleans chunks, vectors and graph...")
+
+        async def mention_llm(prompt, history_messages=[], **kwargs):
+            if history_messages:
+                return "no"
+            text = prompt.split("-Real Data-")[1].split("Text: ", 1)[1]
+            d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+            names = [n for n in ("KOCHI", "MUNNAR", "KERALA") if n.title() in text]
+            records = [
+                f'("entity"{d}"{n}"{d}"location"{d}"{n.title()}, seen in: {text[:30]}")'
+                for n in names
+            ] + [
+                f'("relationship"{d}"{n}"{d}"KERALA"{d}"{n.title()} is in Kerala."{d}"state"{d}1)'
+                for n in names
+                if n != "KERALA"
+            ]
+            return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+
+        rag = self._stub_rag(llm_model_func=mention_llm)
+        doc_a = " ".join(f"Kochi in Kerala, stop {i}." for i in range(40))
+        doc_b = " ".join(f"Munnar in Kerala, estate {i}." for i in range(40))
+        asyncio.run(rag.ainsert([doc_a, doc_b]))
+        doc_a_id = compute_mdhash_id(doc_a, prefix="doc-")
+        a_chunks = set(rag.doc_chunks._data[doc_a_id]["chunk_ids"])
+        graph = rag.chunk_entity_relation_graph._graph
+        self.assertIn('"KOCHI"', graph.nodes)
+
+        self.assertTrue(asyncio.run(rag.adelete_by_doc_id(doc_a_id)))
+        self.assertFalse(asyncio.run(rag.adelete_by_doc_id(doc_a_id)))
+
+        self.assertFalse(a_chunks & set(rag.text_chunks._data))
+        self.assertFalse(
+            a_chunks & {d["__id__"] for d in rag.chunks_vdb.client_storage["data"]}
+        )
+        self.assertNotIn(doc_a_id, rag.full_docs._data)
+        self.assertEqual(set(graph.nodes), {'"KERALA"', '"MUNNAR"'})
+        self.assertEqual(
+            {tuple(sorted(e)) for e in graph.edges}, {('"KERALA"', '"MUNNAR"')}
+        )
+        kerala = graph.nodes['"KERALA"']
+        self.assertFalse(a_chunks & set(kerala["source_id"].split("<SEP>")))
+        self.assertNotIn("Kochi", kerala["description"])
+        self.assertEqual(
+            {d["entity_name"] for d in rag.entities_vdb.client_storage["data"]},
+            {'"KERALA"', '"MUNNAR"'},
+        )
+        self.assertEqual(len(rag.relationships_vdb.client_storage["data"]), 1)
+        print("Success: document removed and graph provenance rebuilt.")
+
+    def test_delete_keeps_chunks_shared_with_other_documents(self):
+        print("\n[Test] Deleting a document keeps the chunks another one shares...")
+        rag = self._stub_rag()
+        preamble = " ".join(
+            f"Standard clause {i} of the Kochi lease." for i in range(30)
+        )
+        doc_a = preamble + " Tenant A pays monthly."
+        doc_b = preamble + " Tenant B pays yearly."
+        report = asyncio.run(rag.aupdate_document("a.txt", doc_a))
+        asyncio.run(rag.ainsert(doc_b))
+        doc_a_id = report["doc_id"]
+        doc_b_id = compute_mdhash_id(doc_b, prefix="doc-")
+        a_chunks = set(rag.doc_chunks._data[doc_a_id]["chunk_ids"])
+        b_chunks = set(rag.doc_chunks._data[doc_b_id]["chunk_ids"])
+        shared = a_chunks & b_chunks
+        self.assertTrue(shared)
+        self.assertTrue(a_chunks - b_chunks)
+
+        self.assertTrue(asyncio.run(rag.adelete_by_doc_id(doc_a_id)))
+        self.assertEqual(set(rag.text_chunks._data), b_chunks)
+        self.assertEqual(
+            {d["__id__"] for d in rag.chunks_vdb.client_storage["data"]}, b_chunks
+        )
+        self.assertEqual(
+            {c["full_doc_id"] for c in rag.text_chunks._data.values()}, {doc_b_id}
+        )
+        sources = rag.chunk_entity_relation_graph._graph.nodes['"KOCHI"']["source_id"]
+        self.assertEqual(set(sources.split("<SEP>")), b_chunks)
+        self.assertEqual(set(rag.chunk_docs._data), b_chunks)
+
+        # the key went with the document
+        self.assertNotIn("a.txt", rag.doc_keys._data)
+        report = asyncio.run(rag.aupdate_document("a.txt", doc_a))
+        self.assertIsNone(report["previous_doc_id"])
+        self.assertEqual(report["chunks_added"], len(a_chunks))
+
+        self.assertTrue(asyncio.run(rag.adelete_by_doc_id(doc_b_id)))
+        self.assertEqual(set(rag.text_chunks._data), a_chunks)
+        self.assertEqual(
+            {c["full_doc_id"] for c in rag.text_chunks._data.values()}, {doc_a_id}
+        )
+        print(f"Success: {len(shared)} shared chunks survived the deletion.")
+
+    def test_failed_delete_can_be_retried(self):
+        print("\n[Test] A backend failing mid-delete leaves the document deletable...")
+        rag = self._stub_rag()
+        doc = " ".join(f"Line {i} about Kochi and Kerala." for i in range(40))
+        asyncio.run(rag.ainsert(doc))
+        doc_id = compute_mdhash_id(doc, prefix="doc-")
+        chunk_ids = set(rag.doc_chunks._data[doc_id]["chunk_ids"])
+
+        vdb_delete = rag.chunks_vdb.delete
+
+        async def failing_delete(ids):
+            raise RuntimeError("vector store down")
+
+        rag.chunks_vdb.delete = failing_delete
+        with self.assertRaises(RuntimeError):
+            asyncio.run(rag.adelete_by_doc_id(doc_id))
+        # the bookkeeping still points at the document
+        self.assertIn(doc_id, rag.doc_chunks._data)
+        self.assertEqual(set(rag.chunk_docs._data), chunk_ids)
+
+        rag.chunks_vdb.delete = vdb_delete
+        self.assertTrue(asyncio.run(rag.adelete_by_doc_id(doc_id)))
+        self.assertEqual(rag.doc_chunks._data, {})
+        self.assertEqual(rag.chunk_docs._data, {})
+        self.assertEqual(rag.chunks_vdb.client_storage["data"], [])
+        self.assertEqual(len(rag.chunk_entity_relation_graph._graph.nodes), 0)
+        print("Success: the second delete finished the job.")
+
+    def test_update_document_reextracts_changed_chunks(self):
+        print("\n[Test] Updating a document only extracts its new chunks...")
+        calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=counting_llm)
+        lines = [f"Clause {i}: Kochi office policy {i}." for i in range(30)]
+        report = asyncio.run(rag.aupdate_document("policy.pdf", "\n".join(lines)))
+        self.assertIsNone(report["previous_doc_id"])
+        first_chunks = set(rag.doc_chunks._data[report["doc_id"]]["chunk_ids"])
+
+        # an in-place edit of one clause
+        lines[3] = "Clause 3: Kochi office policy 9."
+        calls.clear()
+        report = asyncio.run(rag.aupdate_document("policy.pdf", "\n".join(lines)))
+        self.assertEqual(report["chunks_removed"], report["chunks_added"])
+        self.assertGreater(report["chunks_kept"], report["chunks_added"])
+        self.assertEqual(len(calls), 2 * report["chunks_added"])
+
+        new_chunks = set(rag.doc_chunks._data[report["doc_id"]]["chunk_ids"])
+        self.assertEqual(set(rag.text_chunks._data), new_chunks)
+        self.assertEqual(list(rag.full_docs._data), [report["doc_id"]])
+        self.assertEqual(
+            {c["full_doc_id"] for c in rag.text_chunks._data.values()},
+            {report["doc_id"]},
+        )
+        sources = rag.chunk_entity_relation_graph._graph.nodes['"KOCHI"']["source_id"]
+        self.assertEqual(set(sources.split("<SEP>")), new_chunks)
+        self.assertTrue(first_chunks - new_chunks)
+
+        calls.clear()
+        report = asyncio.run(rag.aupdate_document("policy.pdf", "\n".join(lines)))
+        self.assertEqual(report["chunks_added"], 0)
+        self.assertEqual(calls, [])
+        print(f"Success: {report}")
+
+    def test_update_document_to_text_without_entities(self):
+        print("\n[Test] Updating a document to text that extracts nothing...")
+
+        async def kochi_llm(prompt, **kwargs):
+            if "Kochi" not in prompt.split("-Real Data-")[-1]:
+                return ""
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=kochi_llm)
+        prose = "\n".join(f"Clause {i}: Kochi office policy {i}." for i in range(30))
+        first = asyncio.run(rag.aupdate_document("policy.pdf", prose))
+        blank = "\n".join(f"Clause {i}: to be announced {i}." for i in range(30))
+        report = asyncio.run(rag.aupdate_document("policy.pdf", blank))
+        self.assertEqual(report["previous_doc_id"], first["doc_id"])
+        self.assertGreater(report["chunks_added"], 0)
+
+        chunk_ids = set(rag.doc_chunks._data[report["doc_id"]]["chunk_ids"])
+        self.assertEqual(set(rag.text_chunks._data), chunk_ids)
+        self.assertEqual(
+            {d["__id__"] for d in rag.chunks_vdb.client_storage["data"]}, chunk_ids
+        )
+        self.assertEqual(list(rag.full_docs._data), [report["doc_id"]])
+        self.assertEqual(len(rag.chunk_entity_relation_graph._graph.nodes), 0)
+
+        # and the new version can itself be replaced
+        report = asyncio.run(rag.aupdate_document("policy.pdf", prose))
+        self.assertEqual(report["chunks_removed"], len(chunk_ids))
+        self.assertEqual(
+            {d["__id__"] for d in rag.chunks_vdb.client_storage["data"]},
+            set(rag.doc_chunks._data[report["doc_id"]]["chunk_ids"]),
+        )
+        print(f"Success: {len(chunk_ids)} chunks indexed without graph records.")
+
+    def test_backfill_document_index(self):
+        print("\n[Test] Documents indexed before doc_chunks existed get backfilled...")
+        rag = self._stub_rag()
+        old = " ".join(f"Line {i} about Kochi and Kerala." for i in range(40))
+        other = " ".join(f"Row {i} about Kochi." for i in range(40))
+        asyncio.run(rag.ainsert([old, other]))
+        old_id = compute_mdhash_id(old, prefix="doc-")
+        expected = dict(rag.doc_chunks._data)
+        # an index written before this bookkeeping existed
+        for storage in (rag.doc_chunks, rag.chunk_docs, rag.doc_keys):
+            storage._data.clear()
+
+        report = asyncio.run(rag.abackfill_document_index({"old.txt": old_id}))
+        self.assertEqual(report["documents"], 2)
+        self.assertEqual(report["doc_keys"], 1)
+        self.assertEqual(rag.doc_chunks._data[old_id]["doc_keys"], ["old.txt"])
+        self.assertEqual(
+            {d: e["chunk_ids"] for d, e in rag.doc_chunks._data.items()},
+            {d: e["chunk_ids"] for d, e in expected.items()},
+        )
+        self.assertEqual(set(rag.chunk_docs._data), set(rag.text_chunks._data))
+        # nothing left to do the second time
+        report = asyncio.run(rag.abackfill_document_index({"old.txt": old_id}))
+        self.assertEqual(report, {"documents": 0, "chunks": 0, "doc_keys": 0})
+
+        # the edited file now replaces the old version
+        report = asyncio.run(rag.aupdate_document("old.txt", old + " Also Munnar."))
+        self.assertEqual(report["previous_doc_id"], old_id)
+        self.assertNotIn(old_id, rag.full_docs._data)
+        print(f"Success: {report}")
+
+
+if __name__ == "__main__":
+    unittest.main()
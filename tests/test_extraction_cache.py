@@ -0,0 +1,69 @@
+import asyncio
+import os
+import shutil
+import unittest
+
+from stub_rag import StubRagTestCase, stub_llm
+
+
+class TestExtractionCache(StubRagTestCase):
+    def test_extraction_cache_carries_over_to_new_working_dir(self):
+        print("\n[Test] Re-indexing from an imported extraction cache...")
+        calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        docs = [" ".join(f"Line {i} about Kochi and Kerala." for i in range(80))]
+        rag = self._stub_rag(llm_model_func=counting_llm)
+        asyncio.run(rag.ainsert(docs))
+        first_calls = len(calls)
+        export_file = os.path.join(self.test_dir, "extraction_cache.json")
+        n_entries = rag.export_extraction_cache(export_file)
+        self.assertEqual(n_entries, len(rag.text_chunks._data))
+
+        new_dir = self.test_dir + "_reindex"
+        shutil.rmtree(new_dir, ignore_errors=True)
+        try:
+            calls.clear()
+            rag = self._stub_rag(llm_model_func=counting_llm, working_dir=new_dir)
+            self.assertEqual(rag.import_extraction_cache(export_file), n_entries)
+            stage_stats = {}
+
+            async def progress_callback(step, stats=None):
+                if stats is not None:
+                    stage_stats[step] = stats
+
+            asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+            self.assertEqual(calls, [])
+            self.assertEqual(
+                stage_stats["extracting_entities"]["cache_hits"], n_entries
+            )
+            self.assertEqual(rag.extraction_cache_stats()["hits"], n_entries)
+            self.assertEqual(
+                len(
+                    rag.chunk_entity_relation_graph._graph.nodes['"KOCHI"'][
+                        "source_id"
+                    ].split("<SEP>")
+                ),
+                n_entries,
+            )
+
+            # other entity types are a different extraction
+            shutil.rmtree(new_dir)
+            rag = self._stub_rag(
+                llm_model_func=counting_llm,
+                working_dir=new_dir,
+                addon_params={"entity_types": ["location"]},
+            )
+            rag.import_extraction_cache(export_file)
+            asyncio.run(rag.ainsert(docs))
+            self.assertEqual(len(calls), first_calls)
+        finally:
+            shutil.rmtree(new_dir, ignore_errors=True)
+        print(f"Success: {n_entries} chunks re-indexed without the LLM.")
+
+
+if __name__ == "__main__":
+    unittest.main()
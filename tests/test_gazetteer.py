@@ -0,0 +1,141 @@
+import asyncio
+import unittest
+
+from stub_rag import StubRagTestCase
+
+from malrag.gazetteer import AhoCorasick, LocalEntityTagger
+from malrag.prompt import PROMPTS
+from malrag.utils import compute_mdhash_id
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_matches_whole_words_only(self):
+        matcher = AhoCorasick()
+        for name in ("kochi", "kochi metro", "കൊച്ചി"):
+            matcher.add(name)
+        self.assertEqual(len(matcher), 3)
+        self.assertEqual(
+            [
+                name
+                for _, _, name in matcher.iter_matches(
+                    "Kochi Metro, Kochin, കൊച്ചി മെട്രോ"
+                )
+            ],
+            ["kochi", "kochi metro", "കൊച്ചി"],
+        )
+        # a vowel sign continues the word
+        self.assertEqual(list(matcher.iter_matches("കൊച്ചിയിൽ")), [])
+
+    def test_offsets_and_overlapping_names(self):
+        matcher = AhoCorasick()
+        for name in ("he", "she", "his", "hers"):
+            matcher.add(name)
+        text = "She said hers, not his."
+        matches = list(matcher.iter_matches(text))
+        self.assertEqual([name for _, _, name in matches], ["she", "hers", "his"])
+        for start, end, name in matches:
+            self.assertEqual(text[start:end].lower(), name)
+
+    def test_names_added_after_a_search(self):
+        matcher = AhoCorasick()
+        matcher.add("kochi")
+        self.assertEqual(list(matcher.iter_matches("Munnar")), [])
+        matcher.add("munnar")
+        self.assertEqual(
+            [m[2] for m in matcher.iter_matches("Munnar, Kochi")], ["munnar", "kochi"]
+        )
+
+
+class TestLocalEntityTagger(unittest.TestCase):
+    def setUp(self):
+        self.tagger = LocalEntityTagger(None)
+        self.tagger.add(['"KOCHI METRO RAIL"', '"KERALA"'])
+        self.known = ['"KOCHI METRO RAIL"']
+
+    def test_known_names_and_their_parts(self):
+        self.assertTrue(self.tagger._is_known("Kerala", self.known))
+        self.assertTrue(self.tagger._is_known("Kochi Metro", self.known))
+        self.assertTrue(self.tagger._is_known("Metro Rail", self.known))
+        # parts of words, or words out of order, are something new
+        self.assertFalse(self.tagger._is_known("Och", self.known))
+        self.assertFalse(self.tagger._is_known("Metro Kochi", self.known))
+        self.assertFalse(self.tagger._is_known("Kochi Metropolitan", self.known))
+
+    def test_names_cut_at_the_edges_of_a_chunk(self):
+        self.assertTrue(
+            self.tagger._is_known("Kochi Met", self.known, "Rail to Kochi Met")
+        )
+        self.assertTrue(self.tagger._is_known("Ail", self.known, "Ail to Kochi Met"))
+        self.assertTrue(
+            self.tagger._is_known("Tro Rail", self.known, "Tro Rail to Kochi")
+        )
+        self.assertFalse(
+            self.tagger._is_known("Kochi Met", self.known, "Kochi Met rides")
+        )
+
+
+class TestLocalEntityTagging(StubRagTestCase):
+    def test_local_ner_skips_chunks_with_known_entities(self):
+        print("\n[Test] Local tagging of chunks that only mention known entities...")
+        calls = []
+
+        async def mention_llm(prompt, history_messages=[], **kwargs):
+            if history_messages:
+                return "no"
+            calls.append(prompt)
+            text = prompt.split("-Real Data-")[1].split("Text: ", 1)[1]
+            d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+            names = [n for n in ("KOCHI", "MUNNAR", "KERALA") if n.title() in text]
+            records = [
+                f'("entity"{d}"{n}"{d}"location"{d}"{n.title()} is a place.")'
+                for n in names
+            ] + [
+                f'("relationship"{d}"{n}"{d}"KERALA"{d}"{n.title()} is in Kerala."{d}"state"{d}2)'
+                for n in names
+                if n != "KERALA"
+            ]
+            return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+
+        rag = self._stub_rag(llm_model_func=mention_llm, enable_local_ner=True)
+        stage_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if stats is not None:
+                stage_stats[step] = stats
+
+        # an empty graph knows nothing, every chunk goes to the LLM
+        asyncio.run(
+            rag.ainsert([" ".join(f"Kochi in Kerala, stop {i}." for i in range(40))])
+        )
+        self.assertTrue(calls)
+        graph = rag.chunk_entity_relation_graph._graph
+        kochi_description = graph.nodes['"KOCHI"']["description"]
+
+        calls.clear()
+        doc = " ".join(f"Kochi and Kerala, day {i}." for i in range(40))
+        asyncio.run(rag.ainsert([doc], progress_callback=progress_callback))
+        self.assertEqual(calls, [])
+        doc_chunks = rag.doc_chunks._data[compute_mdhash_id(doc, prefix="doc-")][
+            "chunk_ids"
+        ]
+        self.assertEqual(
+            stage_stats["extracting_entities"]["local_tagged"], len(doc_chunks)
+        )
+        for chunk_id in doc_chunks:
+            self.assertIn(chunk_id, graph.nodes['"KOCHI"']["source_id"])
+            self.assertIn(chunk_id, graph.edges['"KOCHI"', '"KERALA"']["source_id"])
+        self.assertEqual(graph.nodes['"KOCHI"']["description"], kochi_description)
+
+        # a new entity needs the LLM
+        asyncio.run(
+            rag.ainsert(
+                [" ".join(f"Trips from Munnar to Kerala, day {i}." for i in range(40))]
+            )
+        )
+        self.assertTrue(calls)
+        self.assertIn('"MUNNAR"', graph.nodes)
+        print(f"Success: {len(doc_chunks)} chunks tagged without the LLM.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,371 @@
+import asyncio
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+from malrag.llm import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve_lines_callers_up(self):
+        bucket = TokenBucket(capacity=2, rate=10)
+        self.assertEqual(bucket.reserve(1), 0)
+        self.assertEqual(bucket.reserve(1), 0)
+        # the level goes negative, so each next caller waits a bit longer
+        self.assertAlmostEqual(bucket.reserve(1), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.reserve(1), 0.2, delta=0.01)
+        self.assertLess(bucket.level, 0)
+
+    def test_refills_up_to_capacity(self):
+        bucket = TokenBucket(capacity=2, rate=100)
+        bucket.reserve(2)
+        time.sleep(0.05)
+        self.assertEqual(bucket.wait_time(2), 0)
+        self.assertEqual(bucket.level, 2)
+
+    def test_call_bigger_than_the_bucket_waits_for_a_full_one(self):
+        bucket = TokenBucket(capacity=10, rate=10)
+        self.assertEqual(bucket.wait_time(50), 0)
+        bucket.reserve(5)
+        self.assertAlmostEqual(bucket.wait_time(50), 0.5, delta=0.01)
+
+    def test_charge_corrects_the_estimate(self):
+        bucket = TokenBucket(capacity=10, rate=1)
+        bucket.reserve(8)
+        bucket.charge(-6)
+        self.assertAlmostEqual(bucket.level, 8, delta=0.01)
+        bucket.charge(-100)
+        self.assertEqual(bucket.level, 10)
+
+    def test_for_quota_never_exceeds_the_limit(self):
+        bucket = TokenBucket.for_quota(limit=60, period=60, burst=0.25)
+        self.assertEqual(bucket.capacity, 15)
+        # the burst plus what refills over the window is the whole quota
+        self.assertAlmostEqual(bucket.capacity + bucket.rate * 60, 60)
+        self.assertEqual(
+            TokenBucket.for_quota(limit=2, period=60, burst=0.1).capacity, 1
+        )
+
+
+class TestProviders(unittest.TestCase):
+    def test_provider_clients_are_pooled(self):
+        print("\n[Test] Provider clients are reused per key and loop...")
+        from malrag.llm import ProviderClientRegistry
+
+        registry = ProviderClientRegistry(max_connections=4)
+
+        async def clients():
+            first = registry.openai("http://127.0.0.1:9/v1", "key-a")
+            again = registry.openai("http://127.0.0.1:9/v1", "key-a")
+            other_key = registry.openai("http://127.0.0.1:9/v1", "key-b")
+            self.assertIs(first, again)
+            self.assertIsNot(first, other_key)
+            self.assertEqual(registry.stats()["open"], {"openai": 2})
+            return first
+
+        first = asyncio.run(clients())
+        # a new loop can't use the old one's connections
+        second = asyncio.run(clients())
+        self.assertIsNot(first, second)
+        self.assertEqual(registry.stats()["created"], {"openai": 4})
+        self.assertEqual(registry.stats()["reused"], {"openai": 2})
+
+        async def close():
+            client = registry.openai(None, "key-a")
+            await registry.aclose()
+            return client
+
+        self.assertTrue(asyncio.run(close()).is_closed())
+        self.assertEqual(registry.stats()["open"], {})
+        with self.assertRaises(ValueError):
+            registry.configure(max_conections=8)
+
+        async def gemini():
+            self.assertIs(registry.gemini("key-a"), registry.gemini("key-a"))
+            self.assertIsNot(registry.gemini("key-a"), registry.gemini("key-b"))
+            await registry.aclose()
+
+        asyncio.run(gemini())
+        print(f"Success: {registry.stats()}")
+
+    def test_gemini_keys_are_dispatched_in_parallel(self):
+        print("\n[Test] Gemini calls spread over keys, 429s cool a key down...")
+        from google.api_core.exceptions import ResourceExhausted
+        from malrag.llm import GeminiKeyManager
+
+        # 2 requests per key per 0.2s window, both at once if need be
+        manager = GeminiKeyManager(
+            ["key-a", "key-b", "key-c"],
+            rpm=2,
+            tpm=1000,
+            cooldown=5,
+            period=0.2,
+            burst=1.0,
+        )
+
+        async def call(key_log):
+            async with manager.lease(10) as key:
+                key_log.append(key)
+                await asyncio.sleep(0.01)
+
+        async def burst(n):
+            key_log = []
+            start = asyncio.get_running_loop().time()
+            await asyncio.gather(*[call(key_log) for _ in range(n)])
+            return key_log, asyncio.get_running_loop().time() - start
+
+        # one request per key at once, the next ones right behind on all keys
+        key_log, elapsed = asyncio.run(burst(6))
+        self.assertEqual(sorted(key_log), ["key-a"] * 2 + ["key-b"] * 2 + ["key-c"] * 2)
+        self.assertLess(elapsed, 0.08)
+        # the buckets are spent, so the next three wait for a refill
+        key_log, elapsed = asyncio.run(burst(3))
+        self.assertEqual(sorted(key_log), ["key-a", "key-b", "key-c"])
+        self.assertGreater(elapsed, 0.05)
+
+        async def rate_limited():
+            with self.assertRaises(ResourceExhausted):
+                async with manager.lease() as key:
+                    raise ResourceExhausted("429 quota")
+            await asyncio.sleep(0.2)
+            used = [await manager.acquire() for _ in range(4)]
+            for k in used:
+                manager.release(k)
+            return key, used
+
+        cooled, used = asyncio.run(rate_limited())
+        self.assertNotIn(cooled, used)
+        stats = manager.stats()
+        self.assertEqual(stats["..." + cooled[-4:]]["rate_limited"], 1)
+        self.assertGreater(stats["..." + cooled[-4:]]["cooldown_seconds"], 4)
+        self.assertEqual(sum(s["in_flight"] for s in stats.values()), 0)
+        with self.assertRaises(ValueError):
+            asyncio.run(GeminiKeyManager([]).acquire())
+        print(f"Success: {stats}")
+
+    def test_gemini_stream_holds_key_lease(self):
+        print("\n[Test] Streamed Gemini calls hold their key until the stream ends...")
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        import google.ai.generativelanguage as glm
+        from google.api_core.exceptions import ResourceExhausted
+        from malrag.llm import GeminiKeyManager, gemini_complete
+
+        class FakeStream:
+            def __init__(self, parts, error=None):
+                self.parts = parts
+                self.error = error
+
+            async def __aiter__(self):
+                for i, part in enumerate(self.parts):
+                    await asyncio.sleep(0)
+                    chunk = glm.GenerateContentResponse(
+                        candidates=[
+                            glm.Candidate(
+                                content=glm.Content(parts=[glm.Part(text=part)])
+                            )
+                        ]
+                    )
+                    if i == len(self.parts) - 1:
+                        # the usage comes with the last chunk
+                        chunk.usage_metadata.total_token_count = 500
+                    yield chunk
+                if self.error is not None:
+                    raise self.error
+
+        used_keys = []
+        streams = []
+
+        class FakeClient:
+            def __init__(self, api_key):
+                self.api_key = api_key
+
+            async def stream_generate_content(self, request):
+                used_keys.append(self.api_key)
+                return streams.pop(0)
+
+            async def generate_content(self, request):
+                used_keys.append(self.api_key)
+                requests.append(request)
+                return glm.GenerateContentResponse(
+                    candidates=[
+                        glm.Candidate(
+                            content=glm.Content(parts=[glm.Part(text="plain")])
+                        )
+                    ]
+                )
+
+        requests = []
+
+        manager = GeminiKeyManager(
+            ["key-a", "key-b", "key-c"], rpm=100, tpm=10_000, cooldown=5, burst=1.0
+        )
+
+        def in_flight():
+            return sum(s["in_flight"] for s in manager.stats().values())
+
+        async def consume(stream):
+            return "".join([part async for part in stream])
+
+        async def scenario():
+            # a plain call, the history goes into the request
+            history = [
+                {"role": "user", "content": "before"},
+                {"role": "assistant", "content": "reply"},
+            ]
+            self.assertEqual(
+                await gemini_complete("hi", history_messages=history, model="gemini-x"),
+                "plain",
+            )
+            self.assertEqual(requests[0].model, "models/gemini-x")
+            self.assertEqual(
+                [(c.role, c.parts[0].text) for c in requests[0].contents],
+                [("user", "before"), ("model", "reply"), ("user", "hi")],
+            )
+
+            # held while the stream is read, then charged with the real usage
+            streams.append(FakeStream(["Hel", "lo"]))
+            stream = await gemini_complete("hi", stream=True)
+            self.assertEqual(in_flight(), 1)
+            self.assertEqual(await consume(stream), "Hello")
+            self.assertEqual(in_flight(), 0)
+            self.assertLess(manager._state[used_keys[-1]].tokens.level, 9600)
+
+            # and released when closed before being read
+            streams.append(FakeStream(["unread"]))
+            await (await gemini_complete("hi", stream=True)).aclose()
+            self.assertEqual(in_flight(), 0)
+
+            # a 429 in the middle of the stream cools the key down
+            streams.append(FakeStream(["partial"], ResourceExhausted("429 quota")))
+            stream = await gemini_complete("hi", stream=True)
+            with self.assertRaises(ResourceExhausted):
+                await consume(stream)
+            cooled = used_keys[-1]
+
+            # a 429 before any output is retried on a key that isn't cooling down
+            streams.append(FakeStream([], ResourceExhausted("429 quota")))
+            streams.append(FakeStream(["ok"]))
+            self.assertEqual(
+                await consume(await gemini_complete("hi", stream=True)), "ok"
+            )
+            return cooled
+
+        with patch("malrag.llm.gemini_key_manager", manager), patch(
+            "malrag.llm.provider_clients", SimpleNamespace(gemini=FakeClient)
+        ):
+            start = time.monotonic()
+            cooled = asyncio.run(scenario())
+            self.assertLess(time.monotonic() - start, 2)
+
+        stats = manager.stats()
+        self.assertEqual(in_flight(), 0)
+        self.assertEqual(sum(s["rate_limited"] for s in stats.values()), 2)
+        self.assertGreater(stats["..." + cooled[-4:]]["cooldown_seconds"], 4)
+        self.assertEqual(len(set(used_keys[-3:])), 3)
+        self.assertEqual(sum(s["completed"] for s in stats.values()), 4)
+        print(f"Success: {stats}")
+
+    def test_multi_model_routing(self):
+        print(
+            "\n[Test] MultiModel routes by load and latency, ejects failing models..."
+        )
+        from malrag.llm import Model, MultiModel
+
+        def stub_model(name, latency, running, broken=None, **kwargs):
+            async def gen_func(prompt, system_prompt=None, history_messages=[], **kw):
+                running[name] = running.get(name, 0) + 1
+                running[f"max_{name}"] = max(
+                    running.get(f"max_{name}", 0), running[name]
+                )
+                try:
+                    await asyncio.sleep(latency)
+                    if broken and broken[0]:
+                        raise RuntimeError(f"{name} down")
+                    return name
+                finally:
+                    running[name] -= 1
+
+            return Model(gen_func=gen_func, kwargs={"model": name}, name=name, **kwargs)
+
+        async def burst(multi, n):
+            return await asyncio.gather(
+                *[multi.llm_model_func(f"q{i}") for i in range(n)],
+                return_exceptions=True,
+            )
+
+        # the fast model is capped, the overflow goes to the slow one
+        running = {}
+        multi = MultiModel(
+            [
+                stub_model("slow", 0.05, running),
+                stub_model("fast", 0.005, running, max_concurrency=2),
+            ],
+            policy="least_in_flight",
+        )
+        results = asyncio.run(burst(multi, 20))
+        self.assertEqual(running["max_fast"], 2)
+        self.assertEqual(len(results), 20)
+        stats = multi.stats()
+        self.assertEqual(stats["slow"]["completed"] + stats["fast"]["completed"], 20)
+        self.assertEqual(stats["fast"]["max_concurrency"], 2)
+
+        # once the latencies are known, the fast model takes most of the calls
+        running = {}
+        multi = MultiModel(
+            [stub_model("slow", 0.04, running), stub_model("fast", 0.004, running)],
+            policy="ewma_latency",
+        )
+
+        async def sequential(n):
+            return [await multi.llm_model_func(f"q{i}") for i in range(n)]
+
+        answered = asyncio.run(sequential(60))
+        self.assertGreater(answered[10:].count("fast"), 40)
+        self.assertLess(
+            multi.stats()["fast"]["ewma_latency_ms"],
+            multi.stats()["slow"]["ewma_latency_ms"],
+        )
+
+        # a failing model is ejected after 2 failures, then readmitted gradually
+        running, broken = {}, [True]
+        multi = MultiModel(
+            [
+                stub_model("good", 0.001, running),
+                stub_model("bad", 0.001, running, broken),
+            ],
+            max_failures=2,
+            ejection_seconds=0.1,
+            readmission_seconds=0.1,
+        )
+
+        async def health():
+            before = []
+            for i in range(20):
+                try:
+                    before.append(await multi.llm_model_func(f"q{i}"))
+                except RuntimeError as e:
+                    before.append(e)
+            self.assertTrue(multi.stats()["bad"]["ejected"])
+            broken[0] = False
+            await asyncio.sleep(0.12)
+            during = await sequential(20)
+            self.assertTrue(multi.stats()["bad"]["readmitting"])
+            await asyncio.sleep(0.12)
+            after = await sequential(20)
+            return before, during, after
+
+        before, during, after = asyncio.run(health())
+        self.assertEqual(sum(isinstance(r, RuntimeError) for r in before), 2)
+        self.assertLess(during.count("bad"), 10)
+        self.assertEqual(after.count("bad"), 10)
+        stats = multi.stats()
+        self.assertEqual((stats["bad"]["ejections"], stats["bad"]["failed"]), (1, 2))
+        with self.assertRaises(ValueError):
+            MultiModel([], policy="fastest")
+        print(f"Success: {stats}")
+
+
+if __name__ == "__main__":
+    unittest.main()
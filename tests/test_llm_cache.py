@@ -0,0 +1,166 @@
+import asyncio
+import os
+import shutil
+import time
+import unittest
+
+from stub_rag import StubRagTestCase
+
+from malrag.llm_cache import LLMResponseCache
+from malrag.storage import JsonKVStorage
+
+
+class TestLLMResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = "./test_llm_cache_data"
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def _kv(self):
+        return JsonKVStorage(
+            namespace="llm_response_cache",
+            global_config={"working_dir": self.test_dir},
+            embedding_func=None,
+        )
+
+    def test_key_covers_the_call_but_not_delivery(self):
+        cache = LLMResponseCache(None, model=("gemini",))
+        key = cache.key("a", None, [], {"max_tokens": 5})
+        self.assertEqual(
+            key, cache.key("a", None, [], {"max_tokens": 5, "stream": False})
+        )
+        self.assertEqual(
+            key, cache.key("a", None, [], {"max_tokens": 5, "hashing_kv": object()})
+        )
+        self.assertNotEqual(key, cache.key("a", "be brief", [], {"max_tokens": 5}))
+        self.assertNotEqual(
+            key, cache.key("a", None, [{"role": "user"}], {"max_tokens": 5})
+        )
+        self.assertNotEqual(key, cache.key("a", None, [], {"max_tokens": 6}))
+        self.assertNotEqual(
+            key,
+            LLMResponseCache(None, model=("openai",)).key(
+                "a", None, [], {"max_tokens": 5}
+            ),
+        )
+
+    def test_evicts_least_recently_used_by_entries_and_bytes(self):
+        async def flow():
+            cache = LLMResponseCache(self._kv(), max_entries=3, max_bytes=10)
+            await cache.put("a", "1234")
+            await cache.put("b", "1234")
+            self.assertEqual(await cache.get("a"), "1234")
+            # over max_bytes, "b" is now the least recently used
+            await cache.put("c", "1234")
+            self.assertIsNone(await cache.get("b"))
+            # bigger than the whole cache, never stored
+            await cache.put("d", "x" * 11)
+            self.assertIsNone(await cache.get("d"))
+            return await cache.stats()
+
+        stats = asyncio.run(flow())
+        self.assertEqual((stats["entries"], stats["bytes"]), (2, 8))
+        self.assertEqual(
+            (stats["hits"], stats["misses"], stats["evictions"]), (1, 2, 1)
+        )
+        self.assertEqual(stats["writes"], 3)
+
+    def test_expired_entries_miss_and_index_survives_restart(self):
+        kv = self._kv()
+
+        async def fill():
+            cache = LLMResponseCache(kv, ttl_seconds=0.1)
+            await cache.put("old", "answer")
+            await kv.index_done_callback()
+
+        asyncio.run(fill())
+        restarted = LLMResponseCache(self._kv(), ttl_seconds=0.1)
+        self.assertEqual(asyncio.run(restarted.get("old")), "answer")
+        self.assertEqual(asyncio.run(restarted.stats())["bytes"], len("answer"))
+        time.sleep(0.15)
+        self.assertIsNone(asyncio.run(restarted.get("old")))
+        self.assertEqual(asyncio.run(restarted.stats())["entries"], 0)
+
+    def test_wrap_without_storage_only_strips_the_site(self):
+        seen = []
+
+        async def func(prompt, **kwargs):
+            seen.append(kwargs)
+            return prompt
+
+        wrapped = LLMResponseCache(None).wrap(func)
+        self.assertEqual(asyncio.run(wrapped("a", cache_site="extraction")), "a")
+        self.assertEqual(seen, [{"system_prompt": None, "history_messages": []}])
+        self.assertEqual(asyncio.run(LLMResponseCache(None).stats()), {})
+
+
+class TestLLMCallCache(StubRagTestCase):
+    def test_llm_call_cache(self):
+        print("\n[Test] Exact-match LLM response cache...")
+        calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            self.assertNotIn("cache_site", kwargs)
+            calls.append(prompt)
+            return f"answer to {prompt}"
+
+        rag = self._stub_rag(
+            llm_model_func=counting_llm, enable_llm_cache=True, llm_cache_max_entries=2
+        )
+
+        async def ask(prompt, **kwargs):
+            return await rag.llm_model_func(prompt, **kwargs)
+
+        async def flow():
+            self.assertEqual(await ask("a", cache_site="extraction"), "answer to a")
+            self.assertEqual(await ask("a", cache_site="keywords"), "answer to a")
+            # other kwargs or a system prompt are another call
+            await ask("a", max_tokens=5)
+            await ask("a", system_prompt="be brief")
+            # query answers are skipped, and so are streams
+            await ask("q", cache_site="query_answer")
+            await ask("q", cache_site="query_answer")
+            await ask("a", stream=True)
+
+        asyncio.run(flow())
+        self.assertEqual(calls, ["a", "a", "a", "q", "q", "a"])
+        stats = rag.llm_cache_stats()
+        # three entries written, the least recently used one evicted
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(
+            (stats["hits"], stats["misses"], stats["evictions"]), (1, 3, 1)
+        )
+        self.assertEqual(stats["skipped"], 2)
+
+        async def lru():
+            await ask("a", system_prompt="be brief")  # hit, now most recent
+            await ask("b")  # evicts the max_tokens entry, not this one
+            await ask("a", system_prompt="be brief")
+            await rag._insert_done()
+
+        calls.clear()
+        asyncio.run(lru())
+        self.assertEqual(calls, ["b"])
+
+        # kept on disk, and past the TTL an entry misses
+        calls.clear()
+        rag = self._stub_rag(
+            llm_model_func=counting_llm,
+            enable_llm_cache=True,
+            llm_cache_ttl_seconds=0.2,
+        )
+        asyncio.run(ask("b"))
+        self.assertEqual(calls, [])
+        time.sleep(0.25)
+        asyncio.run(ask("b"))
+        self.assertEqual(calls, ["b"])
+        print(f"Success: {stats}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+from stub_rag import StubRagTestCase, stub_llm
+
+from malrag.minhash import MinHashLSH, _lsh_bands
+from malrag.utils import compute_mdhash_id
+
+
+class TestMinHashLSH(unittest.TestCase):
+    def setUp(self):
+        self.lsh = MinHashLSH(threshold=0.8, num_perm=128)
+        self.text = " ".join(f"Kochi metro stop {i} opens at six." for i in range(30))
+
+    def test_bands_turn_near_the_threshold(self):
+        for threshold in (0.5, 0.8, 0.95):
+            bands, rows = _lsh_bands(threshold, 128)
+            self.assertLessEqual(bands * rows, 128)
+            self.assertAlmostEqual((1 / bands) ** (1 / rows), threshold, delta=0.05)
+
+    def test_signature_ignores_case_and_spacing(self):
+        signature = self.lsh.signature(self.text)
+        self.assertEqual(signature.shape, (128,))
+        self.assertTrue(
+            (
+                signature
+                == self.lsh.signature("  " + self.text.upper().replace(" ", "\n"))
+            ).all()
+        )
+
+    def test_query_finds_near_duplicates_only(self):
+        self.lsh.insert("a", self.lsh.signature(self.text))
+        self.lsh.insert("b", self.lsh.signature("കൊച്ചി മെട്രോ " * 20))
+        self.assertEqual((len(self.lsh), "a" in self.lsh), (2, True))
+
+        key, similarity = self.lsh.query(self.lsh.signature(self.text + " Updated."))
+        self.assertEqual(key, "a")
+        self.assertGreaterEqual(similarity, 0.8)
+        self.assertIsNone(
+            self.lsh.query(self.lsh.signature("Munnar tea estates. " * 20))
+        )
+        self.assertIsNone(self.lsh.query(self.lsh.signature(self.text), exclude="a"))
+
+    def test_remove(self):
+        signature = self.lsh.signature(self.text)
+        self.lsh.insert("a", signature)
+        self.lsh.remove("a")
+        self.lsh.remove("missing")
+        self.assertEqual(len(self.lsh), 0)
+        self.assertIsNone(self.lsh.query(signature))
+        self.assertFalse(any(self.lsh._buckets))
+
+
+class TestNearDuplicateChunks(StubRagTestCase):
+    def test_near_duplicate_chunks_reuse_extraction(self):
+        print("\n[Test] Near-duplicate chunks skip the LLM...")
+        calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=counting_llm, near_duplicate_threshold=0.95)
+        stage_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if stats is not None:
+                stage_stats[step] = stats
+
+        boilerplate = " ".join(
+            f"Passengers must carry a valid Kochi metro ticket at all stations, rule {i}."
+            for i in range(20)
+        )
+        # the shifted header moves every chunk boundary by a character, so the
+        # second circular's chunks are near-duplicates rather than exact ones
+        docs = [f"Circular 1. {boilerplate}", f"Circular 2B. {boilerplate}"]
+        asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+
+        n_chunks = len(rag.text_chunks._data)
+        extract_stats = stage_stats["extracting_entities"]
+        self.assertGreater(extract_stats["reused"], 0)
+        self.assertEqual(extract_stats["llm_calls_saved"], 2 * extract_stats["reused"])
+        self.assertEqual(len(calls), 2 * (n_chunks - extract_stats["reused"]))
+        sources = rag.chunk_entity_relation_graph._graph.nodes['"KOCHI"']["source_id"]
+        self.assertEqual(set(sources.split("<SEP>")), set(rag.text_chunks._data))
+        self.assertEqual(set(rag.chunk_minhashes._data), set(rag.text_chunks._data))
+
+        asyncio.run(rag.adelete_by_doc_id(compute_mdhash_id(docs[1], prefix="doc-")))
+        self.assertEqual(set(rag.chunk_minhashes._data), set(rag.text_chunks._data))
+        print(
+            f"Success: {extract_stats['reused']}/{n_chunks} chunks reused an extraction."
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
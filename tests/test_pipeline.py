@@ -0,0 +1,476 @@
+import asyncio
+import shutil
+import unittest
+
+from stub_rag import StubRagTestCase, stub_llm
+
+from malrag.prompt import PROMPTS
+from malrag.utils import compute_mdhash_id
+
+
+class TestPipeline(StubRagTestCase):
+    def test_pipelined_insert(self):
+        print("\n[Test] Pipelined insert with a stub LLM...")
+        rag = self._stub_rag()
+        steps = []
+        stage_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if stats is None:
+                steps.append(step)
+            else:
+                stage_stats[step] = stats
+
+        docs = [
+            " ".join(f"Doc {d} line {i}: Kochi metro stop {i}." for i in range(60))
+            for d in range(3)
+        ]
+        asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+
+        n_chunks = len(rag.text_chunks._data)
+        self.assertGreater(n_chunks, 10)
+        self.assertEqual(len(rag.full_docs._data), 3)
+        self.assertEqual(len(rag.chunks_vdb._client), n_chunks)
+        graph = rag.chunk_entity_relation_graph._graph
+        self.assertEqual(set(graph.nodes), {'"KOCHI"', '"KERALA"'})
+        self.assertEqual(
+            len(graph.nodes['"KOCHI"']["source_id"].split("<SEP>")), n_chunks
+        )
+        self.assertEqual(steps[0], "chunking")
+        self.assertEqual(steps[-1], "indexing")
+        for stage in ("chunking", "embedding", "extracting_entities", "merging"):
+            self.assertEqual(stage_stats[stage]["items"], n_chunks)
+        print(f"Success: {n_chunks} chunks, stage stats {stage_stats}")
+
+    def test_pipelined_insert_failure_stops_all_stages(self):
+        print("\n[Test] Pipelined insert surfaces stage errors...")
+
+        async def failing_llm(prompt, **kwargs):
+            raise RuntimeError("llm down")
+
+        rag = self._stub_rag(llm_model_func=failing_llm)
+        docs = [" ".join(f"Line {i} about Kochi." for i in range(200))]
+        with self.assertRaises(RuntimeError):
+            asyncio.run(asyncio.wait_for(rag.ainsert(docs), timeout=30))
+        self.assertEqual(len(rag.text_chunks._data), 0)
+        print("Success: error raised without hanging.")
+
+    def test_merge_failure_stops_pipeline_without_waiting(self):
+        print("\n[Test] A failed background merge stops the pipeline...")
+        extractions = 0
+
+        async def stalling_llm(prompt, **kwargs):
+            nonlocal extractions
+            if "-Real Data-" in prompt:
+                extractions += 1
+                if extractions > 4:
+                    # no more results reach the merger after the first batch
+                    await asyncio.Event().wait()
+            return await stub_llm(prompt, **kwargs)
+
+        async def failing_upsert_nodes(nodes):
+            raise RuntimeError("graph down")
+
+        # one LLM call per chunk, the stalled ones hold every scheduler slot
+        rag = self._stub_rag(llm_model_func=stalling_llm, entity_extract_max_gleaning=0)
+        rag.chunk_entity_relation_graph.upsert_nodes = failing_upsert_nodes
+        docs = [" ".join(f"Line {i} about Kochi." for i in range(200))]
+        with self.assertRaisesRegex(RuntimeError, "graph down"):
+            asyncio.run(asyncio.wait_for(rag.ainsert(docs), timeout=10))
+        print("Success: merge error raised while extraction was stalled.")
+
+    def test_summaries_deferred_to_end_of_insert(self):
+        print("\n[Test] Micro-batches don't re-summarize the same entities...")
+        summary_prompts = []
+
+        async def varied_llm(prompt, **kwargs):
+            if "-Data-" in prompt:
+                summary_prompts.append(prompt)
+                return "A single summary."
+            result = await stub_llm(prompt, **kwargs)
+            if "-Real Data-" in prompt:
+                # every chunk's descriptions differ, so the merged ones grow long
+                line = prompt.split("Text: ", 1)[1].split(":")[0]
+                result = result.replace('."', f' ({line})."')
+            return result
+
+        merging_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if step == "merging" and stats is not None:
+                merging_stats.update(stats)
+
+        rag = self._stub_rag(
+            llm_model_func=varied_llm,
+            entity_summary_to_max_tokens=20,
+            summary_batch_size=1,
+        )
+        docs = [" ".join(f"Line {i}: Kochi and Kerala." for i in range(60))]
+        asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+
+        graph = rag.chunk_entity_relation_graph._graph
+        descriptions = [graph.nodes[n]["description"] for n in graph.nodes] + [
+            graph.edges['"KERALA"', '"KOCHI"']["description"]
+        ]
+        self.assertEqual(descriptions, ["A single summary."] * 3)
+        self.assertGreater(merging_stats["items"], 4)
+        # two entities and their relationship, once each for the whole insert
+        self.assertEqual(len(summary_prompts), 3)
+        self.assertEqual(merging_stats["summarized"], 3)
+        print(
+            f"Success: {len(summary_prompts)} summaries for {merging_stats['items']} chunks"
+        )
+
+    def test_resume_from_extraction_checkpoints(self):
+        print("\n[Test] Restarted insert reuses extraction checkpoints...")
+        calls = []
+
+        async def flaky_llm(prompt, **kwargs):
+            calls.append(prompt)
+            if len(calls) > 20:
+                raise RuntimeError("quota exhausted")
+            return await stub_llm(prompt, **kwargs)
+
+        docs = [" ".join(f"Line {i} about Kochi and Kerala." for i in range(150))]
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self._stub_rag(llm_model_func=flaky_llm).ainsert(docs))
+
+        # a fresh instance, as after a server restart
+        rag = self._stub_rag()
+        checkpointed = set(rag.extraction_checkpoints._data)
+        self.assertGreater(len(checkpointed), 0)
+
+        resumed_calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            resumed_calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=counting_llm)
+        stage_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if stats is not None:
+                stage_stats[step] = stats
+
+        asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+        n_chunks = len(rag.text_chunks._data)
+        self.assertEqual(
+            stage_stats["extracting_entities"]["skipped"], len(checkpointed)
+        )
+        # first pass + one gleaning call for every chunk without a checkpoint
+        self.assertEqual(len(resumed_calls), 2 * (n_chunks - len(checkpointed)))
+        sources = rag.chunk_entity_relation_graph._graph.nodes['"KOCHI"']["source_id"]
+        self.assertEqual(set(sources.split("<SEP>")), set(rag.text_chunks._data))
+        self.assertEqual(
+            set(rag.extraction_checkpoints._data), set(rag.text_chunks._data)
+        )
+        print(
+            f"Success: resumed with {len(checkpointed)}/{n_chunks} chunks checkpointed."
+        )
+
+    def test_checkpoints_of_other_extraction_settings_are_ignored(self):
+        print(
+            "\n[Test] Checkpoints are only reused under the same extraction settings..."
+        )
+        calls = []
+
+        async def flaky_llm(prompt, **kwargs):
+            calls.append(prompt)
+            if len(calls) > 20:
+                raise RuntimeError("quota exhausted")
+            return await stub_llm(prompt, **kwargs)
+
+        docs = [" ".join(f"Line {i} about Kochi and Kerala." for i in range(150))]
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self._stub_rag(llm_model_func=flaky_llm).ainsert(docs))
+
+        resumed_calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            resumed_calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        # resumed without gleaning: the checkpoints were extracted with it
+        rag = self._stub_rag(llm_model_func=counting_llm, entity_extract_max_gleaning=0)
+        checkpointed = set(rag.extraction_checkpoints._data)
+        self.assertGreater(len(checkpointed), 0)
+        stage_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if stats is not None:
+                stage_stats[step] = stats
+
+        asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+        extract_stats = stage_stats["extracting_entities"]
+        self.assertNotIn("skipped", extract_stats)
+        self.assertEqual(extract_stats["stale_checkpoints"], len(checkpointed))
+        self.assertEqual(len(resumed_calls), len(rag.text_chunks._data))
+        print(f"Success: {len(checkpointed)} stale checkpoints re-extracted.")
+
+    def test_packed_extraction_matches_per_chunk_graph(self):
+        print("\n[Test] Packed and streamed extraction build the same graph...")
+        d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+        prompts = []
+
+        def records_for(text):
+            names = [n for n in ("KOCHI", "MUNNAR", "KERALA") if n.title() in text]
+            return [
+                f'("entity"{d}"{n}"{d}"location"{d}"{n.title()}, seen in: {text.strip()[:30]}")'
+                for n in names
+            ] + [
+                f'("relationship"{d}"{n}"{d}"KERALA"{d}"{n.title()} is in Kerala."{d}"state"{d}1)'
+                for n in names
+                if n != "KERALA"
+            ]
+
+        async def mention_llm(prompt, history_messages=[], stream=False, **kwargs):
+            output = await mention_output(prompt, history_messages)
+            if not stream:
+                return output
+
+            # a few characters at a time, splitting the delimiters too
+            async def pieces():
+                for i in range(0, len(output), 3):
+                    await asyncio.sleep(0)
+                    yield output[i : i + 3]
+
+            return pieces()
+
+        async def mention_output(prompt, history_messages):
+            prompts.append(prompt)
+            if history_messages:
+                return "no"
+            text = prompt.split("-Real Data-")[1].split("Text: ", 1)[1]
+            text = text.rsplit("######################", 1)[0]
+            marker = f'("text"{d}'
+            if marker not in text:
+                return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records_for(text))
+            sections = text.split(marker)[1:]
+            records = []
+            for i, section in enumerate(sections):
+                text_id, section_text = section.split(")", 1)
+                # the LLM drops the last text of bigger packs
+                if len(sections) >= 3 and i == len(sections) - 1:
+                    continue
+                records.append(f"{marker}{text_id})")
+                records.extend(records_for(section_text))
+            return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+
+        docs = [
+            " ".join(f"Kochi in Kerala, stop {i}." for i in range(40)),
+            " ".join(f"Munnar in Kerala, estate {i}." for i in range(40)),
+        ]
+        graphs = {}
+        for pack_size, stream in ((1, False), (4, False), (1, True), (4, True)):
+            shutil.rmtree(self.test_dir)
+            rag = self._stub_rag(
+                llm_model_func=mention_llm,
+                extraction_pack_size=pack_size,
+                stream_extraction=stream,
+                # keep every description so both graphs can be compared as is
+                entity_summary_to_max_tokens=100000,
+            )
+            prompts.clear()
+            stage_stats = {}
+
+            async def progress_callback(step, stats=None):
+                if stats is not None:
+                    stage_stats[step] = stats
+
+            asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+            graph = rag.chunk_entity_relation_graph._graph
+            graphs[pack_size, stream] = (
+                {
+                    n: (
+                        sorted(a["source_id"].split("<SEP>")),
+                        sorted(a["description"].split("<SEP>")),
+                    )
+                    for n, a in graph.nodes(data=True)
+                },
+                {
+                    tuple(sorted(e)): sorted(a["source_id"].split("<SEP>"))
+                    for *e, a in graph.edges(data=True)
+                },
+            )
+            n_chunks = len(rag.text_chunks._data)
+            if pack_size == 1:
+                self.assertEqual(
+                    stage_stats["extracting_entities"]["prompts"], n_chunks
+                )
+            else:
+                self.assertLess(stage_stats["extracting_entities"]["prompts"], n_chunks)
+                self.assertIn(f'("text"{d}2)', "".join(prompts))
+        for config in graphs:
+            self.assertEqual(graphs[config], graphs[1, False])
+        print(f"Success: same graph with {len(graphs[1, False][0])} nodes every way.")
+
+    def test_adaptive_gleaning(self):
+        print("\n[Test] Adaptive gleaning skips or merges round trips...")
+        d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+        calls = []
+
+        async def gleaning_llm(prompt, history_messages=[], **kwargs):
+            calls.append(prompt)
+            if not history_messages:
+                return await stub_llm(prompt)
+            self.assertIn("more_entities", prompt)
+            # one more round asked for on the first glean only
+            more = "YES" if len(history_messages) == 2 else "NO"
+            return (
+                f'("entity"{d}"MUNNAR"{d}"location"{d}"A hill station.")'
+                + PROMPTS["DEFAULT_RECORD_DELIMITER"]
+                + f'("more_entities"{d}{more})'
+            )
+
+        def run(docs, **kwargs):
+            shutil.rmtree(self.test_dir, ignore_errors=True)
+            calls.clear()
+            stage_stats = {}
+
+            async def progress_callback(step, stats=None):
+                if stats is not None:
+                    stage_stats[step] = stats
+
+            rag = self._stub_rag(
+                llm_model_func=gleaning_llm,
+                adaptive_gleaning=True,
+                entity_extract_max_gleaning=3,
+                **kwargs,
+            )
+            asyncio.run(rag.ainsert(docs, progress_callback=progress_callback))
+            return rag, stage_stats["extracting_entities"]
+
+        docs = [" ".join(f"Line {i} about Kochi and Kerala." for i in range(60))]
+        rag, stats = run(docs, gleaning_min_chunk_tokens=100)
+        n_chunks = len(rag.text_chunks._data)
+        self.assertEqual(stats["gleaning_skipped_short"], n_chunks)
+        self.assertEqual(len(calls), n_chunks)
+
+        # three records in a 40 token chunk is a high yield
+        rag, stats = run(docs, gleaning_min_chunk_tokens=0, gleaning_skip_yield=0.05)
+        self.assertEqual(stats["gleaning_skipped_yield"], n_chunks)
+
+        # otherwise: first pass, a glean that asks for more, a glean that stops;
+        # no loop-check calls
+        rag, stats = run(docs, gleaning_min_chunk_tokens=0, gleaning_skip_yield=1.0)
+        self.assertEqual(stats["gleaning_stopped_by_model"], n_chunks)
+        self.assertEqual(stats["gleaning_rounds"], 2 * n_chunks)
+        self.assertEqual(len(calls), 3 * n_chunks)
+        graph = rag.chunk_entity_relation_graph._graph
+        self.assertIn('"MUNNAR"', graph.nodes)
+        self.assertNotIn('"MORE_ENTITIES"', graph.nodes)
+        print(f"Success: {n_chunks} chunks, stats {stats}")
+
+    def test_concurrent_inserts_merge_every_chunk(self):
+        print("\n[Test] Concurrent inserts sharing entities...")
+        # a summary LLM call in every merge gives the inserts room to interleave
+        rag = self._stub_rag(entity_summary_to_max_tokens=1)
+
+        async def insert_both():
+            await asyncio.gather(
+                *(
+                    rag.ainsert(
+                        " ".join(
+                            f"Batch {b} line {i}: Kochi ferry {i}." for i in range(60)
+                        )
+                    )
+                    for b in range(2)
+                )
+            )
+
+        asyncio.run(insert_both())
+        n_chunks = len(rag.text_chunks._data)
+        graph = rag.chunk_entity_relation_graph._graph
+        # both inserts merged into the same nodes and edge without losing a chunk
+        for node in ('"KOCHI"', '"KERALA"'):
+            self.assertEqual(
+                len(graph.nodes[node]["source_id"].split("<SEP>")), n_chunks
+            )
+        edge = graph.edges['"KERALA"', '"KOCHI"']
+        self.assertEqual(len(edge["source_id"].split("<SEP>")), n_chunks)
+        self.assertEqual(edge["weight"], 2 * n_chunks)
+        self.assertEqual(len(rag.chunk_entity_relation_graph._merge_locks), 0)
+        print(f"Success: {n_chunks} chunks from two concurrent inserts")
+
+    def test_low_information_chunks_skip_extraction(self):
+        print("\n[Test] Low-information chunks are embedded but not extracted...")
+        from malrag.chunk_filter import chunk_information_score
+
+        self.assertLess(chunk_information_score("Page 3 of 12"), 0.25)
+        self.assertLess(
+            chunk_information_score(
+                "Operations  450  320\nMaintenance  120  150\nTotal  700  575"
+            ),
+            0.25,
+        )
+        self.assertLess(chunk_information_score("|| ~~ ; ,, . 1 ' _ -- |"), 0.25)
+        self.assertGreater(
+            chunk_information_score(
+                "കൊച്ചി മെട്രോ ആലുവയിൽ നിന്ന് പേട്ടയിലേക്ക് സർവീസ് നടത്തുന്നു. യാത്രക്കാരുടെ എണ്ണം വർധിച്ചു."
+            ),
+            0.25,
+        )
+
+        calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=counting_llm, min_chunk_information=0.25)
+        stage_stats = {}
+
+        async def progress_callback(step, stats=None):
+            if stats is not None:
+                stage_stats[step] = stats
+
+        prose = " ".join(f"Line {i} about Kochi and Kerala." for i in range(20))
+        table = "\n".join(f"{i}  {i * 37}  {i * 91}  {i * 13}" for i in range(1, 60))
+        asyncio.run(rag.ainsert([prose, table], progress_callback=progress_callback))
+
+        n_chunks = len(rag.text_chunks._data)
+        skipped = stage_stats["chunking"]["low_information"]
+        self.assertGreater(skipped, 0)
+        self.assertEqual(
+            stage_stats["extracting_entities"]["items"], n_chunks - skipped
+        )
+        self.assertEqual(len(calls), 2 * (n_chunks - skipped))
+        # still there for naive retrieval
+        self.assertEqual(len(rag.chunks_vdb.client_storage["data"]), n_chunks)
+        sources = rag.chunk_entity_relation_graph._graph.nodes['"KOCHI"']["source_id"]
+        self.assertEqual(len(sources.split("<SEP>")), n_chunks - skipped)
+        print(f"Success: {skipped} of {n_chunks} chunks skipped extraction.")
+
+    def test_low_information_document_is_stored(self):
+        print("\n[Test] A document without any extracted entity is still stored...")
+        calls = []
+
+        async def counting_llm(prompt, **kwargs):
+            calls.append(prompt)
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=counting_llm, min_chunk_information=0.25)
+        table = "\n".join(f"{i}  {i * 37}  {i * 91}  {i * 13}" for i in range(1, 60))
+        asyncio.run(rag.ainsert(table))
+
+        self.assertEqual(calls, [])
+        doc_id = compute_mdhash_id(table, prefix="doc-")
+        self.assertIn(doc_id, rag.full_docs._data)
+        chunk_ids = set(rag.doc_chunks._data[doc_id]["chunk_ids"])
+        self.assertEqual(set(rag.text_chunks._data), chunk_ids)
+        self.assertEqual(
+            {d["__id__"] for d in rag.chunks_vdb.client_storage["data"]}, chunk_ids
+        )
+
+        # not processed again, and deletable
+        asyncio.run(rag.ainsert(table))
+        self.assertEqual(calls, [])
+        self.assertTrue(asyncio.run(rag.adelete_by_doc_id(doc_id)))
+        self.assertEqual(rag.text_chunks._data, {})
+        self.assertEqual(rag.chunks_vdb.client_storage["data"], [])
+        print(f"Success: {len(chunk_ids)} chunks stored without graph records.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+import asyncio
+import unittest
+
+from stub_rag import StubRagTestCase, stub_embedding, stub_llm
+
+from malrag.base import QueryParam
+from malrag.scheduler import (
+    PriorityScheduler,
+    SingleFlight,
+    current_priority,
+    llm_priority,
+)
+from malrag.utils import ConcurrencyLimiter
+
+
+class TestPriorityScheduler(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+
+    async def call(self, name, seconds=0.02):
+        self.order.append(name)
+        await asyncio.sleep(seconds)
+
+    def test_weighted_priorities(self):
+        async def weighted():
+            scheduler = PriorityScheduler(1, {"interactive": 2, "ingestion": 1})
+            func = scheduler.wrap(self.call)
+            blocker = asyncio.create_task(func("first"))
+            await asyncio.sleep(0)
+            tasks = [asyncio.create_task(func("ingestion")) for _ in range(4)]
+            with llm_priority("interactive"):
+                tasks += [asyncio.create_task(func("interactive")) for _ in range(4)]
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.stats()["ingestion"]["queued"], 4)
+            await asyncio.gather(blocker, *tasks)
+            return scheduler.stats()
+
+        stats = asyncio.run(weighted())
+        # two interactive calls per ingestion call while both wait
+        self.assertEqual(self.order[1:7].count("ingestion"), 2)
+        self.assertEqual(self.order[7:], ["ingestion"] * 2)
+        self.assertEqual(stats["interactive"]["completed"], 4)
+        self.assertEqual(stats["ingestion"]["max_queued"], 4)
+
+    def test_reserved_slots(self):
+        async def reserved():
+            scheduler = PriorityScheduler(3, reserved={"interactive": 1})
+            func = scheduler.wrap(self.call)
+            tasks = [asyncio.create_task(func("ingestion", 0.2)) for _ in range(10)]
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.stats()["ingestion"]["in_flight"], 2)
+            with llm_priority("interactive"):
+                started = asyncio.get_running_loop().time()
+                await func("interactive")
+                waited = asyncio.get_running_loop().time() - started
+            await asyncio.gather(*tasks)
+            return waited
+
+        self.assertLess(asyncio.run(reserved()), 0.1)
+
+    def test_stream_keeps_its_slot_until_read(self):
+        scheduler = PriorityScheduler(1)
+
+        async def streamed(name):
+            async def inner():
+                for part in (name, "!"):
+                    await asyncio.sleep(0.02)
+                    yield part
+
+            return inner()
+
+        async def read(stream):
+            return "".join([part async for part in stream])
+
+        async def streams():
+            wrapped = scheduler.wrap(streamed)
+            first = await wrapped("a")
+            second = asyncio.create_task(wrapped("b"))
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.stats()["ingestion"]["queued"], 1)
+            self.assertEqual(await read(first), "a!")
+            self.assertEqual(await read(await second), "b!")
+            third = await wrapped("c")
+            await third.aclose()
+            return scheduler.stats()["ingestion"]
+
+        stats = asyncio.run(streams())
+        self.assertEqual((stats["in_flight"], stats["completed"]), (0, 3))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_leaving_callers_errors_and_cancellation(self):
+        flight = SingleFlight()
+        started = []
+
+        async def slow(x):
+            started.append(x)
+            await asyncio.sleep(0.05)
+            if x == "boom":
+                raise RuntimeError(x)
+            return x
+
+        func = flight.wrap(slow)
+
+        async def edge_cases():
+            # the first caller leaving doesn't cancel the call for the others
+            first = asyncio.create_task(func("a"))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(func("a"))
+            await asyncio.sleep(0)
+            first.cancel()
+            self.assertEqual(await second, "a")
+            # an error reaches every caller
+            results = await asyncio.gather(
+                func("boom"), func("boom"), return_exceptions=True
+            )
+            self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+            # the call is cancelled once nobody waits for it
+            lonely = asyncio.create_task(func("b"))
+            await asyncio.sleep(0)
+            lonely.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(flight.stats()["in_flight"], 0)
+
+        asyncio.run(edge_cases())
+        self.assertEqual(started, ["a", "boom", "b"])
+        self.assertEqual(flight.stats()["coalesced"], 2)
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_fifo_and_exception_safe(self):
+        order = []
+        limiter = ConcurrencyLimiter(2)
+
+        async def call(i):
+            async with limiter:
+                order.append(i)
+                await asyncio.sleep(0.01)
+                if i % 3 == 0:
+                    raise RuntimeError("provider error")
+                return i
+
+        async def run():
+            results = await asyncio.gather(
+                *[call(i) for i in range(12)], return_exceptions=True
+            )
+            # errors gave their slots back
+            self.assertEqual(limiter.in_flight, 0)
+            self.assertEqual(await call(1), 1)
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(order[:12], list(range(12)))
+        self.assertEqual(sum(isinstance(r, RuntimeError) for r in results), 4)
+        stats = limiter.stats()
+        self.assertEqual(stats["completed"], 13)
+        self.assertEqual(stats["max_queued"], 10)
+        self.assertGreater(stats["max_wait_seconds"], 0)
+
+        async def cancel_waiter():
+            task = asyncio.create_task(call(2))
+            blockers = [asyncio.create_task(call(4)) for _ in range(2)]
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(call(5))
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.queued, 2)
+            waiter.cancel()
+            await asyncio.gather(task, *blockers, return_exceptions=True)
+            self.assertEqual((limiter.in_flight, limiter.queued), (0, 0))
+
+        asyncio.run(cancel_waiter())
+
+
+class TestSchedulingThroughMalRag(StubRagTestCase):
+    def test_llm_calls_carry_their_priority(self):
+        print("\n[Test] Inserts run as ingestion, queries as interactive...")
+        priorities = []
+
+        async def recording_llm(prompt, **kwargs):
+            priorities.append(current_priority.get())
+            return await stub_llm(prompt, **kwargs)
+
+        rag = self._stub_rag(llm_model_func=recording_llm)
+        asyncio.run(rag.ainsert(["Kochi and Kerala. " * 30]))
+        self.assertEqual(set(priorities), {"ingestion"})
+        priorities.clear()
+        rag.query("Where is Kochi?", QueryParam(mode="local"))
+        self.assertEqual(set(priorities), {"interactive"})
+        self.assertEqual(rag.scheduler_stats()["llm"]["interactive"]["completed"], 1)
+        print("Success: every call ran under the priority of its caller.")
+
+    def test_single_flight_coalesces_identical_calls(self):
+        print("\n[Test] Concurrent identical calls share one request...")
+        llm_calls, embedding_calls = [], []
+
+        async def counting_llm(prompt, **kwargs):
+            llm_calls.append(prompt)
+            if kwargs.get("keyword_extraction"):
+                await asyncio.sleep(0.01)
+                return '{"high_level_keywords": ["place"], "low_level_keywords": ["Kochi"]}'
+            return await stub_llm(prompt, **kwargs)
+
+        async def counting_embedding(texts):
+            embedding_calls.append(texts)
+            return await stub_embedding(texts)
+
+        rag = self._stub_rag(llm_model_func=counting_llm)
+        rag.embedding_func = rag.embedding_single_flight.wrap(counting_embedding)
+        rag.chunks_vdb.embedding_func = rag.entities_vdb.embedding_func = (
+            rag.embedding_func
+        )
+        rag.relationships_vdb.embedding_func = rag.embedding_func
+
+        async def same_question(n):
+            return await asyncio.gather(
+                *[
+                    rag.aquery("Where is Kochi?", QueryParam(mode="local"))
+                    for _ in range(n)
+                ]
+            )
+
+        answers = asyncio.run(same_question(5))
+        self.assertTrue(all(answer == answers[0] for answer in answers))
+        # one keyword extraction, one query embedding and one answer for all five
+        self.assertEqual(len(llm_calls), 2)
+        self.assertEqual(len(embedding_calls), 1)
+        stats = rag.scheduler_stats()["single_flight"]
+        self.assertEqual((stats["llm"]["calls"], stats["llm"]["coalesced"]), (10, 8))
+        self.assertEqual(stats["embedding"]["coalesced"], 4)
+        # once the call is done the next one is a new request
+        asyncio.run(same_question(1))
+        self.assertEqual(len(llm_calls), 4)
+        print(f"Success: {stats}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import shutil
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(".")
+from malrag.storage import (
+    JsonKVStorage,
+    NanoVectorDBStorage,
+    NetworkXStorage,
+    WriteAheadLog,
+)
+from malrag.utils import EmbeddingFunc
+
+
+async def stub_embedding(texts):
+    return np.array([[len(t), 1.0, 0.5, 0.25] for t in texts])
+
+
+EMBEDDING_FUNC = EmbeddingFunc(
+    embedding_dim=4, max_token_size=8192, func=stub_embedding
+)
+
+
+class TestStorageWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = "./test_wal_data"
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir)
+        self.global_config = {"working_dir": self.test_dir, "embedding_batch_num": 8}
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def _kv(self):
+        return JsonKVStorage(
+            namespace="docs", global_config=self.global_config, embedding_func=None
+        )
+
+    def test_kv_appends_changes_and_replays_them(self):
+        print("\n[Test] JsonKV writes the log, not the snapshot...")
+        kv = self._kv()
+        asyncio.run(kv.upsert({"a": {"content": "one"}}))
+        asyncio.run(kv.index_done_callback())
+        snapshot = kv._file_name
+        with open(snapshot) as f:
+            first_snapshot = f.read()
+
+        asyncio.run(kv.upsert({"b": {"content": "two"}, "c": {"content": "three"}}))
+        asyncio.run(kv.delete(["a"]))
+        asyncio.run(kv.index_done_callback())
+        with open(snapshot) as f:
+            self.assertEqual(f.read(), first_snapshot)
+        self.assertTrue(os.path.exists(snapshot + ".wal"))
+
+        restarted = self._kv()
+        self.assertEqual(
+            restarted._data, {"b": {"content": "two"}, "c": {"content": "three"}}
+        )
+        print("Success: snapshot untouched, changes recovered from the log.")
+
+    def test_kv_ignores_torn_last_record(self):
+        print("\n[Test] A torn log record is skipped on replay...")
+        kv = self._kv()
+        asyncio.run(kv.upsert({"a": {"content": "one"}}))
+        asyncio.run(kv.index_done_callback())
+        asyncio.run(kv.upsert({"b": {"content": "two"}}))
+        asyncio.run(kv.index_done_callback())
+        with open(kv._file_name + ".wal", "a") as f:
+            f.write('{"op": "upsert", "data": {"c"')
+
+        self.assertEqual(set(self._kv()._data), {"a", "b"})
+        print("Success: replay stopped at the torn record.")
+
+    def test_compaction_folds_log_into_snapshot(self):
+        print("\n[Test] Log is compacted once it outgrows the snapshot...")
+        self.global_config["wal_compaction_ratio"] = 0.5
+        original_min = WriteAheadLog.min_compaction_bytes
+        WriteAheadLog.min_compaction_bytes = 0
+        try:
+            kv = self._kv()
+            asyncio.run(kv.upsert({"a": {"content": "x" * 100}}))
+            asyncio.run(kv.index_done_callback())
+            asyncio.run(kv.upsert({"b": {"content": "y" * 100}}))
+            asyncio.run(kv.index_done_callback())
+        finally:
+            WriteAheadLog.min_compaction_bytes = original_min
+        self.assertFalse(os.path.exists(kv._file_name + ".wal"))
+        self.assertEqual(set(self._kv()._data), {"a", "b"})
+        print("Success: log compacted into the snapshot.")
+
+    def test_graph_and_vectors_recover_from_log(self):
+        print("\n[Test] Graph and vector changes survive a restart...")
+
+        def open_storages():
+            graph = NetworkXStorage(
+                namespace="chunk_entity_relation", global_config=self.global_config
+            )
+            vdb = NanoVectorDBStorage(
+                namespace="entities",
+                global_config=self.global_config,
+                embedding_func=EMBEDDING_FUNC,
+                meta_fields={"entity_name"},
+            )
+            return graph, vdb
+
+        async def first_run(graph, vdb):
+            await graph.upsert_node(
+                '"KOCHI"', {"entity_type": "GEO", "description_tokens": 3}
+            )
+            await vdb.upsert({"ent-1": {"content": "Kochi", "entity_name": '"KOCHI"'}})
+            await graph.index_done_callback()
+            await vdb.index_done_callback()
+            await graph.upsert_node('"KERALA"', {"entity_type": "GEO"})
+            await graph.upsert_edge('"KOCHI"', '"KERALA"', {"weight": 2.0})
+            await graph.delete_node('"KOCHI"')
+            await graph.upsert_node('"KOCHI"', {"entity_type": "CITY"})
+            await vdb.upsert(
+                {
+                    "ent-1": {"content": "Kochi city", "entity_name": '"KOCHI"'},
+                    "ent-2": {"content": "Kerala", "entity_name": '"KERALA"'},
+                }
+            )
+            await vdb.delete_entity("unknown")
+            await graph.index_done_callback()
+            await vdb.index_done_callback()
+
+        graph, vdb = open_storages()
+        asyncio.run(first_run(graph, vdb))
+        expected_matrix = vdb.client_storage["matrix"].copy()
+
+        graph, vdb = open_storages()
+        self.assertEqual(
+            dict(graph._graph.nodes(data=True)),
+            {
+                '"KERALA"': {"entity_type": "GEO"},
+                '"KOCHI"': {"entity_type": "CITY"},
+            },
+        )
+        self.assertEqual(graph._graph.number_of_edges(), 0)
+        self.assertEqual(
+            [d["__id__"] for d in vdb.client_storage["data"]], ["ent-1", "ent-2"]
+        )
+        np.testing.assert_allclose(
+            vdb.client_storage["matrix"], expected_matrix, rtol=1e-6
+        )
+        print("Success: graph and vectors match after replay.")
+
+
+if __name__ == "__main__":
+    unittest.main()
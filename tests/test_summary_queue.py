@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+
+from stub_rag import StubRagTestCase, stub_llm
+
+from malrag.prompt import PROMPTS
+
+
+class TestSummaryQueue(StubRagTestCase):
+    def test_deferred_summaries_are_batched(self):
+        print("\n[Test] Deferred, batched description summaries...")
+        d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+        summary_prompts = []
+
+        async def summarizing_llm(prompt, **kwargs):
+            if "-Data-" not in prompt:
+                return await stub_llm(prompt, **kwargs)
+            summary_prompts.append(prompt)
+            if "Item 1" not in prompt:
+                return "A single summary."
+            n_items = prompt.count("Description List:")
+            return PROMPTS["DEFAULT_RECORD_DELIMITER"].join(
+                f'("summary"{d}{i}{d}"Summary {i}.")' for i in range(1, n_items + 1)
+            )
+
+        # every chunk's descriptions differ, so the merged ones grow long
+        async def varied_llm(prompt, **kwargs):
+            result = await summarizing_llm(prompt, **kwargs)
+            if "-Real Data-" in prompt:
+                line = prompt.split("Text: ", 1)[1].split(":")[0]
+                result = result.replace('."', f' ({line})."')
+            return result
+
+        rag = self._stub_rag(
+            llm_model_func=varied_llm,
+            entity_summary_to_max_tokens=20,
+            defer_summaries=True,
+            summary_batch_size=2,
+        )
+        docs = [" ".join(f"Line {i}: Kochi and Kerala." for i in range(60))]
+
+        async def insert_then_summarize():
+            await rag.ainsert(docs)
+            # the insert returned before any summary was written
+            graph = rag.chunk_entity_relation_graph._graph
+            self.assertEqual(summary_prompts, [])
+            self.assertIn("<SEP>", graph.nodes['"KOCHI"']["description"])
+            # two entities and their relationship
+            self.assertEqual(await rag.asummary_backlog(), 3)
+            self.assertEqual(await rag.asummarize_pending(), 3)
+
+        asyncio.run(insert_then_summarize())
+        graph = rag.chunk_entity_relation_graph._graph
+        descriptions = [graph.nodes[n]["description"] for n in graph.nodes] + [
+            graph.edges['"KERALA"', '"KOCHI"']["description"]
+        ]
+        self.assertEqual(
+            sorted(descriptions), ["A single summary.", "Summary 1.", "Summary 2."]
+        )
+        self.assertEqual(rag.summary_backlog(), 0)
+        # two descriptions per prompt
+        self.assertEqual(len(summary_prompts), 2)
+        print(f"Success: {len(summary_prompts)} summary prompts after the insert")
+
+
+if __name__ == "__main__":
+    unittest.main()
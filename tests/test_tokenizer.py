@@ -0,0 +1,74 @@
+import sys
+import unittest
+
+sys.path.append(".")
+from malrag.operate import chunking_by_token_size
+from malrag.utils import decode_tokens_by_tiktoken, encode_string_by_tiktoken
+
+
+class TestTokenizer(unittest.TestCase):
+    def test_chunking_matches_window_decode(self):
+        print("\n[Test] Offset chunking matches per-window decode...")
+        text = "കേരളം ഒരു സംസ്ഥാനമാണ്. Kochi Metro runs daily. " * 80
+        chunks = chunking_by_token_size(
+            text, overlap_token_size=7, max_token_size=50, tiktoken_model="gpt2"
+        )
+        tokens = encode_string_by_tiktoken(text, model_name="gpt2")
+        expected = [
+            {
+                "tokens": min(50, len(tokens) - start),
+                "content": decode_tokens_by_tiktoken(
+                    tokens[start : start + 50], model_name="gpt2"
+                ).strip(),
+                "chunk_order_index": index,
+            }
+            for index, start in enumerate(range(0, len(tokens), 50 - 7))
+        ]
+        self.assertEqual(chunks, expected)
+        print(f"Success: {len(chunks)} chunks identical to decoded windows.")
+
+    def test_stored_token_counts_name_their_tokenizer(self):
+        print("\n[Test] Stored token counts are recounted under another tokenizer...")
+        from malrag.operate import needs_summary
+        from malrag.tokenizer import get_tokenizer
+        from malrag.utils import truncate_list_by_token_size
+
+        tokenizer = get_tokenizer("gemini")
+        description = "Kochi is a port city on the south-west coast of India."
+        node = {"description": description}
+        node.update(tokenizer.count_fields(description, "description_tokens"))
+        self.assertEqual(node["description_tokenizer"], "gemini")
+        self.assertEqual(
+            tokenizer.stored_count(node, "description_tokens"),
+            tokenizer.count(description),
+        )
+
+        # counted by another tokenizer, or before the name was stored
+        stale = {
+            **node,
+            "description_tokens": 1,
+            "description_tokenizer": "tiktoken:gpt2",
+        }
+        legacy = {"description": description, "description_tokens": 1}
+        for data in (stale, legacy):
+            self.assertIsNone(tokenizer.stored_count(data, "description_tokens"))
+            self.assertTrue(
+                needs_summary(
+                    data, {"tokenizer": "gemini", "entity_summary_to_max_tokens": 10}
+                )
+            )
+        self.assertEqual(
+            truncate_list_by_token_size(
+                [stale, legacy, node],
+                key=lambda x: x["description"],
+                max_token_size=20,
+                tokenizer=tokenizer,
+                token_key=lambda x: tokenizer.stored_count(x, "description_tokens"),
+            ),
+            [stale],
+        )
+        print("Success: counts from other tokenizers are not trusted.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -31,6 +31,16 @@ def mock_rag_engine():
                 await progress_callback("indexing")
         
         mock_rag.ainsert = AsyncMock(side_effect=mock_ainsert)
+
+        async def mock_aupdate_document(doc_key, content, progress_callback=None):
+            await mock_ainsert(content, progress_callback=progress_callback)
+            return {"doc_id": "doc-test", "previous_doc_id": None, "chunks_kept": 0, "chunks_added": 1, "chunks_removed": 0}
+
+        mock_rag.aupdate_document = AsyncMock(side_effect=mock_aupdate_document)
+        mock_rag.asummary_backlog = AsyncMock(return_value=2)
+        mock_rag.scheduler_stats = MagicMock(
+            return_value={"llm": {"ingestion": {"queued": 3, "in_flight": 16}}}
+        )
         
         # Mock insert for synchronous calls if needed
         mock_rag.insert = MagicMock()
@@ -79,6 +89,8 @@ def test_file_upload_flow(mock_rag_engine):
                 job_details = status_data["data"]
                 assert job_details["step"] == "ready"
                 assert job_details["progress"] == 100
+                assert job_details["summary_backlog"] == 2
+                assert job_details["llm_queues"]["llm"]["ingestion"]["queued"] == 3
                 break
             
             if status_data["status"] == "failed":